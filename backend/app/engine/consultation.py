@@ -0,0 +1,223 @@
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from app.engine.orchestrator import Question
+from app.engine.phase2 import detect_test_type
+from app.engine.turn import next_reply
+from app.models.case_state import CaseState
+from app.utils.session_store import SessionConflict
+
+# --- SESSION OPERATIONS ---
+# What /chat and /upload do to a stored session, written against any session store so they run
+# the same in the web server (its own store) and in an engine process (app.engine.pool, which
+# owns a share of the sessions).
+
+SESSION_EXPIRED = "This consultation has expired after a long period of inactivity. Please start a new one."
+SESSION_EVICTED = "This consultation was dropped because the service was holding too many at once. Please start a new one."
+
+
+class ChatResponse(BaseModel):
+    reply: str
+    options: List[str] = []
+    state: Optional[Dict] = None # Full state, when the client's copy cannot be patched
+    multi_select: bool = False
+    version: int = 0 # State version this reply brings the client to
+    state_patch: Optional[List[Dict]] = None # JSON-patch ops from the client's state_version to `version`
+
+
+def open_session(sessions, session_id: str) -> CaseState:
+    """The session's state (loaded from the store if it is not in memory), or a new one; 410 once it was dropped."""
+    state = sessions.get(session_id)
+    if state is None:
+        _raise_if_dropped(sessions, session_id)
+        state = CaseState(case_id=session_id)
+    return state
+
+
+def _raise_if_dropped(sessions, session_id: str) -> None:
+    """410 for an id whose session the store dropped, saying whether it idled out or was evicted."""
+    reason = sessions.drop_reason(session_id)
+    if reason is not None:
+        raise HTTPException(status_code=410, detail=SESSION_EVICTED if reason == "evicted" else SESSION_EXPIRED)
+
+
+def next_response(state: CaseState, known_version: Optional[int] = None, reply: Optional[Question] = None) -> ChatResponse:
+    """
+    Replies with `reply`, or the orchestrator's next question (special signals turned into replies).
+    Ends the turn: the state is committed (version bumped if anything changed) and sent as a
+    patch against `known_version` (the client's copy), or in full when it cannot be patched.
+    """
+    if reply is None:
+        reply = next_reply(state)
+    state.commit()
+    patch = state.patch_since(known_version)
+    return ChatResponse(
+        reply=reply.text,
+        options=reply.options,
+        multi_select=reply.multi_select,
+        version=state.version,
+        state=None if patch is not None else state.snapshot(),
+        state_patch=patch,
+    )
+
+
+def apply_state_patch(state: Dict, patch: List[Dict]) -> Dict:
+    """A copy of the state dict `state` with next_response()'s patch ops applied (top-level replace/add/remove)."""
+    state = dict(state)
+    for op in patch:
+        field = op["path"][1:].replace("~1", "/").replace("~0", "~")
+        if op["op"] == "remove":
+            state.pop(field, None)
+        else:
+            state[field] = op["value"]
+    return state
+
+
+def seed_session(sessions, session_id: str, updates: Dict) -> ChatResponse:
+    """A new session pre-filled with `updates` (an intake form), replying with the first question still open."""
+    state = CaseState(case_id=session_id, **updates)
+    response = next_response(state)
+    sessions.put(session_id, state)
+    return response
+
+
+def seed_sessions(sessions, forms: List[Tuple[str, Dict]]) -> List[Optional[ChatResponse]]:
+    """
+    seed_session for each (session_id, updates). None for an id another worker created first
+    (shared store); the other forms are still seeded.
+    """
+    created = []
+    for session_id, updates in forms:
+        try:
+            created.append(seed_session(sessions, session_id, updates))
+        except SessionConflict:
+            created.append(None)
+    return created
+
+
+def attach_document(sessions, session_id: str, filename: str, sha256: Optional[str] = None, size: Optional[int] = None) -> Dict:
+    """
+    Enters an uploaded report in phase2_documents. `sha256`/`size` identify its content in the
+    upload store (app.utils.upload_store); without them (offline replays) the filename stands in.
+    """
+    return attach_documents(sessions, session_id, [(filename, sha256, size)])[0]
+
+
+def attach_documents(sessions, session_id: str, files: List[Tuple[str, Optional[str], Optional[int]]]) -> List[Dict]:
+    """attach_document for several (filename, sha256, size) at once: one result each, one save."""
+    # 1. Get Session
+    state = sessions.get(session_id)
+    if state is None:
+        _raise_if_dropped(sessions, session_id)
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    allowed_normalized = _allowed_tests(state)
+    results = [_attach(state, allowed_normalized, *file) for file in files]
+    if any(result["status"] == "success" and not result.get("duplicate") for result in results):
+        state.mark_dirty("phase2_documents") # In-place edit; picked up by the next chat turn
+        sessions.put(session_id, state)
+    return results
+
+
+# Normalization helper
+def _normalize(s): return s.lower().strip()
+
+
+def _allowed_tests(state: CaseState) -> List[str]:
+    # 3. Validate against Phase 1 History
+    # Construct allowed list
+    allowed_tests = set()
+    if state.tests_done_list:
+        allowed_tests.update(state.tests_done_list)
+    if state.male_tests_done_list:
+        allowed_tests.update(state.male_tests_done_list)
+    return [_normalize(t) for t in allowed_tests]
+
+
+def _attach(state: CaseState, allowed_normalized: List[str], filename: str, sha256: Optional[str], size: Optional[int]) -> Dict:
+    # 2. Detect Test Type
+    test_type = detect_test_type(filename)
+
+    if test_type == "UNKNOWN_TEST":
+        return {
+            "status": "error",
+            "message": "I could not identify the test type from the filename. Please rename it to include the test name (e.g., 'AMH Report.pdf').",
+            "detected_type": None
+        }
+
+    # Mapping for generic terms to allowed
+    # If detected 'Semen Analysis' but user said 'Semen analysis', it matches (logic handles this via lower case checks in extractor usually but here we have normalized strings).
+    # Let's check for containment or direct match.
+    # We need to be careful. If user said "Hormonal blood tests", and uploads "AMH", is it allowed?
+    # Yes, AMH is a hormonal test.
+    # Simple Logic: If "None" is in list, no uploads allowed?
+    # Or strict check?
+    # User feedback: "Validate test is part of Phase 1 tests_done"
+
+    # Heuristic for Validation:
+    # If exact match in allowed_tests -> OK
+    # If test_type is "AMH" and "Hormonal" in allowed -> OK
+    # If test_type is "FSH" and "Hormonal" in allowed -> OK
+
+    valid_upload = False
+
+    type_normalized = _normalize(test_type)
+
+    if type_normalized in allowed_normalized:
+        valid_upload = True
+    else:
+        # Hierarchy Check
+        hormonal_subtypes = ["amh", "fsh", "lh", "tsh", "prolactin", "estradiol"]
+        if type_normalized in hormonal_subtypes and any("hormonal" in t for t in allowed_normalized):
+            valid_upload = True
+
+        if type_normalized == "semen analysis" and any("semen" in t for t in allowed_normalized):
+            valid_upload = True
+
+        if type_normalized == "hsg" and any("tube" in t for t in allowed_normalized):
+            valid_upload = True
+
+    if not valid_upload:
+         return {
+            "status": "error",
+            "message": f"This test ({test_type}) was not mentioned in your history. I am only entering reports for tests we discussed.",
+            "detected_type": test_type
+        }
+
+    # 4. Update State
+    new_doc = {
+        "test_name": test_type,
+        "filename": filename,
+        "upload_date": date.today().isoformat(),
+        "test_date": None, # Pending user input
+        "validity_status": None,
+        "sha256": sha256,
+        "size": size,
+    }
+
+    # Avoid Duplicates: the same content under any name (earlier files of the same batch included);
+    # a different file under a used name is kept
+    duplicate = next((d for d in state.phase2_documents if _same_document(d, filename, sha256)), None)
+    if duplicate is not None:
+        return {
+            "status": "success",
+            "message": f"I already have this {duplicate['test_name']} report ({duplicate['filename']}).",
+            "document": duplicate,
+            "duplicate": True
+        }
+    state.phase2_documents.append(new_doc)
+
+    return {
+        "status": "success",
+        "message": f"Received {test_type}. When was this test done?", # Frontend might display this or orchestrator next turn
+        "document": new_doc
+    }
+
+
+def _same_document(doc: Dict, filename: str, sha256: Optional[str]) -> bool:
+    if sha256 is not None and doc.get("sha256") is not None:
+        return doc["sha256"] == sha256
+    return doc["filename"] == filename # Either side predates content hashes
@@ -1,433 +1,577 @@
-import os
-import json
 import re
-from pathlib import Path
-import google.generativeai as genai
-from dotenv import load_dotenv
-from typing import Dict, Any
+from datetime import date
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+from app.engine.keywords import SCANNER
+from app.engine.orchestrator import STEPS
+from app.utils.dates import parse_date
+from app.utils.confidence import AMBIGUOUS_OWNERSHIP, COMPETING, score_fields, step_confidence
+from app.utils.scanner import Hit, ranked_values
 
-env_path = Path(__file__).resolve().parent.parent.parent / ".env"
-load_dotenv(dotenv_path=env_path)
+# LLM extraction lives in app.engine.llm (optional, off by default); this module is the rule-based pass.
 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# --- PATTERNS ---
+# Compiled once and matched against the lowercased message.
+# `\b(a|b)\b` alternations of single words are answered from the message's word set
+# (frozensets below); the remaining regexes carry the substrings (and whether a digit
+# is needed) that must be present for them to match, so most are skipped with an `in` check.
 
-def extract_clinical_state(message: str, current_state: Dict) -> Dict:
-    """
-    HEURISTIC EXTRACTOR (PHASE 1 - FINAL SPEC)
-    Parses user messages to update the flattened CaseState.
+class Pattern:
+    __slots__ = ("regex", "needles", "needs_digit")
+
+    def __init__(self, regex: str, needles: Tuple[str, ...] = (), needs_digit: bool = False):
+        self.regex = re.compile(regex)
+        self.needles = needles
+        self.needs_digit = needs_digit
+
+
+PARTNER_WORDS = frozenset({"partner", "husband", "wife", "spouse"})
+NO_PARTNER = Pattern(r'\b(no|without|not)\s+(partner|husband|wife|spouse)\b', ("no", "without"))
+DONOR_WORDS = frozenset({"donor"}) # also covers "donor sperm" / "conception using a donor"
+UNSURE_WORDS = frozenset({"exploring", "unsure"})
+NOT_SURE = Pattern(r'\bnot sure\b', ("not sure",))
+
+FEMALE_IS = Pattern(r'female is (\d+)', ("female is",), needs_digit=True)
+MALE_IS = Pattern(r'\bmale is (\d+)', ("male is",), needs_digit=True)
+TWO_DIGITS = Pattern(r'\b\d{2}\b', needs_digit=True)
+SELF_AGE = Pattern(r'\b(i am|i\'m|im|my age is|me)\s*(?:is)?\s*(\d{2})', ("i am", "i'm", "im", "my age is", "me"), needs_digit=True)
+PARTNER_AGE = Pattern(r'\b(husband|he|partner|spouse|she)(?:\'s)?\s*(?:age)?\s*(?:is)?\s*(\d{2})', ("husband", "he", "partner", "spouse"), needs_digit=True)
+SELF_WORDS = frozenset({"im", "me"})
+SELF_PHRASE = Pattern(r'\b(i am|i\'m)\b', ("i am", "i'm"))
+PARTNER_PRONOUNS = frozenset({"partner", "he", "husband", "spouse"})
+
+YES = frozenset({"yes", "yeah", "yep"})
+YES_SHORT = frozenset({"yes", "yeah"})
+NO = frozenset({"no", "nope"})
+
+YEARS = Pattern(r'(\d+(?:\.\d+)?)\s*years?', ("year",), needs_digit=True)
+MONTHS = Pattern(r'(\d+)\s*months?', ("month",), needs_digit=True)
+SOLITARY_NUMBER = Pattern(r'^\s*(\d+(?:\.\d+)?)\s*$', needs_digit=True)
+ZERO_WORDS = frozenset({"0", "zero", "never"})
+NOT_YET = Pattern(r'\bnot yet\b', ("not yet",))
+
+REGULAR = frozenset({"yes", "yeah", "regular"})
+IRREGULAR = frozenset({"no", "nope", "irregular", "varies"})
+CYCLE_RANGE = Pattern(r'\b(21|26|31)[-–—to\s]+', ("21", "26", "31"))
+ANY_TWO_DIGITS = Pattern(r'(\d{2})', needs_digit=True)
+
+CYCLES = Pattern(r'(\d+)\s*cycles', ("cycles",), needs_digit=True)
+
+WORD = re.compile(r'\w+')
+DIGIT = re.compile(r'\d')
+
+class MessageView:
     """
-    
-    system_prompt = """
-    You are an IVF Clinical Data Extractor. Update the flattened JSON state.
-    
-    FIELDS TO EXTRACT (Return as flat keys):
-    - male_partner_type: "Partner", "Donor", "Unsure"
-    - male_partner_present: bool
-    - female_age: int
-    - male_age: int
-    - years_trying: float
-    - has_prior_pregnancies: bool
-    - pregnancy_source: "Natural", "Treatment", "NotSure"
-    - pregnancy_outcome: "Miscarriage", "Ectopic", "Ongoing", "Live birth"
-    - treatment_type: "IVF", "IUI", "Medications", "None"
-    - ivf_cycles: int
-    - iui_cycles: int
-    - tests_done_list: list of strings
-    - reports_availability: "Yes", "No", "Some"
-    - confirmation_status: bool
-    
-    OUTPUT FORMAT:
-    Return flat JSON keys ONLY.
+    A user message normalised once per turn and shared by every rule.
+    The word set, digit check and keyword hits are only computed if some rule gets far enough to need them.
+    Rules record fields they were unsure about in `flags` (field -> confidence, see app.utils.confidence).
     """
+    __slots__ = ("raw", "text", "step", "flags", "_words", "_has_digit", "_date", "_hits")
 
-    user_content = f"Current State: {json.dumps(current_state)}\nUser Message: {message}"
-    
-    model = genai.GenerativeModel('gemini-1.5-flash', 
-                                  generation_config={"response_mime_type": "application/json"})
+    def __init__(self, message: str, step: Optional[str] = None):
+        self.raw = message
+        self.text = message.lower()
+        self.step = step
+        self.flags: Dict[str, float] = {}
+        self._words = None
+        self._has_digit = None
+        self._date = False
+        self._hits = None
 
-    extracted_data = {}
-    
-    # 1. LLM Extraction (DISABLED due to 404 errors - Relying on robust heuristics)
-    # try:
-    #     response = model.generate_content([system_prompt, user_content])
-    #     cleaned_text = response.text.strip()
-    #     if "```json" in cleaned_text:
-    #         cleaned_text = cleaned_text.split("```json")[1].split("```")[0].strip()
-    #     extracted_data = json.loads(cleaned_text)
-    # except Exception as e:
-    #     print(f"Gemini Extraction Failed: {e}")
-
-    # 2. Heuristic Augmentation (Safety Layer)
-    
-    # Partner Status
-    if re.search(r'\b(partner|husband|wife|spouse)\b', message, re.IGNORECASE):
-        # Negative lookbehind/lookahead wrapper or simpler check
-        if not re.search(r'\b(no|without|not)\s+(partner|husband|wife|spouse)\b', message, re.IGNORECASE):
-            extracted_data["male_partner_type"] = "Partner"
-            extracted_data["male_partner_present"] = True
-    elif re.search(r'\b(donor|donor sperm|conception using a donor)\b', message, re.IGNORECASE):
-        extracted_data["male_partner_type"] = "Donor"
-        extracted_data["male_partner_present"] = False
-    elif re.search(r'\b(exploring|not sure|unsure)\b', message, re.IGNORECASE):
-        extracted_data["male_partner_type"] = "Unsure"
-        extracted_data["male_partner_present"] = False
-
-    # Ages
-    if "days" in message.lower() or "cycle" in message.lower():
-        pass # Skip age extraction if discussing cycles/days explicitly
-    elif current_state.get("female_age") is None or current_state.get("male_age") is None:
-        # Handle explicit "Female is X, Male is Y" format (Ambiguity Resolution)
-        female_explicit = re.search(r'Female is (\d+)', message, re.IGNORECASE)
-        male_explicit = re.search(r'Male is (\d+)', message, re.IGNORECASE)
-        
-        if female_explicit and male_explicit:
-            extracted_data["female_age"] = int(female_explicit.group(1))
-            extracted_data["male_age"] = int(male_explicit.group(1))
-            extracted_data["unclear_age_ownership"] = []
-            
-        else:
-            # Fallback to standard extraction
-            nums = re.findall(r'\b\d{2}\b', message)
-            if len(nums) >= 2:
-                self_match = re.search(r'\b(i am|i\'m|im|my age is|me)\s*(?:is)?\s*(\d{2})', message, re.IGNORECASE)
-                partner_match = re.search(r'\b(husband|he|partner|spouse|she)(?:\'s)?\s*(?:age)?\s*(?:is)?\s*(\d{2})', message, re.IGNORECASE)
-                
-                if self_match and partner_match:
-                     extracted_data["female_age"] = int(self_match.group(2))
-                     extracted_data["male_age"] = int(partner_match.group(2))
-                     extracted_data["unclear_age_ownership"] = []
-                else:
-                     if current_state.get("male_partner_present") is not False: 
-                        extracted_data["unclear_age_ownership"] = [int(n) for n in nums[:2]]
-            elif len(nums) == 1:
-                val = int(nums[0])
-                if re.search(r'\b(i am|i\'m|im|me)\b', message, re.IGNORECASE):
-                    extracted_data["female_age"] = val
-                elif re.search(r'\b(partner|he|husband|spouse)\b', message, re.IGNORECASE):
-                    extracted_data["male_age"] = val
-                else:
-                    if current_state.get("male_partner_present") is False:
-                        extracted_data["female_age"] = val
-                    elif current_state.get("female_age"):
-                        extracted_data["male_age"] = val
-                    else:
-                        extracted_data["female_age"] = val
-
-    # Ambiguity clarification
-    if "first is mine" in message.lower():
-        ambig = current_state.get("unclear_age_ownership", [])
-        if len(ambig) >= 2:
-            extracted_data["female_age"], extracted_data["male_age"] = ambig[0], ambig[1]
-            extracted_data["unclear_age_ownership"] = []
-    elif "second is mine" in message.lower():
-        ambig = current_state.get("unclear_age_ownership", [])
-        if len(ambig) >= 2:
-            extracted_data["female_age"], extracted_data["male_age"] = ambig[1], ambig[0]
-            extracted_data["unclear_age_ownership"] = []
-
-    # Relationship (Partner Context)
-    if current_state.get("male_age") and current_state.get("first_marriage") is None:
-        if re.search(r'\b(yes|yeah|yep)\b', message, re.IGNORECASE):
-            extracted_data["first_marriage"] = True
-        elif re.search(r'\b(no|nope)\b', message, re.IGNORECASE):
-            extracted_data["first_marriage"] = False
-    elif "marriage" in message.lower(): 
-        if re.search(r'\b(yes|yeah)\b', message, re.IGNORECASE):
-            extracted_data["first_marriage"] = True
-        elif re.search(r'\b(no|nope)\b', message, re.IGNORECASE):
-            extracted_data["first_marriage"] = False
-    
-    # Years Married
-    just_extracted_marriage = False
-    if current_state.get("first_marriage") is not None and current_state.get("years_married") is None:
-        yr_match = re.search(r'(\d+(?:\.\d+)?)\s*years?', message, re.IGNORECASE)
-        if yr_match:
-             extracted_data["years_married"] = float(yr_match.group(1))
-             just_extracted_marriage = True
+    def has(self, *keywords: str) -> bool:
+        text = self.text
+        for kw in keywords:
+            if kw in text:
+                return True
+        return False
+
+    def has_digit(self) -> bool:
+        if self._has_digit is None:
+            self._has_digit = DIGIT.search(self.text) is not None
+        return self._has_digit
+
+    def could_match(self, pattern: Pattern) -> bool:
+        text = self.text
+        needles = pattern.needles
+        if needles:
+            for kw in needles:
+                if kw in text:
+                    break
+            else:
+                return False
+        return not pattern.needs_digit or self.has_digit()
+
+    def search(self, pattern: Pattern) -> Optional["re.Match"]:
+        return pattern.regex.search(self.text) if self.could_match(pattern) else None
+
+    def findall(self, pattern: Pattern) -> List[str]:
+        return pattern.regex.findall(self.text) if self.could_match(pattern) else []
+
+    def any_word(self, words: frozenset) -> bool:
+        """Equivalent to searching `\\b(w1|w2|...)\\b` for single words."""
+        text = self.text
+        for kw in words:
+            if kw in text:
+                break
         else:
-             solitary = re.search(r'^\s*(\d+(?:\.\d+)?)\s*$', message)
-             if solitary: 
-                 extracted_data["years_married"] = float(solitary.group(1))
-                 just_extracted_marriage = True
-
-    # Duration
-    is_post_duration_step = current_state.get("has_prior_pregnancies") is not None
-    should_parse_duration = False
-    
-    if "trying" in message.lower() or "conceiv" in message.lower():
-        should_parse_duration = True
-    elif not just_extracted_marriage and not is_post_duration_step:
-        should_parse_duration = True
-        
-    if should_parse_duration:
-        if re.search(r'\b(0|zero|not yet|never)\b', message, re.IGNORECASE):
-            extracted_data["years_trying"] = 0.0
-            extracted_data["pending_duration_value"] = None
+            return False
+        if self._words is None:
+            self._words = frozenset(WORD.findall(text))
+        return not self._words.isdisjoint(words)
+
+    def hits(self, category: str) -> List[Hit]:
+        """Keyword hits for one catalog. The message is scanned once, on first use."""
+        if self._hits is None:
+            grouped: Dict[str, List[Hit]] = {}
+            for hit in SCANNER.scan(self.text):
+                grouped.setdefault(hit.category, []).append(hit)
+            self._hits = grouped
+        return self._hits.get(category, [])
+
+    def pick(self, category: str, field: str, last: bool = False):
+        """
+        Value of the highest-priority hit in a catalog (lowest-priority if `last`), or None.
+        Flags the field as COMPETING when the hits disagree.
+        """
+        hits = self.hits(category)
+        if not hits:
+            return None
+        if any(hit.value != hits[0].value for hit in hits):
+            self.flag(field, COMPETING)
+        pick = max if last else min
+        return pick(hits, key=lambda hit: hit.rank).value
+
+    def yes_or_no(self, field: str, yes: frozenset) -> Optional[bool]:
+        """True/False from yes/no words (yes wins); flags the field as COMPETING if both appear."""
+        said_yes = self.any_word(yes)
+        said_no = self.any_word(NO)
+        if said_yes and said_no:
+            self.flag(field, COMPETING)
+        if said_yes:
+            return True
+        return False if said_no else None
+
+    def flag(self, field: str, confidence: float) -> None:
+        self.flags[field] = min(confidence, self.flags.get(field, confidence))
+
+    def reported_date(self) -> Optional[date]:
+        """Parses a test date out of the message, or None."""
+        if self._date is False:
+            self._date = parse_date(self.raw)
+        return self._date
+
+
+# --- RULES ---
+# Each rule reads the shared MessageView and the current state, and writes into `out`.
+# Rules run in table order; later rules may read what earlier ones extracted.
+
+def _partner_status(view: MessageView, state: Dict, out: Dict) -> None:
+    if view.any_word(PARTNER_WORDS):
+        if view.any_word(DONOR_WORDS):
+            view.flag("male_partner_type", COMPETING)
+        if not view.search(NO_PARTNER):
+            out["male_partner_type"] = "Partner"
+            out["male_partner_present"] = True
+    elif view.any_word(DONOR_WORDS):
+        out["male_partner_type"] = "Donor"
+        out["male_partner_present"] = False
+    elif view.step in (None, "intro") and (view.any_word(UNSURE_WORDS) or view.search(NOT_SURE)):
+        # "Not sure" is an answer option on several later questions, so only read it as
+        # the partner status on the role question itself
+        out["male_partner_type"] = "Unsure"
+        out["male_partner_present"] = False
+
+
+def _ages(view: MessageView, state: Dict, out: Dict) -> None:
+    if "days" in view.text or "cycle" in view.text:
+        return # Skip age extraction if discussing cycles/days explicitly
+    if state.get("female_age") is not None and state.get("male_age") is not None:
+        return
+
+    # Handle explicit "Female is X, Male is Y" format (Ambiguity Resolution)
+    female_explicit = view.search(FEMALE_IS)
+    male_explicit = view.search(MALE_IS)
+    if female_explicit and male_explicit:
+        out["female_age"] = int(female_explicit.group(1))
+        out["male_age"] = int(male_explicit.group(1))
+        out["unclear_age_ownership"] = []
+        return
+
+    # Fallback to standard extraction
+    nums = view.findall(TWO_DIGITS)
+    if len(nums) >= 2:
+        self_match = view.search(SELF_AGE)
+        partner_match = view.search(PARTNER_AGE)
+        if self_match and partner_match:
+            out["female_age"] = int(self_match.group(2))
+            out["male_age"] = int(partner_match.group(2))
+            out["unclear_age_ownership"] = []
+        elif state.get("male_partner_present") is not False:
+            out["unclear_age_ownership"] = [int(n) for n in nums[:2]]
+            view.flag("female_age", AMBIGUOUS_OWNERSHIP)
+            view.flag("male_age", AMBIGUOUS_OWNERSHIP)
+    elif len(nums) == 1:
+        val = int(nums[0])
+        if view.any_word(SELF_WORDS) or view.search(SELF_PHRASE):
+            out["female_age"] = val
+        elif view.any_word(PARTNER_PRONOUNS):
+            out["male_age"] = val
+        elif state.get("male_partner_present") is False:
+            out["female_age"] = val
+        elif state.get("female_age"):
+            out["male_age"] = val
         else:
-            yr_match = re.search(r'(\d+(?:\.\d+)?)\s*years?', message, re.IGNORECASE)
-            mo_match = re.search(r'(\d+)\s*months?', message, re.IGNORECASE)
-            if yr_match:
-                extracted_data["years_trying"] = float(yr_match.group(1))
-                extracted_data["pending_duration_value"] = None
-            elif mo_match:
-                extracted_data["years_trying"] = float(mo_match.group(1)) / 12.0
-                extracted_data["pending_duration_value"] = None
-            else:
-                solitary_num = re.search(r'^\s*(\d+(?:\.\d+)?)\s*$', message)
-                if solitary_num and current_state.get("female_age") and current_state.get("years_trying") is None:
-                    if "years_married" not in extracted_data:
-                        extracted_data["pending_duration_value"] = float(solitary_num.group(1))
-
-    # Pregnancy
-    if current_state.get("years_trying") is not None and current_state.get("has_prior_pregnancies") is None:
-        if re.search(r'\b(yes|yeah|yep)\b', message, re.IGNORECASE):
-             extracted_data["has_prior_pregnancies"] = True
-        elif re.search(r'\b(no|nope)\b', message, re.IGNORECASE):
-             extracted_data["has_prior_pregnancies"] = False
-    elif re.search(r'\b(yes|yeah|yep)\b', message, re.IGNORECASE) and current_state.get("has_prior_pregnancies") is None:
-         pass 
-
-    if "natural" in message.lower(): extracted_data["pregnancy_source"] = "Natural"
-    if "treatment" in message.lower(): extracted_data["pregnancy_source"] = "Treatment"
-    for outcome in ["miscarriage", "ectopic", "chemical", "ongoing", "live birth"]:
-        if outcome in message.lower():
-            extracted_data["pregnancy_outcome"] = outcome.capitalize()
-
-    # Menstrual History
-    if current_state.get("has_prior_pregnancies") is not None and current_state.get("menstrual_regularity") is None:
-        if re.search(r'\b(yes|yeah|regular)\b', message, re.IGNORECASE) and "ir" not in message.lower():
-            extracted_data["menstrual_regularity"] = "Regular"
-        elif re.search(r'\b(no|nope|irregular|varies)\b', message, re.IGNORECASE):
-            extracted_data["menstrual_regularity"] = "Irregular"
-        elif "not sure" in message.lower():
-             extracted_data["menstrual_regularity"] = "NotSure"
-    elif "regular" in message.lower() and "ir" not in message.lower():
-        extracted_data["menstrual_regularity"] = "Regular"
-    elif "irregular" in message.lower() or "varies" in message.lower():
-        extracted_data["menstrual_regularity"] = "Irregular"
-    
-    # Cycle Length
-    if re.search(r'\b(21|26|31)[-–—to\s]+', message, re.IGNORECASE): 
-         extracted_data["cycle_length"] = message.strip()
-    
-    # Predictability
-    if "predictabl" in message.lower() or (current_state.get("cycle_length") and current_state.get("cycle_predictability") is None):
-         if re.search(r'\b(yes|yeah)\b', message, re.IGNORECASE): extracted_data["cycle_predictability"] = True
-         if re.search(r'\b(no|nope)\b', message, re.IGNORECASE): extracted_data["cycle_predictability"] = False
-
-    # Menarche
-    if "first period" in message.lower() or (current_state.get("cycle_predictability") is not None and current_state.get("menarche_age") is None):
-         num = re.search(r'(\d{2})', message)
-         if num: extracted_data["menarche_age"] = num.group(1)
-
-    # Sexual History
-    if "difficulty" in message.lower():
-        if "without" in message.lower(): extracted_data["sexual_difficulty"] = "None"
-        elif "sometimes" in message.lower(): extracted_data["sexual_difficulty"] = "Sometimes"
-        elif "rarely" in message.lower(): extracted_data["sexual_difficulty"] = "Rarely"
-    elif "not applicable" in message.lower():
-        extracted_data["sexual_difficulty"] = "NotApplicable"
-    elif current_state.get("menarche_age") and current_state.get("sexual_difficulty") is None:
-        if "without" in message.lower() or "yes" in message.lower():
-             extracted_data["sexual_difficulty"] = "None"
-        elif "sometimes" in message.lower(): extracted_data["sexual_difficulty"] = "Sometimes"
-        elif "rarely" in message.lower(): extracted_data["sexual_difficulty"] = "Rarely"
-        elif "not applicable" in message.lower(): extracted_data["sexual_difficulty"] = "NotApplicable"
-
-    # Treatments
-    if "ivf" in message.lower():
-        extracted_data["has_had_treatments"] = True
-        extracted_data["treatment_type"] = "IVF"
-        extracted_data["treatments_reviewed"] = True
-    elif "iui" in message.lower():
-        extracted_data["has_had_treatments"] = True
-        extracted_data["treatment_type"] = "IUI"
-        extracted_data["treatments_reviewed"] = True
-    elif "no treatments" in message.lower() or "no treatment" in message.lower():
-        extracted_data["has_had_treatments"] = False
-        extracted_data["treatment_type"] = "None"
-        extracted_data["treatments_reviewed"] = True
-
-    # Cycles
-    cycles_match = re.search(r'(\d+)\s*cycles', message, re.IGNORECASE)
+            # Nothing says whose age this is; assume the patient's
+            out["female_age"] = val
+            view.flag("female_age", AMBIGUOUS_OWNERSHIP)
+
+
+def _age_clarification(view: MessageView, state: Dict, out: Dict) -> None:
+    if "first is mine" in view.text:
+        order = (0, 1)
+    elif "second is mine" in view.text:
+        order = (1, 0)
+    else:
+        return
+    ambig = state.get("unclear_age_ownership", [])
+    if len(ambig) >= 2:
+        out["female_age"], out["male_age"] = ambig[order[0]], ambig[order[1]]
+        out["unclear_age_ownership"] = []
+
+
+def _first_marriage(view: MessageView, state: Dict, out: Dict) -> None:
+    if state.get("male_age") and state.get("first_marriage") is None:
+        yes = YES
+    elif "marriage" in view.text:
+        yes = YES_SHORT
+    else:
+        return
+    answer = view.yes_or_no("first_marriage", yes)
+    if answer is not None:
+        out["first_marriage"] = answer
+
+
+def _years_married(view: MessageView, state: Dict, out: Dict) -> None:
+    if state.get("first_marriage") is None or state.get("years_married") is not None:
+        return
+    match = view.search(YEARS) or view.search(SOLITARY_NUMBER)
+    if match:
+        out["years_married"] = float(match.group(1))
+
+
+def _duration(view: MessageView, state: Dict, out: Dict) -> None:
+    if "trying" not in view.text and "conceiv" not in view.text:
+        # Only parse bare numbers before the pregnancy step, and never on the marriage answer
+        if "years_married" in out or state.get("has_prior_pregnancies") is not None:
+            return
+
+    if view.any_word(ZERO_WORDS) or view.search(NOT_YET):
+        out["years_trying"] = 0.0
+        out["pending_duration_value"] = None
+        return
+
+    yr_match = view.search(YEARS)
+    if yr_match:
+        out["years_trying"] = float(yr_match.group(1))
+        out["pending_duration_value"] = None
+        return
+    mo_match = view.search(MONTHS)
+    if mo_match:
+        out["years_trying"] = float(mo_match.group(1)) / 12.0
+        out["pending_duration_value"] = None
+        return
+
+    solitary_num = view.search(SOLITARY_NUMBER)
+    if solitary_num and state.get("female_age") and state.get("years_trying") is None:
+        if "years_married" not in out:
+            # Years or months? The orchestrator asks
+            out["pending_duration_value"] = float(solitary_num.group(1))
+            view.flag("years_trying", COMPETING)
+
+
+def _prior_pregnancies(view: MessageView, state: Dict, out: Dict) -> None:
+    if state.get("years_trying") is not None and state.get("has_prior_pregnancies") is None:
+        answer = view.yes_or_no("has_prior_pregnancies", YES)
+        if answer is not None:
+            out["has_prior_pregnancies"] = answer
+
+
+def _pregnancy_details(view: MessageView, state: Dict, out: Dict) -> None:
+    source = view.pick("pregnancy_source", "pregnancy_source", last=True)
+    if source: out["pregnancy_source"] = source
+    outcome = view.pick("pregnancy_outcome", "pregnancy_outcome", last=True)
+    if outcome: out["pregnancy_outcome"] = outcome
+
+
+def _menstrual_regularity(view: MessageView, state: Dict, out: Dict) -> None:
+    text = view.text
+    if state.get("has_prior_pregnancies") is not None and state.get("menstrual_regularity") is None:
+        if view.any_word(REGULAR) and "ir" not in text:
+            out["menstrual_regularity"] = "Regular"
+        elif view.any_word(IRREGULAR):
+            out["menstrual_regularity"] = "Irregular"
+        elif "not sure" in text:
+            out["menstrual_regularity"] = "NotSure"
+    elif "regular" in text and "ir" not in text:
+        out["menstrual_regularity"] = "Regular"
+    elif "irregular" in text or "varies" in text:
+        out["menstrual_regularity"] = "Irregular"
+
+
+def _cycle_length(view: MessageView, state: Dict, out: Dict) -> None:
+    if view.search(CYCLE_RANGE):
+        out["cycle_length"] = view.raw.strip()
+
+
+def _cycle_predictability(view: MessageView, state: Dict, out: Dict) -> None:
+    if "predictabl" in view.text or (state.get("cycle_length") and state.get("cycle_predictability") is None):
+        said_yes, said_no = view.any_word(YES_SHORT), view.any_word(NO)
+        if said_yes and said_no: view.flag("cycle_predictability", COMPETING)
+        if said_yes: out["cycle_predictability"] = True
+        if said_no: out["cycle_predictability"] = False # "No" wins
+
+
+def _menarche(view: MessageView, state: Dict, out: Dict) -> None:
+    if "first period" in view.text or (state.get("cycle_predictability") is not None and state.get("menarche_age") is None):
+        num = view.search(ANY_TWO_DIGITS)
+        if num: out["menarche_age"] = num.group(1)
+
+
+def _sexual_history(view: MessageView, state: Dict, out: Dict) -> None:
+    text = view.text
+    if "difficulty" in text:
+        if "without" in text:
+            out["sexual_difficulty"] = "None"
+            return
+    elif "not applicable" in text:
+        out["sexual_difficulty"] = "NotApplicable"
+        return
+    elif state.get("menarche_age") and state.get("sexual_difficulty") is None:
+        if "without" in text or "yes" in text:
+            out["sexual_difficulty"] = "None"
+            return
+    else:
+        return
+    difficulty = view.pick("sexual_difficulty", "sexual_difficulty")
+    if difficulty:
+        out["sexual_difficulty"] = difficulty
+
+
+def _treatments(view: MessageView, state: Dict, out: Dict) -> None:
+    updates = view.pick("treatment", "treatment_type")
+    if updates:
+        out.update(updates)
+
+
+def _treatment_cycles(view: MessageView, state: Dict, out: Dict) -> None:
+    cycles_match = view.search(CYCLES)
     if cycles_match:
-        if extracted_data.get("treatment_type") == "IVF" or current_state.get("treatment_type") == "IVF":
-            extracted_data["ivf_cycles"] = int(cycles_match.group(1))
+        if out.get("treatment_type") == "IVF" or state.get("treatment_type") == "IVF":
+            out["ivf_cycles"] = int(cycles_match.group(1))
         else:
-            extracted_data["iui_cycles"] = int(cycles_match.group(1))
-            
-    # IVF Details (Fresh/Frozen & Outcome)
-    if current_state.get("treatment_type") == "IVF" and current_state.get("ivf_cycles"):
-        if "fresh" in message.lower():
-            extracted_data["last_ivf_transfer_type"] = "Fresh"
-        elif "frozen" in message.lower():
-            extracted_data["last_ivf_transfer_type"] = "Frozen"
-            
-        if "beta negative" in message.lower() or "negative" in message.lower():
-            extracted_data["last_ivf_outcome"] = "Beta Negative"
-        elif "biochemical" in message.lower() or "chemical" in message.lower():
-            extracted_data["last_ivf_outcome"] = "Biochemical Pregnancy"
-        elif "miscarriage" in message.lower():
-            extracted_data["last_ivf_outcome"] = "Miscarriage"
-        elif "ectopic" in message.lower():
-            extracted_data["last_ivf_outcome"] = "Ectopic Pregnancy"
-        elif "ongoing" in message.lower():
-            extracted_data["last_ivf_outcome"] = "Ongoing Pregnancy"
-        elif "live birth" in message.lower() or "baby" in message.lower():
-            extracted_data["last_ivf_outcome"] = "Live Birth"
+            out["iui_cycles"] = int(cycles_match.group(1))
+
+
+def _ivf_details(view: MessageView, state: Dict, out: Dict) -> None:
+    # Fresh/Frozen & Outcome of the last IVF cycle
+    if state.get("treatment_type") != "IVF" or not state.get("ivf_cycles"):
+        return
+    transfer_type = view.pick("ivf_transfer", "last_ivf_transfer_type")
+    if transfer_type:
+        out["last_ivf_transfer_type"] = transfer_type
+
+    outcome = view.pick("ivf_outcome", "last_ivf_outcome")
+    if outcome:
+        out["last_ivf_outcome"] = outcome
 
+
+def _tests(view: MessageView, state: Dict, out: Dict) -> None:
     # Tests (Female & Male Context Aware)
-    tests_map = {
-        "hormonal": "Hormonal blood tests (AMH, TSH, FSH/LH)", 
-        "ultrasound": "Ultrasound scans", 
-        "tube": "Tube testing (HSG / Laparoscopy / HyCoSy)",
-        "hsg": "Tube testing (HSG / Laparoscopy / HyCoSy)",
-        "laparoscopy": "Tube testing (HSG / Laparoscopy / HyCoSy)"
-    }
-    
-    male_keywords = ["semen", "partner", "his"]
-    is_explicit_male = any(kw in message.lower() for kw in male_keywords)
-    
-    is_implicit_male_step = current_state.get("tests_reviewed") is True
-    
+    text = view.text
+    is_explicit_male = bool(view.hits("male_context"))
+    is_implicit_male_step = state.get("tests_reviewed") is True
+
     if is_explicit_male or is_implicit_male_step:
-        male_tests = []
-        if "semen" in message.lower(): male_tests.append("Semen analysis")
-        if "hormonal" in message.lower(): male_tests.append("Hormonal blood tests")
-        if "genetic" in message.lower(): male_tests.append("Genetic tests")
-        if "none" in message.lower(): male_tests.append("None")
-        
+        male_tests = ranked_values(view.hits("male_test"))
         if male_tests:
-            extracted_data["male_tests_done_list"] = male_tests
+            out["male_tests_done_list"] = male_tests
     else:
-        found_tests = [label for kw, label in tests_map.items() if kw in message.lower()]
+        found_tests = ranked_values(view.hits("female_test"))
         if found_tests:
-            extracted_data["tests_done_list"] = found_tests
-            extracted_data["tests_reviewed"] = True
-        elif "none" in message.lower() and "above" in message.lower():
-            extracted_data["tests_done_list"] = ["None"]
-            extracted_data["tests_reviewed"] = True
-
-    # Reports
-    if "have them" in message.lower():
-        extracted_data["reports_availability"] = "Yes"
-        extracted_data["reports_availability_checked"] = True
-    elif "collect" in message.lower():
-        extracted_data["reports_availability"] = "No"
-        extracted_data["reports_availability_checked"] = True
-
-    # Confirmation
-    if "correct" in message.lower() or "yes" in message.lower():
-         if current_state.get("reports_availability_checked") or (current_state.get("tests_reviewed") and not current_state.get("tests_done_list")):
-              extracted_data["confirmation_status"] = True
-
-    # --- PHASE 1 REFINEMENT: Test Date Extraction ---
-    if current_state.get("active_date_inquiry"):
-        test_name = current_state["active_date_inquiry"]
-        date_str = None
-        
-        # Reuse Regex from Phase 2
-        # Month Year (Jan 2024 or January 2024)
-        mon_yr = re.search(r'\b(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*[\s,.-]+(\d{4})', message, re.IGNORECASE)
-        # Full Date (DD/MM/YYYY or similar)
-        full_date = re.search(r'(\d{1,2})[\/\-\.](\d{1,2})[\/\-\.](\d{2,4})', message)
-        # Year only
-        year_only = re.search(r'\b(20\d{2})\b', message)
-        
-        if mon_yr:
-            months = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
-            m_str = mon_yr.group(1).lower()[:3]
-            m_idx = months.index(m_str) + 1
-            y_str = mon_yr.group(2)
-            date_str = f"{y_str}-{m_idx:02d}-01" # Default to 1st
-        elif full_date:
-            d, m, y = full_date.group(1), full_date.group(2), full_date.group(3)
-            if len(y) == 2: y = "20" + y
-            date_str = f"{y}-{int(m):02d}-{int(d):02d}"
-        elif year_only:
-            date_str = f"{year_only.group(1)}-01-01"
-        elif "last month" in message.lower():
-            from datetime import date, timedelta
-            today = date.today()
-            d = today - timedelta(days=30)
-            date_str = d.isoformat()
-            
-        if date_str:
-            # We need to update the dictionary `reported_test_dates`
-            # CaseState stores it as a Dict. 
-            # We need to make sure we don't overwrite existing if multi-turn? 
-            # Extractor returns partial updates.
-            # We need to get the existing dict from state, update it, and return new dict.
-            existing_dates = current_state.get("reported_test_dates", {})
-            # Ensure it's a dict (pydantic model conversion might leave it as is?)
-            if not isinstance(existing_dates, dict): existing_dates = {}
-            
-            existing_dates[test_name] = date_str
-            extracted_data["reported_test_dates"] = existing_dates
-            
-            # Note: We do NOT clear `active_date_inquiry` here. Orchestrator checks if date exists.
-            
-    # --- PHASE 2 EXTRACTION ---
-    if current_state.get("phase") == "PHASE2":
-        # 1. Check for "Done Uploading" / "No Reports"
-        if "done" in message.lower() or "no report" in message.lower() or "do not have" in message.lower():
-            extracted_data["phase2_uploads_complete"] = True
-            
-        # 2. Extract Dates for Pending Documents
-        # Find doc with missing date
-        docs = current_state.get("phase2_documents", [])
-        pending_doc_idx = -1
-        # Safe iteration
-        if docs:
-            for i, doc in enumerate(docs):
-                is_dict = isinstance(doc, dict)
-                val = doc.get("test_date") if is_dict else getattr(doc, "test_date", None)
-                
-                if val is None:
-                    pending_doc_idx = i
-                    break
-        
-        if pending_doc_idx != -1:
-            date_str = None
-            
-            # Month Year (Jan 2024 or January 2024)
-            mon_yr = re.search(r'\b(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*[\s,.-]+(\d{4})', message, re.IGNORECASE)
-            # Full Date (DD/MM/YYYY)
-            full_date = re.search(r'(\d{1,2})[\/\-\.](\d{1,2})[\/\-\.](\d{2,4})', message)
-            # Year only
-            year_only = re.search(r'\b(20\d{2})\b', message)
-            
-            if mon_yr:
-                months = ["jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec"]
-                m_str = mon_yr.group(1).lower()[:3]
-                m_idx = months.index(m_str) + 1
-                y_str = mon_yr.group(2)
-                date_str = f"{y_str}-{m_idx:02d}-01"
-            elif full_date:
-                d, m, y = full_date.group(1), full_date.group(2), full_date.group(3)
-                if len(y) == 2: y = "20" + y
-                date_str = f"{y}-{int(m):02d}-{int(d):02d}"
-            elif year_only:
-                date_str = f"{year_only.group(1)}-01-01"
-            elif "last month" in message.lower():
-                from datetime import date, timedelta
-                today = date.today()
-                d = today - timedelta(days=30)
-                date_str = d.isoformat()
-            
-            if date_str:
-                updated_docs = list(docs)
-                if isinstance(updated_docs[pending_doc_idx], dict):
-                     updated_docs[pending_doc_idx]["test_date"] = date_str
-                else: 
-                     try:
-                        d_dict = updated_docs[pending_doc_idx].dict()
-                     except AttributeError:
-                        d_dict = dict(updated_docs[pending_doc_idx])
-                     
-                     d_dict["test_date"] = date_str
-                     updated_docs[pending_doc_idx] = d_dict
-                     
-                extracted_data["phase2_documents"] = updated_docs
-
-    return extracted_data
\ No newline at end of file
+            out["tests_done_list"] = found_tests
+            out["tests_reviewed"] = True
+        elif "none" in text and "above" in text:
+            out["tests_done_list"] = ["None"]
+            out["tests_reviewed"] = True
+
+
+def _reports(view: MessageView, state: Dict, out: Dict) -> None:
+    if "have them" in view.text:
+        out["reports_availability"] = "Yes"
+        out["reports_availability_checked"] = True
+    elif "collect" in view.text:
+        out["reports_availability"] = "No"
+        out["reports_availability_checked"] = True
+
+
+def _confirmation(view: MessageView, state: Dict, out: Dict) -> None:
+    if "correct" in view.text or "yes" in view.text:
+        if state.get("reports_availability_checked") or (state.get("tests_reviewed") and not state.get("tests_done_list")):
+            out["confirmation_status"] = True
+
+
+def _test_dates(view: MessageView, state: Dict, out: Dict) -> None:
+    # PHASE 1 REFINEMENT: date for the test we are currently asking about
+    test_name = state.get("active_date_inquiry")
+    if not test_name:
+        return
+    test_date = view.reported_date()
+    if test_date:
+        existing_dates = state.get("reported_test_dates", {})
+        if not isinstance(existing_dates, dict): existing_dates = {}
+        # Note: We do NOT clear `active_date_inquiry` here. Orchestrator checks if date exists.
+        out["reported_test_dates"] = {**existing_dates, test_name: test_date}
+
+
+def _phase2_documents(view: MessageView, state: Dict, out: Dict) -> None:
+    if state.get("phase") != "PHASE2":
+        return
+
+    # 1. Check for "Done Uploading" / "No Reports"
+    if view.has("done", "no report", "do not have"):
+        out["phase2_uploads_complete"] = True
+
+    # 2. Extract Dates for the first document with a missing date
+    docs = state.get("phase2_documents", [])
+    pending_doc_idx = -1
+    for i, doc in enumerate(docs or []):
+        val = doc.get("test_date") if isinstance(doc, dict) else getattr(doc, "test_date", None)
+        if val is None:
+            pending_doc_idx = i
+            break
+    if pending_doc_idx == -1:
+        return
+
+    test_date = view.reported_date()
+    if test_date:
+        updated_docs = list(docs)
+        doc = updated_docs[pending_doc_idx]
+        if not isinstance(doc, dict):
+            try:
+                doc = doc.dict()
+            except AttributeError:
+                doc = dict(doc)
+        updated_docs[pending_doc_idx] = {**doc, "test_date": test_date}
+        out["phase2_documents"] = updated_docs
+
+
+ANY_STEP = "*"
+
+
+class Rule(NamedTuple):
+    name: str
+    apply: Callable[[MessageView, Dict, Dict], None]
+    steps: Tuple[str, ...] # Orchestrator steps (state.pending_step) this rule answers; ANY_STEP = always on
+
+
+# Declarative rule table - order matters (e.g. duration looks at what the marriage rule extracted)
+RULES: List[Rule] = [
+    Rule("partner_status", _partner_status, (ANY_STEP,)),
+    Rule("ages", _ages, ("ages",)),
+    Rule("age_clarification", _age_clarification, ("ages",)),
+    Rule("first_marriage", _first_marriage, ("first_marriage",)),
+    Rule("years_married", _years_married, ("years_married",)),
+    Rule("duration", _duration, ("duration",)),
+    Rule("prior_pregnancies", _prior_pregnancies, ("prior_pregnancies",)),
+    Rule("pregnancy_details", _pregnancy_details, ("pregnancy_source", "pregnancy_outcome")),
+    Rule("menstrual_regularity", _menstrual_regularity, ("menstrual_regularity", "cycle_length")),
+    Rule("cycle_length", _cycle_length, ("cycle_length",)),
+    Rule("cycle_predictability", _cycle_predictability, ("cycle_predictability",)),
+    Rule("menarche", _menarche, ("menarche",)),
+    Rule("sexual_history", _sexual_history, ("sexual_history",)),
+    Rule("treatments", _treatments, ("treatments",)),
+    Rule("treatment_cycles", _treatment_cycles, ("treatments", "treatment_cycles")),
+    Rule("ivf_details", _ivf_details, ("ivf_transfer_type", "ivf_outcome")),
+    Rule("tests", _tests, ("female_tests", "male_tests")),
+    Rule("reports", _reports, ("reports_availability",)),
+    Rule("confirmation", _confirmation, (ANY_STEP,)),
+    Rule("test_dates", _test_dates, ("test_date",)),
+    Rule("phase2_documents", _phase2_documents, ("phase2_uploads", "phase2_test_date")),
+]
+
+
+def _compile_dispatch(rules: List[Rule], steps: List[str]) -> Dict[str, List[Rule]]:
+    unknown = {step for rule in rules for step in rule.steps if step != ANY_STEP} - set(steps)
+    if unknown:
+        raise ValueError(f"Rules answer steps the orchestrator does not have: {sorted(unknown)}")
+    return {
+        step: [rule for rule in rules if step in rule.steps or ANY_STEP in rule.steps]
+        for step in steps
+    }
+
+
+# Step -> rules to run while the orchestrator waits on that step (table order kept). Every
+# orchestrator step has an entry: one with no rules of its own (intro, confirmation, Phase 2
+# messages) runs only the always-on ones, so its answer cannot fill unrelated fields.
+STEP_RULES: Dict[str, List[Rule]] = _compile_dispatch(RULES, [step.name for step in STEPS])
+ALWAYS_ON_RULES: List[Rule] = [rule for rule in RULES if ANY_STEP in rule.steps]
+
+
+# Orchestrator step -> the fields its question can answer (confidence scoring, LLM prompts).
+# Steps not listed (date questions, Phase 2) have no single field to score.
+STEP_FIELDS: Dict[str, List[str]] = {
+    "intro": ["male_partner_type", "male_partner_present"],
+    "ages": ["female_age", "male_age"],
+    "first_marriage": ["first_marriage"],
+    "years_married": ["years_married"],
+    "duration": ["years_trying"],
+    "prior_pregnancies": ["has_prior_pregnancies"],
+    "pregnancy_source": ["pregnancy_source"],
+    "pregnancy_outcome": ["pregnancy_outcome"],
+    "menstrual_regularity": ["menstrual_regularity"],
+    "cycle_length": ["cycle_length"],
+    "cycle_predictability": ["cycle_predictability"],
+    "menarche": ["menarche_age"],
+    "sexual_history": ["sexual_difficulty"],
+    "treatments": ["has_had_treatments", "treatment_type"],
+    "treatment_cycles": ["ivf_cycles", "iui_cycles"],
+    "ivf_transfer_type": ["last_ivf_transfer_type"],
+    "ivf_outcome": ["last_ivf_outcome"],
+    "female_tests": ["tests_done_list"],
+    "male_tests": ["male_tests_done_list"],
+    "reports_availability": ["reports_availability"],
+    "confirmation": ["confirmation_status"],
+}
+
+
+def _run_rules(message: str, current_state: Dict, step: Optional[str]) -> Tuple[Dict, MessageView]:
+    view = MessageView(message, step)
+    rules = RULES if step is None else STEP_RULES.get(step, ALWAYS_ON_RULES)
+    extracted_data = {}
+    for rule in rules:
+        rule.apply(view, current_state, extracted_data)
+    return extracted_data, view
+
+
+def extract_clinical_state(message: str, current_state: Dict, step: Optional[str] = None) -> Dict:
+    """
+    HEURISTIC EXTRACTOR (PHASE 1 - FINAL SPEC)
+    Parses user messages to update the flattened CaseState.
+    Runs the rules in RULES over a single normalised view of the message.
+
+    `step` is the orchestrator's pending step (state.pending_step). When given, only the
+    rules for that step plus the always-on ones run, so e.g. a "yes" to the pregnancy
+    question cannot also fill first_marriage. Without a step (no question pending yet) every
+    rule runs.
+    """
+    return _run_rules(message, current_state, step)[0]
+
+
+def extract_with_confidence(message: str, current_state: Dict, step: Optional[str] = None) -> Tuple[Dict, float]:
+    """
+    extract_clinical_state plus how confident the rules are that the pending step was answered
+    (see app.utils.confidence). Below CONFIDENCE_THRESHOLD the caller escalates.
+    """
+    extracted_data, view = _run_rules(message, current_state, step)
+    fields = STEP_FIELDS.get(step, ())
+    scores = score_fields(extracted_data, view.flags, fields)
+    return extracted_data, step_confidence(scores, fields)
@@ -0,0 +1,111 @@
+from app.utils.scanner import KeywordScanner
+
+# --- KEYWORD CATALOGS ---
+# Every fixed keyword list the engine matches against, compiled into one scanner.
+# Catalog order is priority; a trailing "*" lets the keyword run on ("scan*" -> "scans").
+
+PREGNANCY_SOURCES = [("natural*", "Natural"), ("treatment*", "Treatment")]
+
+# Later entries win (every keyword found overwrites the previous one)
+PREGNANCY_OUTCOMES = [
+    ("miscarriage*", "Miscarriage"),
+    ("ectopic", "Ectopic"),
+    ("chemical", "Chemical"),
+    ("biochemical", "Chemical"),
+    ("ongoing", "Ongoing"),
+    ("live birth*", "Live birth"),
+]
+
+# First keyword found wins
+IVF_OUTCOMES = [
+    ("negative", "Beta Negative"),
+    ("chemical", "Biochemical Pregnancy"),
+    ("biochemical", "Biochemical Pregnancy"),
+    ("miscarriage*", "Miscarriage"),
+    ("ectopic", "Ectopic Pregnancy"),
+    ("ongoing", "Ongoing Pregnancy"),
+    ("live birth*", "Live Birth"),
+    ("baby", "Live Birth"),
+]
+IVF_TRANSFER_TYPES = [("fresh", "Fresh"), ("frozen", "Frozen")]
+
+SEXUAL_DIFFICULTY = [("sometimes", "Sometimes"), ("rarely", "Rarely")]
+
+TREATMENTS = [
+    ("ivf", {"has_had_treatments": True, "treatment_type": "IVF", "treatments_reviewed": True}),
+    ("iui", {"has_had_treatments": True, "treatment_type": "IUI", "treatments_reviewed": True}),
+    ("no treatment*", {"has_had_treatments": False, "treatment_type": "None", "treatments_reviewed": True}),
+]
+
+TESTS_MAP = {
+    "hormonal": "Hormonal blood tests (AMH, TSH, FSH/LH)",
+    "ultrasound*": "Ultrasound scans",
+    "tube*": "Tube testing (HSG / Laparoscopy / HyCoSy)",
+    "hsg": "Tube testing (HSG / Laparoscopy / HyCoSy)",
+    "laparoscopy": "Tube testing (HSG / Laparoscopy / HyCoSy)"
+}
+MALE_TESTS_MAP = {
+    "semen": "Semen analysis",
+    "hormonal": "Hormonal blood tests",
+    "genetic": "Genetic tests",
+    "none": "None"
+}
+MALE_KEYWORDS = [("semen", True), ("partner*", True), ("his", True)]
+
+# Phase 2: test type from an uploaded filename, first keyword found wins. All stems: filenames
+# run words together ("amhreport.pdf", "semenanalysis.pdf")
+KEYWORD_MAP = [
+    ("semen*", "Semen Analysis"),
+    ("sperm*", "Semen Analysis"),
+    ("hsg*", "HSG"),
+    ("tube*", "HSG"),
+    ("patency*", "HSG"),
+    ("hysterosalpingogram*", "HSG"),
+    ("amh*", "AMH"),
+    ("tsh*", "TSH"),
+    ("thyroid*", "TSH"),
+    ("fsh*", "FSH"),
+    ("lh*", "LH"),
+    ("prolactin*", "Prolactin"),
+    ("estradiol*", "Estradiol E2"),
+    ("afc*", "AFC"),
+    ("antral*", "AFC"),
+    ("follicle*", "AFC"),
+    ("scan*", "Pelvic Ultrasound"),
+    ("ultrasound*", "Pelvic Ultrasound"),
+    ("karyotype*", "Genetic tests"), # Generic for validity lookup
+    ("genetic*", "Genetic tests"),
+]
+
+# Narrative intake: test names as patients write them, mapped to the Phase 1 test options
+NARRATIVE_FEMALE_TESTS = [
+    ("amh", "Hormonal blood tests (AMH, TSH, FSH/LH)"),
+    ("tsh", "Hormonal blood tests (AMH, TSH, FSH/LH)"),
+    ("fsh", "Hormonal blood tests (AMH, TSH, FSH/LH)"),
+    ("lh", "Hormonal blood tests (AMH, TSH, FSH/LH)"),
+    ("prolactin", "Hormonal blood tests (AMH, TSH, FSH/LH)"),
+    ("hormon*", "Hormonal blood tests (AMH, TSH, FSH/LH)"),
+    ("ultrasound*", "Ultrasound scans"),
+    ("scan*", "Ultrasound scans"),
+    ("afc", "Ultrasound scans"),
+    ("hsg", "Tube testing (HSG / Laparoscopy / HyCoSy)"),
+    ("laparoscopy", "Tube testing (HSG / Laparoscopy / HyCoSy)"),
+    ("hycosy", "Tube testing (HSG / Laparoscopy / HyCoSy)"),
+    ("tube*", "Tube testing (HSG / Laparoscopy / HyCoSy)"),
+]
+NARRATIVE_MALE_TESTS = [("semen", "Semen analysis"), ("sperm*", "Semen analysis")]
+
+SCANNER = KeywordScanner({
+    "pregnancy_source": PREGNANCY_SOURCES,
+    "pregnancy_outcome": PREGNANCY_OUTCOMES,
+    "ivf_outcome": IVF_OUTCOMES,
+    "ivf_transfer": IVF_TRANSFER_TYPES,
+    "sexual_difficulty": SEXUAL_DIFFICULTY,
+    "treatment": TREATMENTS,
+    "female_test": TESTS_MAP,
+    "male_test": MALE_TESTS_MAP,
+    "male_context": MALE_KEYWORDS,
+    "test_type": KEYWORD_MAP,
+    "narrative_female_test": NARRATIVE_FEMALE_TESTS,
+    "narrative_male_test": NARRATIVE_MALE_TESTS,
+})
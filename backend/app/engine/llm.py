@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from dotenv import load_dotenv
+from pydantic import ValidationError
+
+from app.engine.extractor import STEP_FIELDS
+from app.models.case_state import CaseState
+
+env_path = Path(__file__).resolve().parent.parent.parent / ".env"
+load_dotenv(dotenv_path=env_path)
+
+# --- OPTIONAL LLM EXTRACTION BACKEND ---
+# Used only when LLM_EXTRACTION=1, and only for free text the rule-based extractor
+# could not read confidently (app.utils.confidence). One pooled HTTP client per process; calls are bounded by a semaphore,
+# a per-call timeout and a circuit breaker, and answers are cached per (step, message)
+# (concurrent identical messages share one call).
+# Point LLM_BASE_URL at app.engine.llm_stub to run it offline.
+
+GEMINI_URL = "https://generativelanguage.googleapis.com"
+
+SYSTEM_PROMPT = """
+You are an IVF Clinical Data Extractor. Read the patient's message and extract only what they state.
+
+FIELDS TO EXTRACT (Return as flat keys):
+{fields}
+
+OUTPUT FORMAT:
+Return flat JSON keys ONLY. Leave out any field the message does not answer.
+"""
+
+FIELD_SPECS = {
+    "male_partner_type": '"Partner", "Donor", "Unsure"',
+    "male_partner_present": "bool",
+    "female_age": "int",
+    "male_age": "int",
+    "first_marriage": "bool",
+    "years_married": "float",
+    "years_trying": "float",
+    "has_prior_pregnancies": "bool",
+    "pregnancy_source": '"Natural", "Treatment", "NotSure"',
+    "pregnancy_outcome": '"Miscarriage", "Ectopic", "Chemical", "Ongoing", "Live birth"',
+    "menstrual_regularity": '"Regular", "Irregular", "NotSure"',
+    "cycle_length": 'range in days, e.g. "26-30"',
+    "cycle_predictability": "bool",
+    "menarche_age": "string",
+    "sexual_difficulty": '"None", "Sometimes", "Rarely", "NotApplicable"',
+    "has_had_treatments": "bool",
+    "treatment_type": '"IVF", "IUI", "Medications", "None"',
+    "ivf_cycles": "int",
+    "iui_cycles": "int",
+    "last_ivf_transfer_type": '"Fresh", "Frozen", "NotSure"',
+    "last_ivf_outcome": "string",
+    "tests_done_list": "list of strings",
+    "male_tests_done_list": "list of strings",
+    "reports_availability": '"Yes", "No", "Some"',
+    "confirmation_status": "bool",
+}
+
+# Flags the rule-based extractor sets alongside an answer, so the orchestrator moves on
+STEP_FLAGS = {
+    "treatments": {"treatments_reviewed": True},
+    "female_tests": {"tests_reviewed": True},
+    "reports_availability": {"reports_availability_checked": True},
+}
+
+WHITESPACE = re.compile(r'\s+')
+
+
+@lru_cache(maxsize=None)
+def build_prompt(step: Optional[str]) -> str:
+    """System prompt listing only the fields the current step can answer (all fields if step is None)."""
+    fields = STEP_FIELDS[step] if step else list(FIELD_SPECS)
+    return SYSTEM_PROMPT.format(fields="\n".join(f"- {name}: {FIELD_SPECS[name]}" for name in fields))
+
+
+def normalize_message(message: str) -> str:
+    return WHITESPACE.sub(" ", message.strip().lower())
+
+
+def _validated(updates: Dict, fields: List[str]) -> Dict:
+    # Keep known, non-null fields; coerce through CaseState and drop whatever fails validation
+    updates = {k: v for k, v in updates.items() if k in fields and v is not None}
+    try:
+        model = CaseState(**updates)
+    except ValidationError as e:
+        bad = {err["loc"][0] for err in e.errors()}
+        updates = {k: v for k, v in updates.items() if k not in bad}
+        model = CaseState(**updates)
+    return {k: getattr(model, k) for k in updates}
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures and rejects calls for `cooldown` seconds,
+    then lets a single trial call through (half-open); its result closes or re-opens the circuit.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.opened_at is not None or self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class LLMExtractor:
+    """
+    Async extraction over the Gemini generateContent REST API.
+    extract() never raises: timeouts, HTTP errors, bad JSON and an open circuit all return {}.
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: str = GEMINI_URL,
+        model: str = "gemini-1.5-flash",
+        max_concurrency: int = 4,
+        timeout: float = 8.0,
+        cache_size: int = 1024,
+        breaker: Optional[CircuitBreaker] = None,
+    ):
+        self.api_key = api_key
+        self.url = f"{base_url.rstrip('/')}/v1beta/models/{model}:generateContent"
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.breaker = breaker or CircuitBreaker()
+        self._cache: "OrderedDict[Tuple[Optional[str], str], Dict]" = OrderedDict()
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[Tuple[Optional[str], str], asyncio.Future] = {}
+        self.stats = {"calls": 0, "cache_hits": 0, "coalesced": 0, "timeouts": 0, "errors": 0, "short_circuited": 0}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created lazily so it binds to the running event loop; reused for every later call
+        if self._client is None:
+            headers = {"x-goog-api-key": self.api_key} if self.api_key else {}
+            limits = httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+            self._client = httpx.AsyncClient(headers=headers, limits=limits, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, client: httpx.AsyncClient, body: Dict) -> httpx.Response:
+        async with self._semaphore:
+            return await client.post(self.url, json=body)
+
+    @staticmethod
+    def handles(step: Optional[str]) -> bool:
+        """Whether the pending step has fields the LLM can be asked about."""
+        return step is None or step in STEP_FIELDS
+
+    async def extract(self, message: str, step: Optional[str] = None) -> Dict:
+        if not self.handles(step):
+            return {}
+        key = (step, normalize_message(message))
+        if not key[1]:
+            return {}
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            self.stats["cache_hits"] += 1
+            return dict(cached)
+
+        # Identical messages arriving while a call is in flight wait for that call
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            return dict(await asyncio.shield(pending))
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        updates = None
+        try:
+            updates = await self._fetch(message, step)
+        finally:
+            del self._inflight[key]
+            future.set_result(updates or {})
+        if updates is None:
+            return {}
+
+        self._cache[key] = updates
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return dict(updates)
+
+    async def _fetch(self, message: str, step: Optional[str]) -> Optional[Dict]:
+        # None on failure (not cached), otherwise the validated updates
+        if not self.breaker.allow():
+            self.stats["short_circuited"] += 1
+            return None
+
+        client = self._get_client()
+        body = {
+            "systemInstruction": {"parts": [{"text": build_prompt(step)}]},
+            "contents": [{"role": "user", "parts": [{"text": message}]}],
+            "generationConfig": {"responseMimeType": "application/json", "temperature": 0},
+        }
+        self.stats["calls"] += 1
+        try:
+            # The timeout covers waiting for a slot too, so a backlog sheds load instead of queueing
+            response = await asyncio.wait_for(self._post(client, body), self.timeout)
+            response.raise_for_status()
+            text = response.json()["candidates"][0]["content"]["parts"][0]["text"]
+            raw = json.loads(text)
+            if not isinstance(raw, dict):
+                raise ValueError("LLM did not return a JSON object")
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            self.stats["timeouts"] += 1
+            self.breaker.record_failure()
+            return None
+        except asyncio.CancelledError:
+            self.breaker.record_failure()
+            raise
+        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+            print(f"LLM Extraction Error: {e}")
+            self.stats["errors"] += 1
+            self.breaker.record_failure()
+            return None
+        self.breaker.record_success()
+
+        updates = _validated(raw, STEP_FIELDS[step] if step else list(FIELD_SPECS))
+        if updates and step in STEP_FLAGS:
+            updates.update(STEP_FLAGS[step])
+        return updates
+
+
+def get_llm_extractor() -> Optional[LLMExtractor]:
+    """Builds the backend from the environment, or None when LLM extraction is off (the default)."""
+    if os.getenv("LLM_EXTRACTION", "0") != "1":
+        return None
+    base_url = os.getenv("LLM_BASE_URL", GEMINI_URL)
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key and base_url == GEMINI_URL:
+        print("LLM_EXTRACTION is on but GOOGLE_API_KEY is not set - using rule-based extraction only")
+        return None
+    return LLMExtractor(
+        api_key=api_key,
+        base_url=base_url,
+        model=os.getenv("LLM_MODEL", "gemini-1.5-flash"),
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+        timeout=float(os.getenv("LLM_TIMEOUT", "8")),
+    )
@@ -0,0 +1,102 @@
+"""
+Local stand-in for the Gemini generateContent endpoint, for running and load-testing
+the LLM extraction backend offline.
+
+    uvicorn app.engine.llm_stub:app --port 8001
+    LLM_EXTRACTION=1 LLM_BASE_URL=http://127.0.0.1:8001 uvicorn app.main:app
+
+Answers are produced by the rule-based extractor, restricted to the fields named in the
+prompt. STUB_LATENCY_MS (mean, +/-50% jitter) and STUB_ERROR_RATE shape its behaviour.
+
+    python -m app.engine.llm_stub load --url http://127.0.0.1:8001 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import time
+
+from fastapi import FastAPI, HTTPException, Request
+
+from app.engine.extractor import extract_clinical_state
+from app.engine.llm import CircuitBreaker, LLMExtractor
+
+FIELD_LINE = re.compile(r'^- (\w+):', re.MULTILINE)
+
+LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "300"))
+ERROR_RATE = float(os.getenv("STUB_ERROR_RATE", "0"))
+
+app = FastAPI(title="LLM Extraction Stub")
+
+
+@app.post("/v1beta/models/{model_call}")
+async def generate_content(model_call: str, request: Request):
+    body = await request.json()
+    await asyncio.sleep(LATENCY_MS * random.uniform(0.5, 1.5) / 1000)
+    if random.random() < ERROR_RATE:
+        raise HTTPException(status_code=503, detail="Stub: simulated overload")
+
+    prompt = body["systemInstruction"]["parts"][0]["text"]
+    message = body["contents"][-1]["parts"][0]["text"]
+    fields = set(FIELD_LINE.findall(prompt))
+    updates = {k: v for k, v in extract_clinical_state(message, {}).items() if k in fields}
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": json.dumps(updates)}]}}]}
+
+
+SAMPLE_TURNS = [
+    ("intro", "It's just me and my husband"),
+    ("ages", "I am 34 and he is 37"),
+    ("duration", "we have been trying for about 3 years now"),
+    ("pregnancy_outcome", "sadly it ended in a miscarriage"),
+    ("treatments", "we did IVF last year"),
+    ("treatment_cycles", "2 cycles so far"),
+    ("female_tests", "I had an ultrasound and an HSG"),
+    ("reports_availability", "I'd need to collect them from the clinic"),
+]
+
+
+async def load_test(url: str, requests: int, concurrency: int, timeout: float) -> None:
+    # Mostly unique messages (cache misses) with some repeats, fired all at once
+    extractor = LLMExtractor(base_url=url, max_concurrency=concurrency, timeout=timeout,
+                             breaker=CircuitBreaker(threshold=requests + 1))
+    latencies = []
+
+    async def one(i: int) -> None:
+        step, message = SAMPLE_TURNS[i % len(SAMPLE_TURNS)]
+        if i % 4:
+            message = f"{message} ({i})"
+        started = time.perf_counter()
+        await extractor.extract(message, step)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    await extractor.aclose()
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+    print(f"{requests} requests in {elapsed:.2f}s ({requests / elapsed:.0f} req/s), concurrency {concurrency}")
+    print(f"latency ms: p50 {pct(0.50):.0f}  p95 {pct(0.95):.0f}  p99 {pct(0.99):.0f}")
+    print(f"stats: {extractor.stats}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LLM extraction stub server / load generator")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve")
+    serve.add_argument("--port", type=int, default=8001)
+    load = sub.add_parser("load")
+    load.add_argument("--url", default="http://127.0.0.1:8001")
+    load.add_argument("--requests", type=int, default=500)
+    load.add_argument("--concurrency", type=int, default=8)
+    load.add_argument("--timeout", type=float, default=8.0)
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        import uvicorn
+        uvicorn.run(app, host="127.0.0.1", port=args.port)
+    else:
+        asyncio.run(load_test(args.url, args.requests, args.concurrency, args.timeout))
@@ -0,0 +1,247 @@
+import re
+from typing import Callable, Dict, List
+
+from app.engine.extractor import MessageView, extract_clinical_state
+from app.utils.dates import NUMBER_WORDS, parse_date
+
+# --- NARRATIVE INTAKE ---
+# Many patients paste their whole history in one message ("I'm 34, husband 37, married
+# 6 years, trying 3 years, 2 IVF cycles, last frozen transfer negative, AMH done Jan 2024").
+# The message is split into clauses once and every clause is read on its own cue words,
+# so a number is only assigned when its clause says what it is. Anything without a clear
+# cue is left for the orchestrator to ask, which then skips straight past what we filled.
+
+CLAUSE_SPLIT = re.compile(r'[,;\n]+|\.(?!\d)|\b(?:and|but|also)\b')
+MIN_CLAUSES = 3 # Fewer clauses than this is an ordinary answer to the pending question
+MIN_FIELDS = 2  # A narrative must answer at least this many questions to be used
+
+NUMBER = r'(\d+(?:\.\d+)?|' + '|'.join(sorted(NUMBER_WORDS, key=len, reverse=True)) + r')'
+WORD = re.compile(r"[a-z']+")
+TWO_DIGITS = re.compile(r'\b(\d{2})\b')
+DURATION = re.compile(r'\b' + NUMBER + r'\s*\+?\s*(years?|yrs?|months?)\b')
+CYCLE_COUNT = re.compile(r'\b' + NUMBER + r'\s*(ivf|iui)?\s*(?:cycles?|rounds?|attempts?|tries)\b')
+CYCLE_DAYS = re.compile(r'\b(\d{2})\s*(?:(?:-|–|to)\s*\d{2}\s*)?-?\s*days?\b')
+MENARCHE = re.compile(r'(?:first period|periods? (?:started|began)|menarche)\D{0,12}(\d{1,2})\b')
+NEVER_PREGNANT = re.compile(r"\b(?:never (?:been |got |gotten )?(?:pregnant|conceived)|no (?:previous |prior )?pregnanc|not (?:been |got )?pregnant)")
+NO_TREATMENT = re.compile(r"\b(?:no|never had(?: any)?|haven't had(?: any)?|not had(?: any)?) (?:fertility )?treatments?\b")
+FIRST_MARRIAGE = re.compile(r'\bfirst marriage\b')
+NOT_FIRST_MARRIAGE = re.compile(r'\b(?:second marriage|remarried|previous marriage|married before)\b')
+
+MALE_CUES = frozenset({"husband", "hubby", "partner", "spouse", "he", "he's", "him", "his", "male", "boyfriend"})
+FEMALE_CUES = frozenset({"wife", "female"})
+SELF_CUES = frozenset({"i", "i'm", "im", "me", "myself"}) # Not "my": "my son is 10"
+OTHER_PERSON_CUES = frozenset({
+    "son", "sons", "daughter", "daughters", "child", "children", "kid", "kids", "baby", "stepson", "stepdaughter",
+    "mother", "mom", "mum", "father", "dad", "sister", "brother", "niece", "nephew",
+})
+NOT_AGE_CUES = ("month", "week", "day", "cycle", "married", "trying", "ttc", "conceiv", "since", "ago", "amh", "%")
+TRYING_CUES = ("trying", "ttc", "conceive", "conceiving", "infertil")
+PERIOD_CUES = ("period", "menstru", "cycle")
+IVF_CONTEXT = ("ivf", "icsi", "transfer", "fet", "embryo", "beta", "cycle")
+
+CYCLE_BUCKETS = [(21, 25, "21–25 days"), (26, 30, "26–30 days"), (31, 35, "31–35 days")]
+
+# Fields that are False until their question is answered (the rest are None / empty)
+REVIEW_FLAGS = frozenset({"treatments_reviewed"})
+
+
+class Clause:
+    __slots__ = ("text", "words", "view")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.words = frozenset(WORD.findall(text))
+        self.view = MessageView(text)
+
+    def has(self, *cues: str) -> bool:
+        return any(cue in self.text for cue in cues)
+
+
+def _number(value: str) -> float:
+    return float(NUMBER_WORDS[value]) if value in NUMBER_WORDS else float(value)
+
+
+def _years(match: "re.Match") -> float:
+    value = _number(match.group(1))
+    return value / 12.0 if match.group(2).startswith("month") else value
+
+
+# --- NARRATIVE RULES ---
+# Each rule reads every clause and writes what it is sure of into `out`; the first clause wins.
+
+def _ages(clauses: List[Clause], out: Dict) -> None:
+    # The writer is the female partner, unless they mention a wife: then they are the male one
+    writer_is_male = any("wife" in clause.words for clause in clauses)
+    for clause in clauses:
+        if clause.has(*NOT_AGE_CUES) or (clause.has("year", "yr") and "old" not in clause.text):
+            continue
+        nums = TWO_DIGITS.findall(clause.text)
+        words = clause.words
+        if len(nums) != 1 or not words.isdisjoint(OTHER_PERSON_CUES):
+            continue # Someone else's age ("my son is 10") is not the couple's
+        male = not words.isdisjoint(MALE_CUES)
+        female = not words.isdisjoint(FEMALE_CUES)
+        if not words.isdisjoint(SELF_CUES):
+            male, female = male or writer_is_male, female or not writer_is_male
+        if male and not female:
+            out.setdefault("male_age", int(nums[0]))
+        elif female and not male:
+            out.setdefault("female_age", int(nums[0]))
+
+
+def _marriage(clauses: List[Clause], out: Dict) -> None:
+    for clause in clauses:
+        if "marri" not in clause.text:
+            continue
+        if FIRST_MARRIAGE.search(clause.text):
+            out.setdefault("first_marriage", True)
+        elif NOT_FIRST_MARRIAGE.search(clause.text):
+            out.setdefault("first_marriage", False)
+        match = DURATION.search(clause.text)
+        if match and not clause.has(*TRYING_CUES):
+            out.setdefault("years_married", _years(match))
+
+
+def _trying(clauses: List[Clause], out: Dict) -> None:
+    for clause in clauses:
+        if clause.has(*TRYING_CUES) and "marri" not in clause.text:
+            match = DURATION.search(clause.text)
+            if match:
+                out.setdefault("years_trying", _years(match))
+
+
+def _pregnancies(clauses: List[Clause], out: Dict) -> None:
+    for clause in clauses:
+        if NEVER_PREGNANT.search(clause.text):
+            out.setdefault("has_prior_pregnancies", False)
+            continue
+        if clause.has(*IVF_CONTEXT):
+            continue # Outcome of a treatment cycle, read by _ivf_details
+        outcome = clause.view.pick("pregnancy_outcome", "pregnancy_outcome", last=True)
+        if outcome or "pregnant" in clause.text or "pregnancy" in clause.text:
+            out.setdefault("has_prior_pregnancies", True)
+        if outcome:
+            out.setdefault("pregnancy_outcome", outcome)
+            source = clause.view.pick("pregnancy_source", "pregnancy_source", last=True)
+            if source:
+                out.setdefault("pregnancy_source", source)
+
+
+def _menstrual(clauses: List[Clause], out: Dict) -> None:
+    for clause in clauses:
+        if not clause.has(*PERIOD_CUES) or clause.has("ivf", "iui"):
+            continue
+        if "irregular" in clause.text:
+            out.setdefault("menstrual_regularity", "Irregular")
+        elif "regular" in clause.text:
+            out.setdefault("menstrual_regularity", "Regular")
+        match = CYCLE_DAYS.search(clause.text)
+        if match:
+            days = int(match.group(1))
+            for low, high, label in CYCLE_BUCKETS:
+                if low <= days <= high:
+                    out.setdefault("cycle_length", label)
+        match = MENARCHE.search(clause.text)
+        if match:
+            out.setdefault("menarche_age", match.group(1))
+
+
+def _treatments(clauses: List[Clause], out: Dict) -> None:
+    for clause in clauses:
+        if NO_TREATMENT.search(clause.text):
+            out.update({"has_had_treatments": False, "treatment_type": "None", "treatments_reviewed": True})
+            return
+    types = [t for clause in clauses for t in ("ivf", "iui") if t in clause.words]
+    if not types:
+        return
+    treatment_type = "IVF" if "ivf" in types else "IUI"
+    out.update({"has_had_treatments": True, "treatment_type": treatment_type, "treatments_reviewed": True})
+    for clause in clauses:
+        match = CYCLE_COUNT.search(clause.text)
+        if match and (match.group(2) or not clause.words.isdisjoint(("ivf", "iui")) or len(types) == 1):
+            kind = match.group(2) or ("iui" if "iui" in clause.words else treatment_type.lower())
+            out.setdefault(f"{kind}_cycles", int(_number(match.group(1))))
+
+
+def _ivf_details(clauses: List[Clause], out: Dict) -> None:
+    if out.get("treatment_type") != "IVF":
+        return
+    for clause in clauses:
+        if not clause.has(*IVF_CONTEXT, "last", "fresh", "frozen"):
+            continue
+        transfer_type = clause.view.pick("ivf_transfer", "last_ivf_transfer_type")
+        if transfer_type:
+            out.setdefault("last_ivf_transfer_type", transfer_type)
+        outcome = clause.view.pick("ivf_outcome", "last_ivf_outcome")
+        if outcome:
+            out.setdefault("last_ivf_outcome", outcome)
+
+
+def _tests(clauses: List[Clause], out: Dict) -> None:
+    female, male, dates = [], [], {}
+    for clause in clauses:
+        female_tests = [hit.value for hit in clause.view.hits("narrative_female_test")]
+        male_tests = [hit.value for hit in clause.view.hits("narrative_male_test")]
+        if not female_tests and not male_tests:
+            continue
+        female.extend(female_tests)
+        male.extend(male_tests)
+        test_date = parse_date(clause.text)
+        if test_date:
+            for test in female_tests + male_tests:
+                dates.setdefault(test, test_date)
+    if female:
+        out["tests_done_list"] = list(dict.fromkeys(female)) # tests_reviewed stays with the tests question
+    if male:
+        out["male_tests_done_list"] = list(dict.fromkeys(male))
+    if dates:
+        out["reported_test_dates"] = dates
+
+
+NARRATIVE_RULES: List[Callable[[List[Clause], Dict], None]] = [
+    _ages, _marriage, _trying, _pregnancies, _menstrual, _treatments, _ivf_details, _tests,
+]
+
+
+def split_clauses(message: str) -> List[str]:
+    text = message.lower().replace("’", "'")
+    return [part.strip() for part in CLAUSE_SPLIT.split(text) if part and part.strip()]
+
+
+def _is_unset(field: str, value) -> bool:
+    return value is None or value == [] or value == {} or (field in REVIEW_FLAGS and value is False)
+
+
+def extract_narrative(message: str, current_state: Dict) -> Dict:
+    """
+    Reads a long, multi-clause message for every field it can resolve from explicit cues.
+    Only fills fields the state has not answered yet; returns {} for ordinary short answers
+    or when fewer than MIN_FIELDS questions were answered.
+    """
+    parts = split_clauses(message)
+    if len(parts) < MIN_CLAUSES:
+        return {}
+    clauses = [Clause(part) for part in parts]
+
+    # Partner status is a whole-message question (any "husband" anywhere counts)
+    found = {k: v for k, v in extract_clinical_state(message, {}, step="intro").items()
+             if k in ("male_partner_type", "male_partner_present")}
+    for rule in NARRATIVE_RULES:
+        rule(clauses, found)
+
+    out = {k: v for k, v in found.items() if k != "reported_test_dates" and _is_unset(k, current_state.get(k))}
+    existing_dates = current_state.get("reported_test_dates") or {}
+    new_dates = {t: d for t, d in found.get("reported_test_dates", {}).items() if t not in existing_dates}
+    if new_dates:
+        out["reported_test_dates"] = {**existing_dates, **new_dates}
+
+    answered = [k for k in out if k not in REVIEW_FLAGS and k != "male_partner_present"]
+    if len(answered) < MIN_FIELDS:
+        return {}
+
+    # Ages and duration are now known outright; drop any pending clarification for them
+    if "female_age" in out and "male_age" in out:
+        out["unclear_age_ownership"] = []
+    if "years_trying" in out:
+        out["pending_duration_value"] = None
+    return out
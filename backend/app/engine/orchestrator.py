@@ -1,377 +1,606 @@
 import json
-from typing import Tuple, List
+from datetime import date
+from itertools import islice
+from typing import Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple, Union
 from app.models.case_state import CaseState
 
-def get_next_question(state: CaseState) -> Tuple[str, List[str]]:
+# --- OPTION CATALOG ---
+# Every canned reply the orchestrator offers, per step, with the state update it stands for.
+# A click on one of these is applied directly (see resolve_option) instead of going through
+# the regex extractor.
+STEP_OPTIONS: Dict[str, List[Tuple[str, Dict]]] = {
+    "intro": [
+        ("I have a partner", {"male_partner_type": "Partner", "male_partner_present": True}),
+        ("I am planning to conceive using a donor", {"male_partner_type": "Donor", "male_partner_present": False}),
+        ("I’m exploring options / not sure yet", {"male_partner_type": "Unsure", "male_partner_present": False}),
+    ],
+    "first_marriage": [
+        ("Yes", {"first_marriage": True}),
+        ("No", {"first_marriage": False}),
+    ],
+    "prior_pregnancies": [
+        ("Yes", {"has_prior_pregnancies": True}),
+        ("No", {"has_prior_pregnancies": False}),
+    ],
+    "pregnancy_source": [
+        ("Natural pregnancy", {"pregnancy_source": "Natural"}),
+        ("Pregnancy after treatment", {"pregnancy_source": "Treatment"}),
+        ("I’m not sure", {"pregnancy_source": "NotSure"}),
+    ],
+    "pregnancy_outcome": [
+        ("Miscarriage", {"pregnancy_outcome": "Miscarriage"}),
+        ("Ectopic pregnancy", {"pregnancy_outcome": "Ectopic"}),
+        ("Chemical pregnancy", {"pregnancy_outcome": "Chemical"}),
+        ("Live birth", {"pregnancy_outcome": "Live birth"}),
+        ("Ongoing", {"pregnancy_outcome": "Ongoing"}),
+    ],
+    "menstrual_regularity": [
+        ("Yes", {"menstrual_regularity": "Regular"}),
+        ("No", {"menstrual_regularity": "Irregular"}),
+        ("Not sure", {"menstrual_regularity": "NotSure"}),
+    ],
+    "cycle_length": [
+        ("21–25 days", {"cycle_length": "21–25 days"}),
+        ("26–30 days", {"cycle_length": "26–30 days"}),
+        ("31–35 days", {"cycle_length": "31–35 days"}),
+        ("Irregular / varies", {"menstrual_regularity": "Irregular"}),
+        ("Not sure", {"cycle_length": "Not sure"}),
+    ],
+    "cycle_predictability": [
+        ("Yes", {"cycle_predictability": True}),
+        ("No", {"cycle_predictability": False}),
+    ],
+    "sexual_history": [
+        ("Yes, without difficulty", {"sexual_difficulty": "None"}),
+        ("Sometimes difficult", {"sexual_difficulty": "Sometimes"}),
+        ("Rarely / with difficulty", {"sexual_difficulty": "Rarely"}),
+        ("Not applicable (using donor / no partner)", {"sexual_difficulty": "NotApplicable"}),
+    ],
+    "treatments": [
+        ("IVF", {"has_had_treatments": True, "treatment_type": "IVF", "treatments_reviewed": True}),
+        ("IUI", {"has_had_treatments": True, "treatment_type": "IUI", "treatments_reviewed": True}),
+        ("Medications only", {"has_had_treatments": True, "treatment_type": "Medications", "treatments_reviewed": True}),
+        ("No treatments so far", {"has_had_treatments": False, "treatment_type": "None", "treatments_reviewed": True}),
+    ],
+    "ivf_transfer_type": [
+        ("Fresh transfer", {"last_ivf_transfer_type": "Fresh"}),
+        ("Frozen transfer", {"last_ivf_transfer_type": "Frozen"}),
+        ("Not sure", {"last_ivf_transfer_type": "NotSure"}),
+    ],
+    "ivf_outcome": [
+        ("Beta negative", {"last_ivf_outcome": "Beta Negative"}),
+        ("Biochemical pregnancy", {"last_ivf_outcome": "Biochemical Pregnancy"}),
+        ("Miscarriage", {"last_ivf_outcome": "Miscarriage"}),
+        ("Ectopic pregnancy", {"last_ivf_outcome": "Ectopic Pregnancy"}),
+        ("Ongoing pregnancy", {"last_ivf_outcome": "Ongoing Pregnancy"}),
+        ("Live birth", {"last_ivf_outcome": "Live Birth"}),
+    ],
+    # Multi-select: the frontend sends the ticked options joined with ", "
+    "female_tests": [
+        ("Hormonal blood tests (AMH, TSH, FSH/LH)", {"tests_done_list": ["Hormonal blood tests (AMH, TSH, FSH/LH)"], "tests_reviewed": True}),
+        ("Ultrasound scans", {"tests_done_list": ["Ultrasound scans"], "tests_reviewed": True}),
+        ("Tube testing (HSG / Laparoscopy / HyCoSy)", {"tests_done_list": ["Tube testing (HSG / Laparoscopy / HyCoSy)"], "tests_reviewed": True}),
+        ("None of the above", {"tests_done_list": ["None"], "tests_reviewed": True}),
+    ],
+    "male_tests": [
+        ("Semen analysis", {"male_tests_done_list": ["Semen analysis"]}),
+        ("Hormonal blood tests", {"male_tests_done_list": ["Hormonal blood tests"]}),
+        ("Genetic tests", {"male_tests_done_list": ["Genetic tests"]}),
+        ("None of the above", {"male_tests_done_list": ["None"]}),
+    ],
+    "reports_availability": [
+        ("Yes, I have them", {"reports_availability": "Yes", "reports_availability_checked": True}),
+        ("No, I would need to collect them", {"reports_availability": "No", "reports_availability_checked": True}),
+        ("Some reports only", {"reports_availability": "Some", "reports_availability_checked": True}),
+    ],
+    "confirmation": [
+        ("Yes, that’s correct", {"confirmation_status": True}),
+        ("No, I’d like to correct something", {"confirmation_status": False}),
+    ],
+    "phase2_uploads": [
+        ("Done uploading", {"phase2_uploads_complete": True}),
+        ("I don't have any reports", {"phase2_uploads_complete": True}),
+    ],
+}
+
+MULTI_SELECT_STEPS = {"female_tests", "male_tests"}
+
+# (step, exact option text) -> state update, built once at import
+OPTION_TABLE: Dict[Tuple[str, str], Dict] = {
+    (step, text): update for step, options in STEP_OPTIONS.items() for text, update in options
+}
+
+
+def _options(step: str) -> List[str]:
+    return [text for text, _ in STEP_OPTIONS[step]]
+
+
+def _age_clarification_options(state: CaseState) -> List[Tuple[str, Dict]]:
+    age1, age2 = state.unclear_age_ownership[0], state.unclear_age_ownership[1]
+    return [
+        (f"Female is {age1}, Male is {age2}", {"female_age": age1, "male_age": age2, "unclear_age_ownership": []}),
+        (f"Female is {age2}, Male is {age1}", {"female_age": age2, "male_age": age1, "unclear_age_ownership": []}),
+    ]
+
+
+def _duration_clarification_options(state: CaseState) -> List[Tuple[str, Dict]]:
+    val = state.pending_duration_value
+    val_str = str(int(val)) if val == int(val) else str(val)
+    return [
+        (f"{val_str} years", {"years_trying": val, "pending_duration_value": None}),
+        (f"{val_str} months", {"years_trying": val / 12.0, "pending_duration_value": None}),
+        ("Something else", {"pending_duration_value": None}),
+    ]
+
+
+def _merge_selection(step: str, message: str) -> Optional[Dict]:
+    """Splits a multi-select reply back into catalog options (option texts may contain ", ")."""
+    options = sorted(STEP_OPTIONS[step], key=lambda opt: len(opt[0]), reverse=True)
+    selected = set()
+    rest = message
+    while rest:
+        match = next((opt for opt in options if rest.startswith(opt[0])), None)
+        if match is None:
+            return None
+        selected.add(match[0])
+        rest = rest[len(match[0]):]
+        if rest and not rest.startswith(", "):
+            return None
+        rest = rest[2:]
+
+    # Catalog order, and "None of the above" only counts when nothing else was ticked
+    merged: Dict = {}
+    for text, update in STEP_OPTIONS[step]:
+        if text not in selected or (text == "None of the above" and len(selected) > 1):
+            continue
+        for key, val in update.items():
+            merged[key] = merged.get(key, []) + val if isinstance(val, list) else val
+    return merged
+
+
+def resolve_option(state: CaseState, message: str) -> Optional[Dict]:
     """
-    DETERMINISTIC ORCHESTRATOR (FINAL SPEC - PHASE 1)
-    Strictly follows the sequential decision flow from the USER'S FINAL SPEC.
+    Fast path for button clicks: returns the state update for a reply that is exactly one
+    of the options offered for `state.pending_step`, or None for free text.
     """
+    step = state.pending_step
+    if step is None:
+        return None
 
-    # 0. Entry + Role Selection (CRITICAL - FIRST DECISION)
-    if not state.intro_shown:
-        state.intro_shown = True
-        msg = (
-            "Hello. I am Dr. Malpani’s AI assistant.\n"
-            "To help us understand your case, I’ll walk through your fertility history step by step.\n"
-            "I may pause or clarify at times — that’s how doctors avoid missing important details.\n\n"
-            "Which of the following best describes your situation?"
-        )
-        options = ["I have a partner", "I am planning to conceive using a donor", "I’m exploring options / not sure yet"]
-        return msg, options
-
-    # 1. Partner Status Extraction is handled, we move to Age Intake
-
-    # 2. Age Intake
-    # Case 1A: Partner Branch
-    if state.male_partner_type == "Partner" or (state.male_partner_present is True and state.male_partner_type != "Donor"):
-        if state.female_age is None or state.male_age is None:
-            if not state.female_age and not state.male_age and not state.unclear_age_ownership:
-                 return "Please tell me the ages of both people involved.", []
-            
-            if state.unclear_age_ownership:
-                 # Explicit Clarification options
-                 age1, age2 = state.unclear_age_ownership[0], state.unclear_age_ownership[1]
-                 return (
-                     "Just to confirm, please select one option so I record this correctly:",
-                     [f"Female is {age1}, Male is {age2}", f"Female is {age2}, Male is {age1}"]
-                 )
-            
-            if state.female_age and not state.male_age:
-                 return "And how old is your partner?", []
-            
-            if state.male_age and not state.female_age:
-                 return "And how old are you?", []
-
-    # Case 1B/1C: Donor / Exploring Branch (Female only)
-    else:
-        if state.female_age is None:
-            return "How old are you?", []
+    update = OPTION_TABLE.get((step, message))
+    if update is not None:
+        # Fresh lists so the state never shares them with the catalog
+        return {key: list(val) if isinstance(val, list) else val for key, val in update.items()}
 
-    # 3. Relationship & Timeline (PARTNER BRANCH ONLY)
-    if state.male_partner_type == "Partner" or (state.male_partner_present is True and state.male_partner_type != "Donor"):
-        if state.first_marriage is None:
-            return "Is this the first marriage for both of you?", ["Yes", "No"]
-        if state.years_married is None:
-             # Free text expected, no options
-             return "How long have you been married?", []
-
-    # 4. Duration of Trying
-    # Zero Duration Handling
-    if state.years_trying == 0:
-        pass # Fall through to next step
-    elif state.pending_duration_value is not None:
-         val = state.pending_duration_value
-         val_str = str(int(val)) if val == int(val) else str(val)
-         return f"Could you clarify the time period for '{val_str}'?", [f"{val_str} years", f"{val_str} months", "Something else"]
-
-    if state.years_trying is None:
-        return "How long have you been trying to conceive?", []
+    if step in MULTI_SELECT_STEPS:
+        return _merge_selection(step, message)
+    if step == "ages" and len(state.unclear_age_ownership) >= 2:
+        return dict(_age_clarification_options(state)).get(message)
+    if step == "duration" and state.pending_duration_value is not None:
+        return dict(_duration_clarification_options(state)).get(message)
+    return None
 
-    # 5. Pregnancy History (CRITICAL)
-    if state.has_prior_pregnancies is None:
-        return "Has there ever been a pregnancy before?", ["Yes", "No"]
-    
-    if state.has_prior_pregnancies is False and not state.menstrual_regularity: # Check next step trigger
-         # Empathy Message for NO
-         return (
-             "I understand. Thank you for sharing that.\n\n"
-             "Are your menstrual cycles regular?", 
-             ["Yes", "No", "Not sure"]
-         )
-
-    if state.has_prior_pregnancies is True:
-         if state.pregnancy_source is None:
-              return "Was it a natural pregnancy or with treatment?", ["Natural pregnancy", "Pregnancy after treatment", "I’m not sure"]
-         if state.pregnancy_outcome is None:
-              return "What was the outcome?", ["Miscarriage", "Ectopic pregnancy", "Chemical pregnancy", "Live birth", "Ongoing"]
 
-    # 6. Menstrual History (NEW)
-    if state.menstrual_regularity is None:
-        return "Are your menstrual cycles regular?", ["Yes", "No", "Not sure"]
+# --- STEP GRAPH ---
+# The intake flow as data: the walk asks the first step whose guard holds and whose completion
+# predicate does not. `reads` lists the fields a step's guard/done/pass hook look at, so the
+# walk can resume from where it last stopped unless the turn changed one of those.
 
-    if state.menstrual_regularity in ["Regular", "NotSure"] or state.menstrual_regularity == "Irregular": 
-        # Logic: If Yes or Not Sure, ask Length. If No/Irregular, user likely knows it varies, but spec says ask length if Yes/NotSur.
-        # Strict spec: "5B. Cycle Length (if Yes or Not sure)"
-        if state.menstrual_regularity != "Irregular" and state.cycle_length is None:
-             return "About how many days apart do your periods usually come?", ["21–25 days", "26–30 days", "31–35 days", "Irregular / varies", "Not sure"]
+class Question(NamedTuple):
+    text: str
+    options: List[str] = []
+    multi_select: bool = False
+    step: Optional[str] = None # The step now pending (None when nothing is awaited)
 
-    if state.cycle_predictability is None:
-        return "Do your periods usually come predictably each month?", ["Yes", "No"]
 
-    if state.menarche_age is None:
-        return "At what age did you get your first period?", []
+StateTest = Callable[[CaseState], bool]
+StateText = Union[str, Callable[[CaseState], str]]
+StateOptions = Union[List[str], Callable[[CaseState], List[str]]]
 
-    # 6E. Sexual History (Screening)
-    if state.sexual_difficulty is None:
-        return (
-            "Are you and your partner generally able to have regular sexual intercourse without difficulty?",
-            ["Yes, without difficulty", "Sometimes difficult", "Rarely / with difficulty", "Not applicable (using donor / no partner)"]
-        )
 
-    # 7. Treatments
-    if not state.treatments_reviewed:
-        return "Have you tried any fertility treatments before?", ["IVF", "IUI", "Medications only", "No treatments so far"]
-
-    if state.has_had_treatments:
-         if state.treatment_type in ["IVF", "IUI"] and state.ivf_cycles is None and state.iui_cycles is None:
-              return "How many cycles have you undergone?", []
-         
-         # 7B. IVF Drill-Down
-         if state.treatment_type == "IVF":
-              # 1. Fresh/Frozen
-              if state.last_ivf_transfer_type is None:
-                   msg = f"You mentioned {state.ivf_cycles} IVF cycles. Let’s focus on the most recent one.\nWas it a fresh embryo transfer or a frozen embryo transfer?"
-                   return msg, ["Fresh transfer", "Frozen transfer", "Not sure"]
-              
-              # 2. Outcome
-              if state.last_ivf_outcome is None:
-                   return "What was the outcome of that last cycle?", ["Beta negative", "Biochemical pregnancy", "Miscarriage", "Ectopic pregnancy", "Ongoing pregnancy", "Live birth"]
+class Step(NamedTuple):
+    name: str
+    question: StateText = ""
+    options: StateOptions = []
+    multi_select: bool = False
+    guard: Optional[StateTest] = None             # Step applies to this case (None = always)
+    done: Optional[StateTest] = None              # Answered; the walk moves on (None = never, e.g. terminal messages)
+    reads: Tuple[str, ...] = ()
+    waits: bool = True                            # Awaits an answer (sets pending_step), vs. a terminal message
+    on_ask: Optional[Callable[[CaseState], None]] = None
+    on_pass: Optional[Callable[[CaseState], None]] = None
 
-    # 8. Tests Overview (BRANCHING)
-    if not state.tests_reviewed:
-        # Female Tests (Multi-select)
-        options = [
-            "Hormonal blood tests (AMH, TSH, FSH/LH)", 
-            "Ultrasound scans", 
-            "Tube testing (HSG / Laparoscopy / HyCoSy)",
-            "None of the above"
-        ]
-        return (
-            "Which of the following tests have been done for you? You can select all that apply.",
-            options,
-            True # Multi-select
-        )
-
-    # 8B. Male Tests (Partner Branch Only)
-    is_partner_flow = (state.male_partner_type == "Partner" or (state.male_partner_present is True and state.male_partner_type != "Donor"))
-    
-    # We use a virtual check: if we are in partner flow, tests_reviewed is True (meaning Female done), 
-    # but we haven't checked male tests yet.
-    # We can check if `male_tests_done_list` is populated OR if we just asked the male question?
-    # Better: We rely on the Extractor to populate `male_tests_done_list`.
-    # Complexity: How do we know if we *asked* it?
-    # Let's add a state field or use a specific logic.
-    # To keep CaseState simple, let's assume if tests_reviewed is True, we check male tests.
-    
-    # Logic: 
-    # 1. Ask Female Tests (Step 8A). Extractor sets tests_reviewed=True.
-    # 2. Next turn: tests_reviewed is True. Check if Partner Flow.
-    # 3. If Partner Flow, check if we have Male Tests data or a "Male Tests Skipped" flag?
-    # We don't have a flag. Let's look at `male_tests_done_list`.
-    # If it's empty, we ASK. (Unless they really have none? Then extractor sets ["None"]).
-    # So if `male_tests_done_list` is empty, we Ask.
-    
-    if is_partner_flow and state.tests_reviewed and not state.male_tests_done_list:
-        options = [
-            "Semen analysis",
-            "Hormonal blood tests",
-            "Genetic tests",
-            "None of the above"
-        ]
-        return (
-            "Which of the following tests have been done for your partner? You can select all that apply.",
-            options,
-            True # Multi-select
-        )
-
-    # 9. Reports Availability
-    # Only ask if ANY tests exist (Female or Male)
-    # Check: tests_done_list has entries (not "None") OR male_tests_done_list has entries (not "None")
-    has_female_tests = state.tests_done_list and "None" not in state.tests_done_list
-    has_male_tests = state.male_tests_done_list and "None" not in state.male_tests_done_list
-    
-    # 9A. Date Collection Loop (NEW REQ: Ask dates immediately)
-    if has_female_tests or has_male_tests:
-        all_tests = []
-        if has_female_tests: all_tests.extend(state.tests_done_list)
-        if has_male_tests: all_tests.extend(state.male_tests_done_list)
-        
-        # Check if we have dates for all
-        for test in all_tests:
-            if test not in state.reported_test_dates:
-                state.active_date_inquiry = test
-                return f"When was your {test} test done?", []
-        
-        # If loop finishes, all dates are present
+
+def _always(state: CaseState) -> bool:
+    return True
+
+
+PARTNER_FIELDS = ("male_partner_type", "male_partner_present")
+TEST_LIST_FIELDS = ("tests_done_list", "male_tests_done_list")
+
+
+def _is_partner_flow(state: CaseState) -> bool:
+    return state.male_partner_type == "Partner" or (state.male_partner_present is True and state.male_partner_type != "Donor")
+
+
+def _reported_tests(state: CaseState) -> List[str]:
+    """Tests done (female then male), unless the list is just "None"."""
+    tests = []
+    if state.tests_done_list and "None" not in state.tests_done_list: tests.extend(state.tests_done_list)
+    if state.male_tests_done_list and "None" not in state.male_tests_done_list: tests.extend(state.male_tests_done_list)
+    return tests
+
+
+# 0. Entry + Role Selection (CRITICAL - FIRST DECISION)
+GREETING = (
+    "Hello. I am Dr. Malpani’s AI assistant.\n"
+    "To help us understand your case, I’ll walk through your fertility history step by step.\n"
+    "I may pause or clarify at times — that’s how doctors avoid missing important details.\n\n"
+)
+
+
+# 2. Age Intake
+def _ages_done(state: CaseState) -> bool:
+    # Case 1A: Partner Branch needs both; Case 1B/1C: Donor / Exploring Branch (Female only)
+    return state.female_age is not None and (state.male_age is not None or not _is_partner_flow(state))
+
+
+def _ages_question(state: CaseState) -> str:
+    if not _is_partner_flow(state):
+        return "How old are you?"
+    if not state.female_age and not state.male_age and not state.unclear_age_ownership:
+        return "Please tell me the ages of both people involved."
+    if state.unclear_age_ownership:
+        # Explicit Clarification options
+        return "Just to confirm, please select one option so I record this correctly:"
+    if state.female_age and not state.male_age:
+        return "And how old is your partner?"
+    return "And how old are you?"
+
+
+def _ages_options(state: CaseState) -> List[str]:
+    if _is_partner_flow(state) and state.unclear_age_ownership:
+        return [text for text, _ in _age_clarification_options(state)]
+    return []
+
+
+# 4. Duration of Trying (Zero Duration Handling: 0 counts as answered, never clarified)
+def _duration_done(state: CaseState) -> bool:
+    return state.years_trying == 0 or (state.pending_duration_value is None and state.years_trying is not None)
+
+
+def _duration_question(state: CaseState) -> str:
+    if state.pending_duration_value is not None:
+        val = state.pending_duration_value
+        val_str = str(int(val)) if val == int(val) else str(val)
+        return f"Could you clarify the time period for '{val_str}'?"
+    return "How long have you been trying to conceive?"
+
+
+def _duration_options(state: CaseState) -> List[str]:
+    if state.pending_duration_value is not None:
+        return [text for text, _ in _duration_clarification_options(state)]
+    return []
+
+
+# 5/6. Menstrual History: after a "no" to pregnancy, acknowledge it first (Empathy Message for NO)
+def _menstrual_question(state: CaseState) -> str:
+    if state.has_prior_pregnancies is False:
+        return "I understand. Thank you for sharing that.\n\nAre your menstrual cycles regular?"
+    return "Are your menstrual cycles regular?"
+
+
+# 9A. Date Collection Loop (NEW REQ: Ask dates immediately)
+def _undated_test(state: CaseState) -> Optional[str]:
+    for test in _reported_tests(state):
+        if test not in state.reported_test_dates:
+            return test
+    return None
+
+
+def _ask_test_date(state: CaseState) -> None:
+    test = _undated_test(state)
+    if state.active_date_inquiry != test:
+        state.active_date_inquiry = test
+
+
+def _all_dates_collected(state: CaseState) -> None:
+    if state.active_date_inquiry is not None:
         state.active_date_inquiry = None
 
-    if (has_female_tests or has_male_tests) and not state.reports_availability_checked:
-        return (
-            "Do you currently have copies of these reports?",
-            ["Yes, I have them", "No, I would need to collect them", "Some reports only"],
-            False
-        )
-
-    # 10. Confirmation Step (Summary Generation)
-    if state.confirmation_status is None:
-        from app.engine.phase2 import check_validity
-        
-        summary_text = (
-            "Section A: My Understanding\n\n"
-            f"• Age: Female {state.female_age}" + (f", Male {state.male_age}" if state.male_age else "") + "\n"
-            f"• Duration trying to conceive: {state.years_trying} years\n"
-        )
-        
-        # Add Menstrual History
-        if state.menstrual_regularity:
-            summary_text += f"• Menstrual history: {state.menstrual_regularity}, {state.cycle_length or ''} days\n"
-            
-        # Add Sexual History
-        if state.sexual_difficulty:
-             summary_text += f"• Intercourse Difficulty: {state.sexual_difficulty}\n"
-
-        # Add Pregnancies
-        summary_text += f"• Previous pregnancies: {'Yes' if state.has_prior_pregnancies else 'No'}"
-        if state.has_prior_pregnancies:
-            summary_text += f" ({state.pregnancy_outcome or 'Unknown'})"
-        summary_text += "\n"
-
-        # Add Treatments
-        summary_text += f"• Fertility treatments: {state.treatment_type or 'None'}\n"
-        if state.treatment_type == "IVF":
-            details = []
-            if state.ivf_cycles: details.append(f"{state.ivf_cycles} cycles")
-            if state.last_ivf_transfer_type: details.append(f"Last transfer: {state.last_ivf_transfer_type}")
-            if state.last_ivf_outcome: details.append(f"Outcome: {state.last_ivf_outcome}")
-            if details:
-                summary_text += f"  - Details: {', '.join(details)}\n"
-        
-        # Add Tests with Validity
-        if state.tests_done_list:
-            f_tests_display = []
-            for t in state.tests_done_list:
-                if t == "None": continue
-                date_val = state.reported_test_dates.get(t)
-                if date_val:
-                    validity = check_validity(t, date_val)
-                    f_tests_display.append(f"{t} ({validity})")
-                else:
-                    f_tests_display.append(t)
-            
-            f_str = ", ".join(f_tests_display) if f_tests_display else "None"
-            summary_text += f"• Female tests done: {f_str}\n"
-        
-        if is_partner_flow:
-            m_tests_display = []
-            if state.male_tests_done_list:
-                for t in state.male_tests_done_list:
-                    if t == "None": continue
-                    date_val = state.reported_test_dates.get(t)
-                    if date_val:
-                        validity = check_validity(t, date_val)
-                        m_tests_display.append(f"{t} ({validity})")
-                    else:
-                        m_tests_display.append(t)
-                        
-                m_str = ", ".join(m_tests_display) if m_tests_display else "None"
-                summary_text += f"• Male tests done: {m_str}\n"
-
-        summary_text += "\n" + "Please let me know if I’ve understood this correctly so far."
-
-        return summary_text, ["Yes, that’s correct", "No, I’d like to correct something"], False
-        
-    # 11. Phase 2 Transition Logic (End of Phase 1)
-    if state.status == "INTAKE":
-         # Check if we should move to Phase 2
-         # Trigger: Confirmation is True
-         if state.confirmation_status is True:
-             state.status = "PHASE2_START" # Transient status to trigger Phase 2 logic next block
-             state.phase = "PHASE2"
-             # Fall through to Phase 2 block
-             
+
+# 10. Confirmation Step (Summary Generation)
+def _tests_with_validity(state: CaseState, tests: List[str]) -> str:
+    from app.engine.phase2 import check_validity
+
+    display = []
+    for t in tests:
+        if t == "None": continue
+        date_val = state.reported_test_dates.get(t)
+        if date_val:
+            validity = check_validity(t, date_val)
+            display.append(f"{t} ({validity})")
+        else:
+            display.append(t)
+    return ", ".join(display) if display else "None"
+
+
+# Fields the summary shows; it is rebuilt only when one of them changes (or the day does,
+# since test validity is relative to today)
+SUMMARY_READS = PARTNER_FIELDS + (
+    "female_age", "male_age", "years_trying", "menstrual_regularity", "cycle_length", "sexual_difficulty",
+    "has_prior_pregnancies", "pregnancy_outcome", "treatment_type", "ivf_cycles", "last_ivf_transfer_type",
+    "last_ivf_outcome", "tests_done_list", "male_tests_done_list", "reported_test_dates",
+)
+
+
+def _confirmation_summary(state: CaseState) -> str:
+    return state.memo(("confirmation_summary", date.today()), SUMMARY_READS, lambda: _render_confirmation_summary(state))
+
+
+def _render_confirmation_summary(state: CaseState) -> str:
+    summary_text = (
+        "Section A: My Understanding\n\n"
+        f"• Age: Female {state.female_age}" + (f", Male {state.male_age}" if state.male_age else "") + "\n"
+        f"• Duration trying to conceive: {state.years_trying} years\n"
+    )
+
+    # Add Menstrual History
+    if state.menstrual_regularity:
+        summary_text += f"• Menstrual history: {state.menstrual_regularity}, {state.cycle_length or ''} days\n"
+
+    # Add Sexual History
+    if state.sexual_difficulty:
+         summary_text += f"• Intercourse Difficulty: {state.sexual_difficulty}\n"
+
+    # Add Pregnancies
+    summary_text += f"• Previous pregnancies: {'Yes' if state.has_prior_pregnancies else 'No'}"
+    if state.has_prior_pregnancies:
+        summary_text += f" ({state.pregnancy_outcome or 'Unknown'})"
+    summary_text += "\n"
+
+    # Add Treatments
+    summary_text += f"• Fertility treatments: {state.treatment_type or 'None'}\n"
+    if state.treatment_type == "IVF":
+        details = []
+        if state.ivf_cycles: details.append(f"{state.ivf_cycles} cycles")
+        if state.last_ivf_transfer_type: details.append(f"Last transfer: {state.last_ivf_transfer_type}")
+        if state.last_ivf_outcome: details.append(f"Outcome: {state.last_ivf_outcome}")
+        if details:
+            summary_text += f"  - Details: {', '.join(details)}\n"
+
+    # Add Tests with Validity
+    if state.tests_done_list:
+        summary_text += f"• Female tests done: {_tests_with_validity(state, state.tests_done_list)}\n"
+    if _is_partner_flow(state):
+        summary_text += f"• Male tests done: {_tests_with_validity(state, state.male_tests_done_list)}\n"
+
+    summary_text += "\n" + "Please let me know if I’ve understood this correctly so far."
+    return summary_text
+
+
+# 11. Phase 2 Transition Logic (End of Phase 1): confirmation moves the case to Phase 2
+def _enter_phase2(state: CaseState) -> None:
+    state.status = "PHASE2_START" # Transient status to trigger Phase 2 logic next block
+    state.phase = "PHASE2"
+
+
+def _in_phase2(state: CaseState) -> bool:
+    return state.phase == "PHASE2"
+
+
+def _phase2_finish_without_tests(state: CaseState) -> None:
+    state.phase = "COMPLETE"
+
+
+def _phase2_missing_date_doc(state: CaseState) -> Optional[Dict]:
+    return next((d for d in state.phase2_documents if d['test_date'] is None), None)
+
+
+def _phase2_uploads_question(state: CaseState) -> str:
+    docs_count = len(state.phase2_documents)
+    if docs_count > 0:
+        return f"I have received {docs_count} report(s). Upload more if you have them, or click 'Done uploading' to proceed."
+    return "If you have your test reports, you can upload them here. I’ll review them the way a doctor would."
+
+
+def _run_validity_checks(state: CaseState) -> None:
+    # All Dates Present & Uploads Done -> VALIDITY CHECK
+    from app.engine.phase2 import check_validity
+
+    for doc in state.phase2_documents:
+        doc["validity_status"] = check_validity(doc["test_name"], doc["test_date"])
+    state.mark_dirty("phase2_documents")
+    state.phase2_verification_complete = True
+
+
+def _phase2_summary(state: CaseState) -> str:
+    from app.engine.phase2 import generate_validity_summary
+    return generate_validity_summary(state.phase2_documents)
+
+
+STEPS: List[Step] = [
+    Step("intro", GREETING + "Which of the following best describes your situation?", _options("intro"),
+         done=lambda s: s.intro_shown, reads=("intro_shown",)),
+    Step("ages", _ages_question, _ages_options,
+         done=_ages_done, reads=PARTNER_FIELDS + ("female_age", "male_age")),
+    # 3. Relationship & Timeline (PARTNER BRANCH ONLY)
+    Step("first_marriage", "Is this the first marriage for both of you?", _options("first_marriage"),
+         guard=_is_partner_flow, done=lambda s: s.first_marriage is not None, reads=PARTNER_FIELDS + ("first_marriage",)),
+    Step("years_married", "How long have you been married?",
+         guard=_is_partner_flow, done=lambda s: s.years_married is not None, reads=PARTNER_FIELDS + ("years_married",)),
+    Step("duration", _duration_question, _duration_options,
+         done=_duration_done, reads=("years_trying", "pending_duration_value")),
+    # 5. Pregnancy History (CRITICAL)
+    Step("prior_pregnancies", "Has there ever been a pregnancy before?", _options("prior_pregnancies"),
+         done=lambda s: s.has_prior_pregnancies is not None, reads=("has_prior_pregnancies",)),
+    Step("pregnancy_source", "Was it a natural pregnancy or with treatment?", _options("pregnancy_source"),
+         guard=lambda s: s.has_prior_pregnancies is True, done=lambda s: s.pregnancy_source is not None,
+         reads=("has_prior_pregnancies", "pregnancy_source")),
+    Step("pregnancy_outcome", "What was the outcome?", _options("pregnancy_outcome"),
+         guard=lambda s: s.has_prior_pregnancies is True, done=lambda s: s.pregnancy_outcome is not None,
+         reads=("has_prior_pregnancies", "pregnancy_outcome")),
+    # 6. Menstrual History (NEW)
+    Step("menstrual_regularity", _menstrual_question, _options("menstrual_regularity"),
+         done=lambda s: s.menstrual_regularity is not None, reads=("menstrual_regularity",)),
+    # Strict spec: "5B. Cycle Length (if Yes or Not sure)"
+    Step("cycle_length", "About how many days apart do your periods usually come?", _options("cycle_length"),
+         guard=lambda s: s.menstrual_regularity in ["Regular", "NotSure"], done=lambda s: s.cycle_length is not None,
+         reads=("menstrual_regularity", "cycle_length")),
+    Step("cycle_predictability", "Do your periods usually come predictably each month?", _options("cycle_predictability"),
+         done=lambda s: s.cycle_predictability is not None, reads=("cycle_predictability",)),
+    Step("menarche", "At what age did you get your first period?",
+         done=lambda s: s.menarche_age is not None, reads=("menarche_age",)),
+    # 6E. Sexual History (Screening)
+    Step("sexual_history", "Are you and your partner generally able to have regular sexual intercourse without difficulty?",
+         _options("sexual_history"), done=lambda s: s.sexual_difficulty is not None, reads=("sexual_difficulty",)),
+    # 7. Treatments
+    Step("treatments", "Have you tried any fertility treatments before?", _options("treatments"),
+         done=lambda s: s.treatments_reviewed, reads=("treatments_reviewed",)),
+    Step("treatment_cycles", "How many cycles have you undergone?",
+         guard=lambda s: bool(s.has_had_treatments) and s.treatment_type in ["IVF", "IUI"],
+         done=lambda s: s.ivf_cycles is not None or s.iui_cycles is not None,
+         reads=("has_had_treatments", "treatment_type", "ivf_cycles", "iui_cycles")),
+    # 7B. IVF Drill-Down
+    Step("ivf_transfer_type",
+         lambda s: f"You mentioned {s.ivf_cycles} IVF cycles. Let’s focus on the most recent one.\nWas it a fresh embryo transfer or a frozen embryo transfer?",
+         _options("ivf_transfer_type"),
+         guard=lambda s: bool(s.has_had_treatments) and s.treatment_type == "IVF", done=lambda s: s.last_ivf_transfer_type is not None,
+         reads=("has_had_treatments", "treatment_type", "last_ivf_transfer_type")),
+    Step("ivf_outcome", "What was the outcome of that last cycle?", _options("ivf_outcome"),
+         guard=lambda s: bool(s.has_had_treatments) and s.treatment_type == "IVF", done=lambda s: s.last_ivf_outcome is not None,
+         reads=("has_had_treatments", "treatment_type", "last_ivf_outcome")),
+    # 8. Tests Overview (BRANCHING)
+    Step("female_tests", "Which of the following tests have been done for you? You can select all that apply.",
+         _options("female_tests"), multi_select=True, done=lambda s: s.tests_reviewed, reads=("tests_reviewed",)),
+    # 8B. Male Tests (Partner Branch Only). The extractor sets ["None"] when none were done,
+    # so an empty list means the question has not been answered yet.
+    Step("male_tests", "Which of the following tests have been done for your partner? You can select all that apply.",
+         _options("male_tests"), multi_select=True,
+         guard=lambda s: _is_partner_flow(s) and s.tests_reviewed, done=lambda s: bool(s.male_tests_done_list),
+         reads=PARTNER_FIELDS + ("tests_reviewed", "male_tests_done_list")),
+    # 9. Reports Availability - only if ANY tests exist (Female or Male); dates first
+    Step("test_date", lambda s: f"When was your {s.active_date_inquiry} test done?",
+         guard=lambda s: bool(_reported_tests(s)), done=lambda s: _undated_test(s) is None,
+         reads=TEST_LIST_FIELDS + ("reported_test_dates", "active_date_inquiry"),
+         on_ask=_ask_test_date, on_pass=_all_dates_collected),
+    Step("reports_availability", "Do you currently have copies of these reports?", _options("reports_availability"),
+         guard=lambda s: bool(_reported_tests(s)), done=lambda s: s.reports_availability_checked,
+         reads=TEST_LIST_FIELDS + ("reports_availability_checked",)),
+    Step("confirmation", _confirmation_summary, _options("confirmation"),
+         done=lambda s: s.confirmation_status is not None, reads=("confirmation_status",)),
+    Step("phase2_entry", guard=lambda s: s.status == "INTAKE" and s.confirmation_status is True,
+         done=_always, reads=("status", "confirmation_status"), on_pass=_enter_phase2),
+
     # --- PHASE 2 ORCHESTRATION ---
-    if state.phase == "PHASE2":
-        
-        # A. Entry Check (Skip if no tests)
-        has_tests = False
-        if state.tests_done_list and "None" not in state.tests_done_list: has_tests = True
-        if state.male_tests_done_list and "None" not in state.male_tests_done_list: has_tests = True
-        
-        if not has_tests:
-            state.phase = "COMPLETE"
-            return "Based on your history, no prior tests were reported. We can proceed to the next stage.", []
-
-        # B. Introduction
-        # We need a flag to know if we already showed the intro vs we are in the loop.
-        # Use state.phase2_documents check? No, user might not have uploaded yet.
-        # Let's use a specific flag or reuse `intro_shown`? No, specific Phase 2 intro.
-        # Let's assume if we are in PHASE2 and no docs yet, we show intro.
-        # But what if they truly have none to upload despite having tests?
-        # We need an option "I don't have reports".
-        
-        # Better: Check existing documents count or a specific "phase2_intro_shown" flag.
-        # Let's use a dynamic check:
-        # If we haven't asked for uploads yet.
-        # But we don't have a flag. Let's add one to State if needed, or infer.
-        # Inference: If `phase2_documents` is empty AND we haven't received a "No files" signal.
-        # Complexity: The user can upload 1 file, then waiting for more. 
-        # So we need an explicit "Done uploading" Loop.
-        
-        docs_count = len(state.phase2_documents)
-        
-        # Upload Loop
-        # If we are waiting for uploads or dates.
-        
-        # 1. Ask for Uploads (Initial)
-        # Condition: We just entered Phase 2 (implied by lack of docs and 'verification_complete' is False)
-        # But wait, what if they upoaded 0 files?
-        # We need to detect the "Start of Phase 2".
-        # Let's rely on the previous turn returning "CONVERSATION_COMPLETE" which wasn't quite right.
-        # The previous block returned "Please let me know if correct".
-        # User says "Yes". Extractor sets confirmation_status=True.
-        # NEXT REQUEST: Orchestrator sees confirmation=True -> sets PHASE2.
-        # AND THEN executes this block.
-        
-        if not state.phase2_documents and not hasattr(state, "phase2_intro_shown"):
-             # We need to store that we showed it.
-             pass 
-             
-        # Use phase2_uploads_complete flag
-        # If user is NOT done uploading, and we are not forcing a date question (which we do if doc exists),
-        # Actually, if user uploads, we receive file. if user talks, we receive message.
-        
-        # Priority 1: Check if verification already done
-        if state.phase2_verification_complete:
-             # Transition to Phase 3
-             return "Phase 2 Analysis Complete. Moving to Pattern Recognition.", []
-
-        # Priority 2: Missing Dates (ALWAYS ask immediately)
-        missing_date_doc = next((d for d in state.phase2_documents if d['test_date'] is None), None)
-        if missing_date_doc:
-            return f"When was the {missing_date_doc['test_name']} test done?", []
-
-        # Priority 3: Uploads Done?
-        # If NOT done uploading, keep asking/waiting.
-        if not state.phase2_uploads_complete:
-            docs_count = len(state.phase2_documents)
-            msg = "If you have your test reports, you can upload them here. I’ll review them the way a doctor would."
-            if docs_count > 0:
-                msg = f"I have received {docs_count} report(s). Upload more if you have them, or click 'Done uploading' to proceed."
-            
-            return msg, ["Done uploading", "I don't have any reports"]
-
-        # Priority 4: All Dates Present & Uploads Done -> VALIDITY CHECK & SUMMARY
-        # We reach here if uploads_complete is True AND no missing dates.
-        
-        from app.engine.phase2 import check_validity, generate_validity_summary
-        
-        # Run Checks
-        processed_docs = []
-        for doc in state.phase2_documents:
-            status = check_validity(doc["test_name"], doc["test_date"])
-            doc["validity_status"] = status
-            processed_docs.append(doc)
-            
-        # Update State (In-place modification works for object refs, but cleaner to assign?)
-        # Orchestrator doesn't usually update state, Extractor (or Main) does.
-        # But here we are the "Engine". We are allowed to modify state before returning?
-        # Yes, python objects are mutable.
-        state.phase2_documents = processed_docs
-        state.phase2_verification_complete = True
-        
-        summary = generate_validity_summary(processed_docs)
-        
-        return summary, ["Proceed to next steps"]
-
-    return "CONVERSATION_COMPLETE", [], False
+    # A. Entry Check (Skip if no tests)
+    Step("phase2_no_tests", "Based on your history, no prior tests were reported. We can proceed to the next stage.",
+         guard=lambda s: _in_phase2(s) and not _reported_tests(s), reads=("phase",) + TEST_LIST_FIELDS,
+         waits=False, on_ask=_phase2_finish_without_tests),
+    # Priority 1: Check if verification already done (Transition to Phase 3)
+    Step("phase2_complete", "Phase 2 Analysis Complete. Moving to Pattern Recognition.",
+         guard=lambda s: _in_phase2(s) and s.phase2_verification_complete, reads=("phase", "phase2_verification_complete"),
+         waits=False),
+    # Priority 2: Missing Dates (ALWAYS ask immediately)
+    Step("phase2_test_date", lambda s: f"When was the {_phase2_missing_date_doc(s)['test_name']} test done?",
+         guard=_in_phase2, done=lambda s: _phase2_missing_date_doc(s) is None, reads=("phase", "phase2_documents")),
+    # Priority 3: Uploads Done? If NOT done uploading, keep asking/waiting.
+    Step("phase2_uploads", _phase2_uploads_question, _options("phase2_uploads"),
+         guard=_in_phase2, done=lambda s: s.phase2_uploads_complete, reads=("phase", "phase2_uploads_complete")),
+    # Priority 4: All Dates Present & Uploads Done -> VALIDITY CHECK & SUMMARY
+    Step("phase2_summary", _phase2_summary, ["Proceed to next steps"],
+         guard=_in_phase2, reads=("phase",), waits=False, on_ask=_run_validity_checks),
+
+    Step("complete", "CONVERSATION_COMPLETE", waits=False),
+]
+
+
+class StepGraph:
+    """
+    STEPS compiled once at import: name -> position, and for each position the fields read by
+    the steps before it (what must stay unchanged to resume the walk there).
+    """
+
+    def __init__(self, steps: List[Step]):
+        self.steps = steps
+        self.index = {step.name: i for i, step in enumerate(steps)}
+        if len(self.index) != len(steps):
+            raise ValueError("Step names must be unique")
+        # (step, guard, done, on_pass) per position, so the walk skips NamedTuple attribute lookups
+        self.plan = [(step, step.guard, step.done, step.on_pass) for step in steps]
+        self.upstream_reads: List[FrozenSet[str]] = []
+        seen: set = set()
+        for step in steps:
+            self.upstream_reads.append(frozenset(seen))
+            seen.update(step.reads)
+
+    def start(self, state: CaseState) -> int:
+        """Where the walk may begin: the cursor, unless this turn changed a field a step before it reads."""
+        position = self.index.get(state.step_cursor)
+        if position is None or not self.upstream_reads[position].isdisjoint(state.changed_fields):
+            return 0
+        return position
+
+    def walk(self, state: CaseState, start: int = 0) -> Step:
+        """The first step from `start` that applies and is not done (running pass hooks on the way)."""
+        for step, guard, done, on_pass in islice(self.plan, start, None):
+            if guard is not None and not guard(state):
+                continue
+            if done is not None and done(state):
+                if on_pass is not None:
+                    on_pass(state)
+                continue
+            return step
+        raise RuntimeError("Step graph has no terminal step") # "complete" always applies
+
+    def describe(self) -> List[Dict]:
+        """The graph as plain data, for introspection (GET /flow) and tests."""
+        return [
+            {
+                "name": step.name,
+                "question": step.question if isinstance(step.question, str) else None, # None = built from the state
+                "options": step.options if isinstance(step.options, list) else None,
+                "multi_select": step.multi_select,
+                "conditional": step.guard is not None,
+                "terminal": step.done is None,
+                "waits": step.waits,
+                "reads": list(step.reads),
+            }
+            for step in self.steps
+        ]
+
+
+STEP_GRAPH = StepGraph(STEPS)
+
+
+def _ask(state: CaseState, step: Step) -> Question:
+    if step.on_ask is not None:
+        step.on_ask(state)
+    # Terminal steps can rewrite what earlier steps read (e.g. the Phase 2 summary marks
+    # verification complete), so the walk after one starts from the top
+    pending = step.name if step.waits else None
+    if state.pending_step != pending or state.step_cursor != pending:
+        state.pending_step = state.step_cursor = pending
+    text = step.question(state) if callable(step.question) else step.question
+    options = step.options(state) if callable(step.options) else list(step.options)
+    return Question(text, options, step.multi_select, pending)
+
+
+def get_next_question(state: CaseState) -> Question:
+    """
+    DETERMINISTIC ORCHESTRATOR (FINAL SPEC - PHASE 1)
+    Strictly follows the sequential decision flow from the USER'S FINAL SPEC (STEP_GRAPH).
+    Records the step it is now waiting on in `state.pending_step` (None when nothing is pending).
+
+    The walk resumes at `state.step_cursor` unless a step before it reads one of
+    `state.changed_fields`, so callers commit() the state once the reply is built.
+    """
+    if not state.intro_shown:
+        state.intro_shown = True
+        if state.male_partner_type is None:
+            return _ask(state, STEP_GRAPH.steps[0])
+        # An opening narrative already told us the situation: greet, then go to the first open question
+        question = _ask(state, STEP_GRAPH.walk(state))
+        return question._replace(text=GREETING + "Thank you, that helps. " + question.text)
+
+    return _ask(state, STEP_GRAPH.walk(state, STEP_GRAPH.start(state)))
@@ -1,7 +1,10 @@
 import re
 from datetime import datetime, date, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 from app.models.case_state import CaseState
+from app.engine.keywords import SCANNER
+from app.utils.dates import to_date
+from app.utils.scanner import first_ranked
 
 # 1. VALIDITY DATASET (Days)
 VALIDITY_DATASET = {
@@ -47,71 +50,34 @@ VALIDITY_DATASET = {
 }
 
 # 2. TEST TYPE DETECTION
-KEYWORD_MAP = {
-    "amh": "AMH",
-    "semen": "Semen Analysis",
-    "sperm": "Semen Analysis",
-    "hsg": "HSG",
-    "tube": "HSG",
-    "hysterosalpingogram": "HSG",
-    "tsh": "TSH",
-    "prolactin": "Prolactin",
-    "afc": "AFC",
-    "follicle": "AFC",
-    "fsh": "FSH",
-    "lh": "LH",
-    "estradiol": "Estradiol E2",
-    "thyroid": "TSH",
-    "karyotype": "Male Karyotype", # Need context for Female/Male, defaulting generic if logic allows, or explicit check
-    "genetic": "Genetic Tests"
-}
+# Filename keywords live in app.engine.keywords (KEYWORD_MAP), scanned with the chat catalogs.
+CAMEL_CASE = re.compile(r'(?<=[a-z])(?=[A-Z])')
+ACRONYM_END = re.compile(r'(?<=[A-Z])(?=[A-Z][a-z])')
 
 def detect_test_type(filename: str) -> str:
     """
     Identifies the test type based on the filename keywords.
     Returns 'UNKNOWN_TEST' if no match found.
     """
-    fname = filename.lower()
-    
-    # Specific Checks
-    if "semen" in fname or "sperm" in fname:
-        return "Semen Analysis"
-    if "hsg" in fname or "tube" in fname or "patency" in fname:
-        return "HSG"
-    if "amh" in fname:
-        return "AMH"
-    if "tsh" in fname:
-        return "TSH"
-    if "fsh" in fname:
-        return "FSH"
-    if "lh" in fname:
-        return "LH"
-    if "prolactin" in fname:
-        return "Prolactin"
-    if "afc" in fname or "antral" in fname:
-        return "AFC"
-    if "scan" in fname or "ultrasound" in fname:
-        return "Pelvic Ultrasound"
-    if "karyotype" in fname:
-        return "Genetic tests" # Generic for validity lookup
-        
-    return "UNKNOWN_TEST"
+    # "SemenAnalysis.pdf" -> "semen analysis.pdf", so whole-word matching still sees the words.
+    # The KEYWORD_MAP entries are stems, which covers names that run on ("amhreport.pdf",
+    # "PatientAMHresult.pdf" -> "patient amhresult.pdf"). Where an acronym runs into a word, the
+    # name is also read split there ("IMGSemen.pdf" -> "img semen.pdf").
+    words = CAMEL_CASE.sub(" ", filename)
+    fname = words.lower()
+    hits = SCANNER.scan(fname)
+    acronyms = ACRONYM_END.sub(" ", words).lower()
+    if acronyms != fname:
+        hits += SCANNER.scan(acronyms)
+    return first_ranked(hit for hit in hits if hit.category == "test_type") or "UNKNOWN_TEST"
 
-def check_validity(test_name: str, test_date_str: str) -> str:
+def check_validity(test_name: str, test_date: Union[date, str, None]) -> str:
     """
     Compares test_date with today based on VALIDITY_DATASET.
-    test_date_str expected in ISO format YYYY-MM-DD or similar parsable.
+    test_date is a date (as the extractor stores it) or an ISO/free-text date string.
     """
-    try:
-        # Simple parser - assuming ISO for now as state stores it
-        # If user input is "Jan 2024", extractor must convert it before calling this, 
-        # OR we parse here.
-        # Let's assume the state stores a datetime date object or ISO string.
-        if isinstance(test_date_str, date):
-             t_date = test_date_str
-        else:
-             t_date = datetime.strptime(test_date_str, "%Y-%m-%d").date()
-    except:
+    t_date = to_date(test_date)
+    if t_date is None:
         return "Date Unknown"
 
     validity_days = VALIDITY_DATASET.get(test_name, VALIDITY_DATASET.get(test_name.split(" ")[0], 180)) # Default 6 months
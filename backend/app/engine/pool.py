@@ -0,0 +1,315 @@
+import asyncio
+import hashlib
+import itertools
+import multiprocessing
+import os
+import signal
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from fastapi import HTTPException
+
+from app.engine.consultation import ChatResponse, attach_documents, next_response, open_session, seed_sessions
+from app.engine.llm import LLMExtractor
+from app.engine.turn import answer, take_turn
+from app.models.case_state import CaseState
+from app.utils.session_store import SessionConflict, get_session_store
+
+# --- SESSION-AFFINE ENGINE POOL ---
+# ENGINE_PROCESSES=N moves the sessions out of the web server into N engine processes. Every
+# session id belongs to one engine (rendezvous hashing over the live ones), which keeps its
+# CaseState hot in its own store and runs all of its turns: /chat and /upload become a short
+# message to the owner and back, no state is copied per turn and nothing is locked across
+# processes. The engines share the SQLite file; since ownership is exclusive each one writes
+# behind, like a lone server.
+#
+# When an engine dies, its calls in flight fail with EngineDied (the endpoints redo them) and
+# only its sessions move: to the survivors, which load them from the database (the dead engine's
+# last flush interval is lost, as in a crash). A replacement is spawned into the same slot;
+# before it serves, every survivor writes and unloads the sessions that are its again
+# (release), so a session is never hot in two engines.
+#
+# Engines are started with "spawn", warmed with a throwaway turn, and ignore Ctrl-C: the web
+# server stops them on shutdown, after they flush.
+
+WARM_MESSAGE = "I am 32 and my husband is 35, trying for 3 years"
+RESPAWN_DELAY = 1.0 # Seconds between attempts to replace an engine that keeps failing to start
+
+
+def owner(session_id: str, members: Sequence[int]) -> int:
+    """Rendezvous hashing: the slot scoring highest for this id. Adding or removing a slot only moves that slot's ids."""
+    return max(members, key=lambda slot: hashlib.blake2b(f"{slot}:{session_id}".encode(), digest_size=8).digest())
+
+
+class EngineDied(Exception):
+    """The engine that owned the session died (or is gone); redo the call, it now has another owner."""
+
+
+# --- Engine process ---
+
+class Engine:
+    """One engine process: its share of the sessions, in its own store, and the operations on them."""
+
+    def __init__(self, slot: int, members: Sequence[int]):
+        self.slot = slot
+        self.members = tuple(members)
+        self.sessions = get_session_store()
+        self.midturn: Dict[str, CaseState] = {} # Turns waiting on the LLM (between turn() and answer())
+
+    def owns(self, session_id: str) -> bool:
+        return owner(session_id, self.members) == self.slot
+
+    def turn(self, session_id: str, message: str, llm: bool, known_version: Optional[int]) -> Tuple:
+        """
+        take_turn on the session: (tier, extraction seconds, updates, pending step, response).
+        Without a response the rules were unsure; the server asks the LLM and calls answer().
+        """
+        state = open_session(self.sessions, session_id)
+        tier, seconds, updates, reply = take_turn(state, message, llm and LLMExtractor.handles(state.pending_step))
+        if reply is None:
+            self.midturn[session_id] = state
+            return tier, seconds, updates, state.pending_step, None
+        return tier, seconds, updates, None, self._end(session_id, state, reply, known_version)
+
+    def answer(self, session_id: str, updates: Dict, known_version: Optional[int]) -> ChatResponse:
+        state = self.midturn.pop(session_id)
+        return self._end(session_id, state, answer(state, updates), known_version)
+
+    def _end(self, session_id: str, state: CaseState, reply, known_version: Optional[int]) -> ChatResponse:
+        response = next_response(state, known_version, reply)
+        self.sessions.put(session_id, state)
+        if not self.owns(session_id):
+            self.sessions.release(self.owns) # Moved to a new engine while waiting on the LLM: hand it over now
+        return response
+
+    def upload(self, session_id: str, documents: List[Tuple[str, str, int]]) -> List[Dict]:
+        return attach_documents(self.sessions, session_id, documents)
+
+    def existing(self, session_ids: List[str]) -> Set[str]:
+        return self.sessions.existing(session_ids)
+
+    def create(self, forms: List[Tuple[str, Dict]]) -> List[Optional[ChatResponse]]:
+        return seed_sessions(self.sessions, forms)
+
+    def rebalance(self, members: Sequence[int]) -> int:
+        """New live slots: releases the sessions that now belong elsewhere (how many)."""
+        self.members = tuple(members)
+        return self.sessions.release(self.owns)
+
+    def stats(self) -> Dict:
+        return {"slot": self.slot, "pid": os.getpid(), "midturn": len(self.midturn), **self.sessions.stats}
+
+
+def _engine_main(slot: int, members: Sequence[int], inbox, outbox) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    engine = Engine(slot, members)
+    take_turn(CaseState(), WARM_MESSAGE)
+    outbox.send((0, "ready", os.getpid()))
+    while True:
+        call_id, op, args = inbox.get()
+        if op == "close":
+            engine.sessions.close()
+            return
+        try:
+            outbox.send((call_id, "ok", getattr(engine, op)(*args)))
+        except HTTPException as e:
+            outbox.send((call_id, "http", (e.status_code, e.detail)))
+        except SessionConflict as e:
+            outbox.send((call_id, "conflict", e.session_id))
+        except Exception as e:
+            outbox.send((call_id, "error", f"{type(e).__name__}: {e}"))
+
+
+# --- Web server side ---
+
+class EngineHandle:
+    __slots__ = ("slot", "process", "inbox", "outbox", "pid", "calls", "ready")
+
+    def __init__(self, slot: int, process, inbox, outbox, pid: int):
+        self.slot = slot
+        self.process = process
+        self.inbox = inbox    # Calls to the engine (multiprocessing.Queue: put() never blocks the loop)
+        self.outbox = outbox  # Its replies, read by one thread per engine
+        self.pid = pid
+        self.calls: Dict[int, asyncio.Future] = {}
+        self.ready = asyncio.Event() # Set once the survivors released its sessions
+
+
+class EnginePool:
+    """Routes session calls to their owning engine process, and replaces engines that die."""
+
+    def __init__(self, processes: int):
+        self.processes = processes
+        self.context = multiprocessing.get_context("spawn")
+        self.engines: Dict[int, EngineHandle] = {}
+        self.members: Tuple[int, ...] = () # Live slots, the ones sessions are hashed over
+        self.call_ids = itertools.count(1)
+        self.counters = {"calls": 0, "died": 0, "replaced": 0, "released": 0}
+        self.closing = False
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        members = tuple(range(self.processes))
+        for handle in await asyncio.gather(*(self._spawn(slot, members) for slot in members)):
+            handle.ready.set()
+        self.members = members
+
+    async def _spawn(self, slot: int, members: Sequence[int]) -> EngineHandle:
+        inbox = self.context.Queue()
+        outbox, writer = self.context.Pipe(duplex=False)
+        process = self.context.Process(target=_engine_main, args=(slot, members, inbox, writer), name=f"engine-{slot}", daemon=True)
+        process.start()
+        writer.close() # Ours; the reader sees EOF once the engine's copy goes with it
+        try:
+            _, _, pid = await self.loop.run_in_executor(None, outbox.recv)
+        except (EOFError, OSError):
+            inbox.cancel_join_thread()
+            await self.loop.run_in_executor(None, process.join)
+            raise EngineDied(f"Engine {slot} failed to start (exit code {process.exitcode})")
+        handle = self.engines[slot] = EngineHandle(slot, process, inbox, outbox, pid)
+        threading.Thread(target=self._read, args=(handle,), name=f"engine-{slot}-replies", daemon=True).start()
+        return handle
+
+    def _read(self, handle: EngineHandle) -> None:
+        try:
+            while True:
+                call_id, status, result = handle.outbox.recv()
+                self.loop.call_soon_threadsafe(self._settle, handle, call_id, status, result)
+        except (EOFError, OSError):
+            try:
+                self.loop.call_soon_threadsafe(self._died, handle)
+            except RuntimeError:
+                pass # The loop is closed: the server is gone already
+
+    def _settle(self, handle: EngineHandle, call_id: int, status: str, result: Any) -> None:
+        future = handle.calls.pop(call_id, None)
+        if future is None or future.done():
+            return # Its request was cancelled (client gone)
+        if status == "ok":
+            future.set_result(result)
+        elif status == "http":
+            future.set_exception(HTTPException(status_code=result[0], detail=result[1]))
+        elif status == "conflict":
+            future.set_exception(SessionConflict(result))
+        else:
+            future.set_exception(RuntimeError(f"Engine {handle.slot}: {result}"))
+
+    def _died(self, handle: EngineHandle) -> None:
+        if self.engines.get(handle.slot) is not handle:
+            return
+        del self.engines[handle.slot]
+        handle.inbox.cancel_join_thread()
+        for future in handle.calls.values():
+            if not future.done():
+                future.set_exception(EngineDied(f"Engine {handle.slot} died"))
+        handle.calls.clear()
+        handle.ready.set() # Wakes calls queued for it; they find it gone
+        self.loop.run_in_executor(None, handle.process.join)
+        if self.closing:
+            return
+        self.counters["died"] += 1
+        print(f"Engine {handle.slot} (pid {handle.pid}) died; its sessions move to the other engines")
+        # Survivors only gain sessions, which they load from the database on their next request
+        self.members = tuple(slot for slot in self.members if slot != handle.slot)
+        for survivor in self.engines.values():
+            self._send(survivor, "rebalance", self.members)
+        self.loop.create_task(self._replace(handle.slot))
+
+    async def _replace(self, slot: int) -> None:
+        while True:
+            if self.closing:
+                return
+            try:
+                handle = await self._spawn(slot, tuple(sorted({*self.members, slot})))
+                break
+            except EngineDied as e:
+                print(f"{e}; retrying in {RESPAWN_DELAY}s")
+                await asyncio.sleep(RESPAWN_DELAY)
+        # Route its sessions back to it at once (calls wait on `ready`), and let it serve them
+        # once every engine has written and unloaded its copies
+        self.members = tuple(sorted({*self.members, slot}))
+        released = await asyncio.gather(
+            *(self._send(engine, "rebalance", self.members) for engine in list(self.engines.values())),
+            return_exceptions=True,
+        )
+        self.counters["released"] += sum(count for count in released if isinstance(count, int))
+        self.counters["replaced"] += 1
+        handle.ready.set()
+
+    def _send(self, handle: EngineHandle, op: str, *args: Any) -> asyncio.Future:
+        future = self.loop.create_future()
+        if self.engines.get(handle.slot) is not handle:
+            future.set_exception(EngineDied(f"Engine {handle.slot} died"))
+            return future
+        call_id = next(self.call_ids)
+        handle.calls[call_id] = future
+        handle.inbox.put((call_id, op, args))
+        return future
+
+    def owner(self, session_id: str) -> int:
+        if not self.members:
+            raise EngineDied("No engine is running")
+        return owner(session_id, self.members)
+
+    async def call(self, slot: int, op: str, *args: Any) -> Any:
+        """Runs Engine.<op>(*args) on the engine in `slot` (see owner()); raises what it raised."""
+        handle = self.engines.get(slot)
+        if handle is None:
+            raise EngineDied(f"Engine {slot} is not running")
+        await handle.ready.wait()
+        self.counters["calls"] += 1
+        return await self._send(handle, op, *args)
+
+    async def existing(self, session_ids: Iterable[str]) -> Set[str]:
+        """Which of `session_ids` already have a session, asking each owner about its own."""
+        found = await asyncio.gather(*(self.call(slot, "existing", ids) for slot, ids in self._by_owner(session_ids).items()))
+        return set().union(*found)
+
+    async def create(self, forms: List[Tuple[str, Dict]]) -> List[Optional[ChatResponse]]:
+        """seed_sessions for each (session_id, state updates), on its owner; responses in `forms` order."""
+        by_owner = self._by_owner(forms, key=lambda form: form[0])
+        created = await asyncio.gather(*(self.call(slot, "create", batch) for slot, batch in by_owner.items()))
+        responses = {form[0]: response for batch, batch_created in zip(by_owner.values(), created)
+                     for form, response in zip(batch, batch_created)}
+        return [responses[session_id] for session_id, _ in forms]
+
+    def _by_owner(self, items: Iterable, key=lambda item: item) -> Dict[int, List]:
+        groups: Dict[int, List] = {}
+        for item in items:
+            groups.setdefault(self.owner(key(item)), []).append(item)
+        return groups
+
+    async def stats(self) -> Dict:
+        engines = await asyncio.gather(
+            *(self.call(slot, "stats") for slot in sorted(self.engines)), return_exceptions=True
+        )
+        engines = [engine for engine in engines if isinstance(engine, dict)]
+        return {
+            "backend": "engines",
+            "processes": self.processes,
+            "members": list(self.members),
+            **self.counters,
+            "hot": sum(engine["hot"] for engine in engines),
+            "engines": engines,
+        }
+
+    def close(self) -> None:
+        """Stops the engines (each flushes its store first); call on shutdown."""
+        self.closing = True
+        for handle in list(self.engines.values()):
+            handle.inbox.put((0, "close", ()))
+        for handle in list(self.engines.values()):
+            handle.process.join(timeout=10)
+            if handle.process.is_alive():
+                handle.process.terminate()
+
+
+def get_engine_pool() -> Optional[EnginePool]:
+    """ENGINE_PROCESSES > 0: the sessions live in that many engine processes (None: in the web server, the default)."""
+    processes = int(os.getenv("ENGINE_PROCESSES", "0"))
+    if processes <= 0:
+        return None
+    if os.getenv("SESSION_STORE", "sqlite") == "memory":
+        raise ValueError("ENGINE_PROCESSES needs the SQLite session store: sessions move between engines through it")
+    return EnginePool(processes)
@@ -0,0 +1,87 @@
+import time
+from typing import Dict, Optional, Tuple
+
+from app.engine.extractor import STEP_FIELDS, extract_with_confidence
+from app.engine.narrative import extract_narrative
+from app.engine.orchestrator import Question, get_next_question, resolve_option
+from app.engine.summary import generate_section_a
+from app.models.case_state import CaseState
+from app.utils.confidence import CONFIDENCE_THRESHOLD
+
+# --- ONE CHAT TURN ---
+# The CPU-bound part of a turn (extraction, orchestration, the Section A summary) as plain
+# functions of the CaseState, so the server can run them off the event loop (see
+# app.utils.executor). Only the LLM fallback is left to the caller: it is I/O, and awaited there.
+
+COMPLETE_REPLY = "Thank you for providing those details. We are now ready to proceed with Phase 2."
+
+
+def read_message(state: CaseState, message: str, llm: bool = False) -> Tuple[Dict, str]:
+    """
+    Tiered extraction for one turn, short of the LLM call: returns (updates, tier).
+    option click -> rule-based extractor (+ narrative reading of long multi-clause messages)
+    -> (only below CONFIDENCE_THRESHOLD) tier "llm" when `llm` (an LLM handles the pending step),
+    for the caller to ask it and merge_llm_updates(); otherwise the orchestrator's clarification question.
+    """
+    updates = resolve_option(state, message)
+    if updates is not None:
+        return updates, "option"
+
+    current_state_dict = state.snapshot()
+    updates, confidence = extract_with_confidence(message, current_state_dict, step=state.pending_step)
+    narrative = extract_narrative(message, current_state_dict)
+    if narrative:
+        # Keep the rules' answer to the pending question only; the cue-based reading of the
+        # whole history beats their guesses everywhere else
+        pending_fields = STEP_FIELDS.get(state.pending_step, ())
+        return {**{k: v for k, v in updates.items() if k in pending_fields}, **narrative}, "narrative"
+    if confidence >= CONFIDENCE_THRESHOLD:
+        return updates, "rules"
+    return updates, "llm" if llm else "clarify"
+
+
+def merge_llm_updates(updates: Dict, llm_updates: Dict) -> Dict:
+    """The LLM answered the pending fields; drop the rules' ownership/unit guesses."""
+    if not llm_updates:
+        return updates
+    updates = {**updates, **llm_updates}
+    if "female_age" in llm_updates or "male_age" in llm_updates:
+        updates["unclear_age_ownership"] = []
+    if "years_trying" in llm_updates:
+        updates["pending_duration_value"] = None
+    return updates
+
+
+def next_reply(state: CaseState) -> Question:
+    """Asks the orchestrator for the next question and turns its special signals into replies."""
+    question = get_next_question(state)
+    if question.text == "SUMMARY_READY":
+        # options: ["Yes, that’s correct", "No, I’d like to correct something"]
+        return question._replace(text=generate_section_a(state), multi_select=False)
+    if question.text == "CONVERSATION_COMPLETE":
+        return question._replace(text=COMPLETE_REPLY, options=[], multi_select=False)
+    return question
+
+
+def answer(state: CaseState, updates: Dict) -> Question:
+    """Applies the turn's updates (unknown keys are ignored; unchanged values are not marked dirty) and replies."""
+    state.apply(updates)
+    return next_reply(state)
+
+
+def take_turn(state: CaseState, message: str, llm: bool = False) -> Tuple[str, float, Dict, Optional[Question]]:
+    """
+    A whole turn in one call: read_message, then answer() unless the LLM has to be asked first
+    (tier "llm": no reply yet, the caller merges the LLM's updates and calls answer() itself).
+    Returns (tier, extraction seconds, updates, reply).
+    """
+    started = time.perf_counter()
+    try:
+        updates, tier = read_message(state, message, llm)
+    except Exception as e:
+        print(f"Extraction Error: {e}")
+        updates, tier = {}, "clarify"
+    seconds = time.perf_counter() - started
+    if tier == "llm":
+        return tier, seconds, updates, None
+    return tier, seconds, updates, answer(state, updates)
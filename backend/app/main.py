@@ -1,13 +1,29 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Dict, Any, List, Optional
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
 import json
+import time
+import uuid
 
 # Internal imports - these files must exist in your /app folders
-from app.models.case_state import CaseState
-from app.engine.extractor import extract_clinical_state
-from app.engine.summary import generate_section_a
+from app.models.intake import IntakeBatch
+from app.engine.consultation import (
+    ChatResponse, apply_state_patch, attach_documents, next_response, open_session, seed_sessions,
+)
+from app.engine.llm import get_llm_extractor
+from app.engine.orchestrator import STEP_GRAPH
+from app.engine.phase2 import detect_test_type
+from app.engine.pool import EngineDied, get_engine_pool
+from app.engine.turn import answer, merge_llm_updates, take_turn
+from app.utils.channels import SessionChannels
+from app.utils.confidence import TierCounters
+from app.utils.executor import get_turn_executor
+from app.utils.session_store import ResponseCache, SessionConflict, SessionLocks, get_session_store
+from app.utils.upload_store import StoredFile, UploadRejected, get_upload_store
 
 app = FastAPI(title="IVF Consultation Engine - Phase 1")
 
@@ -19,179 +35,345 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Server-side Session Storage
-sessions: Dict[str, CaseState] = {}
+# Optional LLM fallback for free text the rules could not read (None unless LLM_EXTRACTION=1)
+llm_extractor = get_llm_extractor()
+extraction_tiers = TierCounters()
+
+# Server-side Session Storage (SQLite-backed unless SESSION_STORE=memory; see app.utils.session_store),
+# or, with ENGINE_PROCESSES set, in engine processes that each own a share of the sessions (app.engine.pool)
+engines = get_engine_pool()
+sessions = get_session_store() if engines is None else None
+session_locks = SessionLocks() # One request at a time per session (within this worker)
+recent_responses = ResponseCache() # Replies by client request_id, for retries
+channels = SessionChannels() # Open /ws connections per session, for upload notifications
+uploads = get_upload_store() # Uploaded reports, by content hash (UPLOAD_DIR)
+SESSION_BUSY = "This consultation is being updated elsewhere. Please try again."
+TURN_ATTEMPTS = 3 # Redo a turn that lost a race with another worker (shared store), or whose engine died, this many times
+MAX_TRANSCRIPT = 1000 # Messages per /replay request
+MAX_UPLOAD_FILES = 20 # Files per /upload/batch request
+
+# Where turn processing runs: on the event loop, or a thread/process pool (TURN_EXECUTOR)
+turn_executor = get_turn_executor()
+
+@app.on_event("startup")
+def warm_turn_executor():
+    turn_executor.start()
 
-class ChatResponse(BaseModel):
-    reply: str
-    options: List[str] = []
-    state: Optional[Dict] = None
-    multi_select: bool = False
+@app.on_event("shutdown")
+def close_turn_executor():
+    turn_executor.close()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    if llm_extractor is not None:
+        await llm_extractor.aclose()
+
+@app.on_event("startup")
+async def start_engines():
+    if engines is not None:
+        await engines.start()
+
+@app.on_event("shutdown")
+def close_session_store():
+    if engines is not None:
+        engines.close() # Each engine flushes its store
+    else:
+        sessions.close() # Flushes the write-behind queue
 
 class ChatRequest(BaseModel):
     session_id: str
     message: str
+    state_version: Optional[int] = None # Version of the state the client holds (None: send it in full)
+    request_id: Optional[str] = None # Client-chosen, unique per request: a retry with the same id gets the same reply
 
-@app.post("/chat")
-async def chat_endpoint(req: ChatRequest):
+def replayed(session_id: str, request_id: Optional[str], fingerprint: Any) -> Optional[Any]:
+    """The reply already sent for this request_id (a retry), or None to run the request."""
+    if request_id is None:
+        return None
+    try:
+        return recent_responses.get(session_id, request_id, fingerprint)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def chat_turn(req: ChatRequest) -> ChatResponse:
+    if engines is not None:
+        return await engine_turn(req)
     session_id = req.session_id
     
-    # 1. Get or Create Session
-    if session_id not in sessions:
-        sessions[session_id] = CaseState(case_id=session_id)
+    # 1. Get or Create Session (loaded from the store if it is not in memory)
+    state = open_session(sessions, session_id)
     
-    state = sessions[session_id]
-    
-    # 2. Extract Data from user message
+    # 2. Extract Data from user message and get the next question (see app.engine.turn)
+    # Option clicks resolve straight from the orchestrator's catalog; free text goes through the extractor
+    llm = llm_extractor is not None and llm_extractor.handles(state.pending_step)
+    tier, seconds, updates, reply = await turn_executor.run(state, take_turn, req.message, llm)
+    if reply is None:
+        updates, seconds = await ask_llm(req.message, state.pending_step, updates, seconds)
+        reply = await turn_executor.run(state, answer, updates)
+    extraction_tiers.record(tier, seconds)
+
+    # 3. End the turn
+    response = next_response(state, req.state_version, reply)
+    sessions.put(session_id, state) # Saved behind the response (raises SessionConflict if another worker saved first)
+    return response
+
+async def engine_turn(req: ChatRequest) -> ChatResponse:
+    """chat_turn on the session's engine process: one call there (two when the LLM is asked in between)."""
+    slot = engines.owner(req.session_id)
+    tier, seconds, updates, step, response = await engines.call(
+        slot, "turn", req.session_id, req.message, llm_extractor is not None, req.state_version
+    )
+    if response is None:
+        updates, seconds = await ask_llm(req.message, step, updates, seconds)
+        response = await engines.call(slot, "answer", req.session_id, updates, req.state_version)
+    extraction_tiers.record(tier, seconds)
+    return response
+
+async def ask_llm(message: str, step: Optional[str], updates: Dict, seconds: float):
+    """The rules were unsure: ask the LLM (awaited here, it is I/O) and merge its reading into `updates`."""
+    started = time.perf_counter()
     try:
-        current_state_dict = state.dict()
-        extracted_updates = extract_clinical_state(req.message, current_state_dict)
-        
-        # Apply updates to flattened state
-        for key, val in extracted_updates.items():
-            if hasattr(state, key):
-                setattr(state, key, val)
-            elif isinstance(val, dict):
-                # Handle nested dicts if they appear (e.g. state.demographics)
-                # But since we flattened CaseState, we mostly expect direct attributes.
-                pass
+        updates = merge_llm_updates(updates, await llm_extractor.extract(message, step))
     except Exception as e:
         print(f"Extraction Error: {e}")
+    return updates, seconds + time.perf_counter() - started
 
-    # 3. Get Next Question from Orchestrator
-    from app.engine.orchestrator import get_next_question
-    # Expecting tuple: (msg, options, multi_select)
-    # But for backward compatibility with older steps, we might need a check, 
-    # OR we just updated ALL returns in orchestrator.py?
-    # I updated the critical paths. I should check if I missed any.
-    # To be safe, let's unpack and handle if length is 2 or 3.
-    orc_response = get_next_question(state)
-    
-    if len(orc_response) == 3:
-        reply, options, multi_select = orc_response
-    else:
-        reply, options = orc_response
-        multi_select = False
-    
-    # 4. Handle Special Signals
-    if reply == "SUMMARY_READY":
-        summary_text = generate_section_a(state)
-        return ChatResponse(
-            reply=summary_text,
-            options=options, # ["Yes, that’s correct", "No, I’d like to correct something"]
-            state=state.dict(),
-            multi_select=False
-        )
-    
-    if reply == "CONVERSATION_COMPLETE":
-        return ChatResponse(
-            reply="Thank you for providing those details. We are now ready to proceed with Phase 2.",
-            options=[],
-            state=state.dict(),
-            multi_select=False
-        )
-
-    # 5. Standard Response
-    return ChatResponse(
-        reply=reply,
-        options=options,
-        state=state.dict(),
-        multi_select=multi_select
-    )
+@app.post("/chat")
+async def chat_endpoint(req: ChatRequest):
+    return await run_chat(req)
+
+async def run_chat(req: ChatRequest) -> ChatResponse:
+    """One turn as /chat and /ws run it; errors are raised as HTTPException."""
+    # A double-click, or an upload mid-turn, must not interleave with this turn on the same CaseState
+    async with session_locks.hold(req.session_id):
+        return await locked_chat(req)
+
+async def locked_chat(req: ChatRequest) -> ChatResponse:
+    # A retry of a turn that already ran (the reply got lost) must not answer the question again
+    fingerprint = ("chat", req.message)
+    response = replayed(req.session_id, req.request_id, fingerprint)
+    if response is not None:
+        return response
+    for attempt in range(TURN_ATTEMPTS):
+        try:
+            response = await chat_turn(req)
+        except (SessionConflict, EngineDied):
+            continue # Redone on the state the other worker saved, or on the session's new engine
+        if req.request_id is not None:
+            recent_responses.put(req.session_id, req.request_id, fingerprint, response)
+        return response
+    raise HTTPException(status_code=409, detail=SESSION_BUSY)
+
+class ReplayRequest(BaseModel):
+    session_id: str
+    messages: List[str] = Field(..., min_length=1, max_length=MAX_TRANSCRIPT)
+    diffs: bool = False # Return each turn's state change (the full state on the first turn)
+
+@app.post("/replay")
+async def replay_transcript(req: ReplayRequest):
+    """
+    Feeds a whole transcript (QA, or a conversation migrated from another system) into one session:
+    every message is a /chat turn, run exactly as /chat runs it, with the session locked throughout.
+    Returns every turn's response (with its state change when `diffs` is set) and the final state.
+    A turn that fails ends the replay with its error; the turns before it are kept.
+    """
+    turns = []
+    state, known_version = None, None
+    async with session_locks.hold(req.session_id):
+        for message in req.messages:
+            response = await locked_chat(ChatRequest(session_id=req.session_id, message=message, state_version=known_version))
+            state = response.state if response.state is not None else apply_state_patch(state, response.state_patch)
+            known_version = response.version
+            turns.append(response if req.diffs else response.copy(update={"state": None, "state_patch": None}))
+    return {"session_id": req.session_id, "turns": turns, "state": state}
+
+@app.websocket("/ws/{session_id}")
+async def chat_socket(websocket: WebSocket, session_id: str, state_version: Optional[int] = None):
+    """
+    /chat over one connection per session (POST /chat stays as the fallback). The client sends
+    {"type": "chat", "message", "request_id"}; each turn is answered with a "question" frame
+    (reply, options, multi_select) and a "state" frame: the patch from the version last sent on
+    this connection (from `state_version` to begin with), or the full state. Documents attached
+    to the session through /upload arrive as "upload" frames (the /upload result). Failures are
+    "error" frames ({status, detail}, as the HTTP error would have been) and the connection stays open.
+    """
+    await websocket.accept()
+    channel = channels.add(session_id, websocket)
+    known_version = state_version
+    try:
+        while True:
+            try:
+                frame = json.loads(await websocket.receive_text())
+            except ValueError:
+                frame = None
+            if not isinstance(frame, dict) or frame.get("type") != "chat" or not isinstance(frame.get("message"), str):
+                await channel.send({"type": "error", "status": 422, "detail": 'Expected {"type": "chat", "message": ...}'})
+                continue
+            request_id = frame.get("request_id")
+            try:
+                req = ChatRequest(session_id=session_id, message=frame["message"], state_version=known_version, request_id=request_id)
+            except ValidationError as e: # A request_id that is not a string, say: answered as /chat would
+                await channel.send({"type": "error", "request_id": request_id, "status": 422, "detail": e.errors(include_url=False, include_context=False)})
+                continue
+            try:
+                response = await run_chat(req)
+            except HTTPException as e:
+                await channel.send({"type": "error", "request_id": request_id, "status": e.status_code, "detail": e.detail})
+                continue
+            known_version = response.version
+            await channel.send({
+                "type": "question", "request_id": request_id,
+                "reply": response.reply, "options": response.options, "multi_select": response.multi_select,
+            })
+            await channel.send({"type": "state", "version": response.version, "state_patch": response.state_patch, "state": response.state})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        channels.remove(session_id, channel)
+
+class SessionCreated(ChatResponse):
+    session_id: str
+
+@app.post("/sessions")
+async def create_sessions(batch: IntakeBatch):
+    """
+    Seeds sessions from clinic intake forms (one or many per request) and returns, per session,
+    the first question still open - the chat then carries on from there via /chat.
+    The whole batch is validated before any session is created, and nothing is created if an id
+    is taken. Only an id another worker creates meanwhile (shared store) is answered 409 after
+    the fact: the response then still lists the sessions that were created.
+    """
+    session_ids = [form.session_id or uuid.uuid4().hex for form in batch.sessions]
+    taken = await engines.existing(session_ids) if engines is not None else sessions.existing(session_ids)
+    if taken or len(set(session_ids)) != len(session_ids):
+        duplicates = taken or [sid for sid in session_ids if session_ids.count(sid) > 1]
+        raise HTTPException(status_code=409, detail=f"Session already exists: {sorted(set(duplicates))[:10]}")
+
+    forms = [(session_id, form.to_state_updates()) for session_id, form in zip(session_ids, batch.sessions)]
+    created = await engines.create(forms) if engines is not None else seed_sessions(sessions, forms)
+    seeded = [SessionCreated(session_id=session_id, **response.dict())
+              for (session_id, _), response in zip(forms, created) if response is not None]
+    lost = [session_id for (session_id, _), response in zip(forms, created) if response is None]
+    if lost:
+        return JSONResponse(status_code=409, content=jsonable_encoder(
+            {"detail": f"Session already exists: {lost[:10]}", "sessions": seeded}
+        ))
+    return {"sessions": seeded}
+
+@app.get("/flow")
+async def flow():
+    """The orchestrator's step graph (steps in walk order, with their options and guards)."""
+    return {"steps": STEP_GRAPH.describe()}
+
+@app.get("/stats/extraction")
+async def extraction_stats():
+    """How often each extraction tier ran (and its mean latency), plus LLM backend and turn executor counters."""
+    stats = extraction_tiers.snapshot()
+    stats["llm"] = llm_extractor.stats if llm_extractor is not None else None
+    stats["executor"] = turn_executor.stats
+    return stats
+
+@app.get("/stats/sessions")
+async def session_stats():
+    """
+    Session store counters (live sessions, hot LRU hits, cold loads, evictions, expiries, flushes,
+    conflicts; per engine with ENGINE_PROCESSES, plus its deaths and replacements), lock contention,
+    retried requests answered from the response cache, open /ws connections and the upload store.
+    """
+    store = await engines.stats() if engines is not None else sessions.stats
+    return {
+        **store,
+        "locks": {"active": len(session_locks.locks), **session_locks.stats},
+        "replays": recent_responses.stats,
+        "channels": {"open": channels.open, **channels.stats},
+        "uploads": uploads.stats,
+    }
 
 from fastapi import UploadFile, File, Form
 
 @app.post("/upload")
 async def upload_document(
     session_id: str = Form(...),
-    file: UploadFile = File(...)
+    file: UploadFile = File(...),
+    request_id: Optional[str] = Form(None) # As in ChatRequest
 ):
-    # 1. Get Session
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-    state = sessions[session_id]
-    
-    # 2. Detect Test Type
-    from app.engine.phase2 import detect_test_type
-    test_type = detect_test_type(file.filename)
-    
-    if test_type == "UNKNOWN_TEST":
-        return {
-            "status": "error",
-            "message": "I could not identify the test type from the filename. Please rename it to include the test name (e.g., 'AMH Report.pdf').",
-            "detected_type": None
-        }
-
-    # 3. Validate against Phase 1 History
-    # Construct allowed list
-    allowed_tests = set()
-    if state.tests_done_list:
-        allowed_tests.update(state.tests_done_list)
-    if state.male_tests_done_list:
-        allowed_tests.update(state.male_tests_done_list)
-        
-    # Mapping for generic terms to allowed
-    # If detected 'Semen Analysis' but user said 'Semen analysis', it matches (logic handles this via lower case checks in extractor usually but here we have normalized strings).
-    # Let's check for containment or direct match.
-    # We need to be careful. If user said "Hormonal blood tests", and uploads "AMH", is it allowed?
-    # Yes, AMH is a hormonal test.
-    # Simple Logic: If "None" is in list, no uploads allowed?
-    # Or strict check?
-    # User feedback: "Validate test is part of Phase 1 tests_done"
-    
-    # Heuristic for Validation:
-    # If exact match in allowed_tests -> OK
-    # If test_type is "AMH" and "Hormonal" in allowed -> OK
-    # If test_type is "FSH" and "Hormonal" in allowed -> OK
-    
-    valid_upload = False
-    
-    # Normalization helper
-    def normalize(s): return s.lower().strip()
-    
-    allowed_normalized = [normalize(t) for t in allowed_tests]
-    type_normalized = normalize(test_type)
-    
-    if type_normalized in allowed_normalized:
-        valid_upload = True
-    else:
-        # Hierarchy Check
-        hormonal_subtypes = ["amh", "fsh", "lh", "tsh", "prolactin", "estradiol"]
-        if type_normalized in hormonal_subtypes and any("hormonal" in t for t in allowed_normalized):
-            valid_upload = True
-            
-        if type_normalized == "semen analysis" and any("semen" in t for t in allowed_normalized):
-            valid_upload = True
-            
-        if type_normalized == "hsg" and any("tube" in t for t in allowed_normalized):
-            valid_upload = True
-            
-    if not valid_upload:
-         return {
-            "status": "error",
-            "message": f"This test ({test_type}) was not mentioned in your history. I am only entering reports for tests we discussed.",
-            "detected_type": test_type
-        }
-
-    # 4. Update State
-    from datetime import date
-    new_doc = {
-        "test_name": test_type,
-        "filename": file.filename,
-        "upload_date": date.today().isoformat(),
-        "test_date": None, # Pending user input
-        "validity_status": None
-    }
-    
-    # Avoid Duplicates
-    if not any(d["filename"] == file.filename for d in state.phase2_documents):
-        state.phase2_documents.append(new_doc)
-        
-    return {
-        "status": "success",
-        "message": f"Received {test_type}. When was this test done?", # Frontend might display this or orchestrator next turn
-        "document": new_doc
-    }
+    # Staged before taking the lock: the copy is I/O and needs nothing from the session
+    try:
+        stored = await stage_upload(file)
+    except UploadRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return (await attach_uploads(session_id, [(file.filename, stored)], request_id))[0]
+
+@app.post("/upload/batch")
+async def upload_documents(
+    session_id: str = Form(...),
+    files: List[UploadFile] = File(...),
+    request_id: Optional[str] = Form(None) # As in ChatRequest
+):
+    """
+    /upload for several reports at once: they are stored concurrently, then entered in the session
+    together under one lock (one save). Returns a result per file, in order, each with its
+    filename; a file the store refused (too large, empty) gets an error result of its own.
+    """
+    if len(files) > MAX_UPLOAD_FILES:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_UPLOAD_FILES} files per upload.")
+    staged = await asyncio.gather(*(stage_upload(file) for file in files), return_exceptions=True)
+    rejected = [outcome for outcome in staged if isinstance(outcome, BaseException)]
+    accepted = [(file.filename, outcome) for file, outcome in zip(files, staged) if not isinstance(outcome, BaseException)]
+    unexpected = [outcome for outcome in rejected if not isinstance(outcome, UploadRejected)]
+    if unexpected:
+        for filename, stored in accepted:
+            if stored is not None:
+                uploads.discard(stored)
+        raise unexpected[0]
+    attached = iter(await attach_uploads(session_id, accepted, request_id) if accepted else [])
+    return {"results": [
+        {"filename": file.filename, **(next(attached) if not isinstance(outcome, BaseException) else {"status": "error", "message": outcome.detail})}
+        for file, outcome in zip(files, staged)
+    ]}
+
+async def stage_upload(file: UploadFile) -> Optional[StoredFile]:
+    """The file copied into the upload store's staging area; None (nothing written) when its test type cannot be told."""
+    if detect_test_type(file.filename) == "UNKNOWN_TEST":
+        return None # attach_documents answers it from the filename
+    return await uploads.store(file)
+
+async def attach_uploads(session_id: str, files: List[Tuple[str, Optional[StoredFile]]], request_id: Optional[str]) -> List[Dict]:
+    """
+    Enters staged files in the session (attach_documents), as one locked, retried and replayable
+    request; then keeps the files the session took in the upload store and discards the rest.
+    """
+    documents = [(filename, *(stored[:2] if stored is not None else (None, None))) for filename, stored in files]
+    fingerprint = ("upload", tuple(documents))
+    kept = [False] * len(files)
+    try:
+        async with session_locks.hold(session_id):
+            results = replayed(session_id, request_id, fingerprint)
+            if results is not None:
+                return results # Its files were kept (or not) when it first ran
+            for attempt in range(TURN_ATTEMPTS):
+                try:
+                    if engines is not None:
+                        results = await engines.call(engines.owner(session_id), "upload", session_id, documents)
+                    else:
+                        results = attach_documents(sessions, session_id, documents)
+                except (SessionConflict, EngineDied):
+                    continue
+                if request_id is not None:
+                    recent_responses.put(session_id, request_id, fingerprint, results)
+                break
+            else:
+                raise HTTPException(status_code=409, detail=SESSION_BUSY)
+            kept = [result["status"] == "success" and not result.get("duplicate") for result in results]
+    finally:
+        # Also when the session refused them all (expired, not found, busy)
+        for (filename, stored), keep in zip(files, kept):
+            if stored is not None:
+                (uploads.keep if keep else uploads.discard)(stored)
+    # Outside the lock: a slow socket must not hold up the session's next turn
+    for result in results:
+        await channels.publish(session_id, {"type": "upload", "request_id": request_id, **result})
+    return results
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,12 +1,16 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Literal, Any
+from datetime import date
+from pydantic import BaseModel, Field, PrivateAttr
+from typing import Callable, Iterable, List, Optional, Dict, Literal, Any, Set, Tuple
 
 # --- MAIN CASE STATE ---
 
 class CaseState(BaseModel):
     case_id: str = ""
+    version: int = 0 # Bumped once per turn that changed anything (see commit)
     phase: str = "phase_1"
     intro_shown: bool = False
+    pending_step: Optional[str] = None # The step get_next_question is waiting on (drives extractor dispatch)
+    step_cursor: Optional[str] = None # The step graph position the last walk stopped at (see orchestrator.StepGraph)
     
     # 1. Partner Status
     male_partner_present: Optional[bool] = None
@@ -60,7 +64,7 @@ class CaseState(BaseModel):
     semen_report_available: Optional[bool] = None
 
     # Date Collection (Phase 1 Refinement)
-    reported_test_dates: Dict[str, str] = {} # e.g. {"AMH": "2024-01-01"}
+    reported_test_dates: Dict[str, date] = {} # e.g. {"AMH": date(2024, 1, 1)}
     active_date_inquiry: Optional[str] = None # The test we are currently asking about
 
     # 9. Reports
@@ -73,10 +77,141 @@ class CaseState(BaseModel):
     # --- PHASE 2 STATE ---
     phase: Literal["PHASE1", "PHASE2", "COMPLETE"] = "PHASE1"
     phase2_documents: List[Dict[str, Any]] = [] 
+    phase2_uploads_complete: bool = False # "Done uploading" / "I don't have any reports"
     phase2_verification_complete: bool = False
 
     class Config:
         use_enum_values = True
 
     # Internal status for the orchestrated flow
-    status: str = "INTAKE"  # INTAKE, SUMMARIZED, CONFIRMED
\ No newline at end of file
+    status: str = "INTAKE"  # INTAKE, SUMMARIZED, CONFIRMED
+
+    # --- CHANGE TRACKING ---
+    # Every field assignment that changes a value is recorded, so per-turn work (step graph
+    # resume, serialisation, summaries) only redoes what the turn touched. In-place edits of a
+    # list/dict field are invisible to this: call mark_dirty() after them.
+    _tracker: "ChangeTracker" = PrivateAttr(default_factory=lambda: ChangeTracker())
+
+    def model_post_init(self, __context: Any) -> None:
+        self.__pydantic_private__["_tracker"].tracked_from = self.version
+
+    # The tracker is read straight from __pydantic_private__: plain attribute access to a private
+    # attribute goes through BaseModel.__getattr__, which is slow on this per-assignment path.
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if name in TRACKED_FIELDS and _differs(self.__dict__.get(name), value):
+            self.mark_dirty(name)
+        super().__setattr__(name, value)
+
+    def mark_dirty(self, *fields: str) -> None:
+        tracker = self.__pydantic_private__["_tracker"]
+        tracker.dirty.update(fields)
+        tracker.stale.update(fields)
+        if tracker.memo:
+            for key in [key for key, (reads, _) in tracker.memo.items() if not reads.isdisjoint(fields)]:
+                del tracker.memo[key]
+
+    @property
+    def changed_fields(self) -> Set[str]:
+        """Fields changed since the last commit (i.e. during the current turn)."""
+        return self.__pydantic_private__["_tracker"].dirty
+
+    def apply(self, updates: Dict) -> List[str]:
+        """Sets the known fields in `updates` (extractor output); returns the ones that changed."""
+        changed = []
+        for key, val in updates.items():
+            if key in TRACKED_FIELDS and _differs(self.__dict__.get(key), val):
+                setattr(self, key, val)
+                changed.append(key)
+        return changed
+
+    def commit(self) -> Set[str]:
+        """Ends the turn: bumps `version` if anything changed and returns what did."""
+        tracker = self.__pydantic_private__["_tracker"]
+        changed = tracker.dirty
+        if changed:
+            version = self.version + 1
+            super().__setattr__("version", version)
+            tracker.stale.add("version")
+            for field in changed:
+                tracker.changed_at[field] = version
+        tracker.dirty = set()
+        return changed
+
+    def changed_since(self, version: int) -> Optional[Set[str]]:
+        """Fields changed after `version` (committed or not); None if that is older than what is tracked."""
+        tracker = self.__pydantic_private__["_tracker"]
+        if version < tracker.tracked_from:
+            return None
+        return {field for field, at in tracker.changed_at.items() if at > version} | tracker.dirty
+
+    def snapshot(self) -> Dict:
+        """
+        Same as state.dict(), re-serialising only the fields changed since the previous call.
+        Nested values are shared with the cached copy: treat the result as read-only.
+        """
+        tracker = self.__pydantic_private__["_tracker"]
+        if tracker.snapshot is None:
+            tracker.snapshot = self.dict()
+        elif tracker.stale:
+            # Every field holds plain values (no nested models), so dict() amounts to copying containers
+            values = self.__dict__
+            for field in tracker.stale:
+                tracker.snapshot[field] = _plain(values[field])
+        tracker.stale = set()
+        return dict(tracker.snapshot)
+
+    def patch_since(self, version: Optional[int]) -> Optional[List[Dict]]:
+        """
+        JSON-patch (RFC 6902) ops that bring a copy of the state at `version` up to date, one
+        "replace" per changed field. None when that copy cannot be patched (no version given,
+        one from a different run of this session, or older than what is tracked): send snapshot().
+        """
+        if version is None or version > self.version:
+            return None
+        changed = self.changed_since(version)
+        if changed is None:
+            return None
+        if changed:
+            changed = changed | {"version"}
+        snapshot = self.snapshot()
+        return [{"op": "replace", "path": "/" + field, "value": snapshot[field]} for field in sorted(changed)]
+
+    def memo(self, key: Any, reads: Iterable[str], build: Callable[[], Any]) -> Any:
+        """build(), cached until one of the `reads` fields changes."""
+        memo = self.__pydantic_private__["_tracker"].memo
+        hit = memo.get(key)
+        if hit is None:
+            hit = memo[key] = (frozenset(reads), build())
+        return hit[1]
+
+
+class ChangeTracker:
+    """CaseState's per-session change bookkeeping (not part of the serialised state)."""
+    __slots__ = ("dirty", "stale", "snapshot", "changed_at", "tracked_from", "memo")
+
+    def __init__(self):
+        self.dirty: Set[str] = set()                     # Changed since the last commit
+        self.stale: Set[str] = set()                     # Changed since the last snapshot
+        self.snapshot: Optional[Dict] = None
+        self.changed_at: Dict[str, int] = {}             # Field -> version it last changed in
+        self.tracked_from = 0                            # changed_since is exact from this version on
+        self.memo: Dict[Any, Tuple[frozenset, Any]] = {}
+
+
+TRACKED_FIELDS = frozenset(CaseState.model_fields) - {"version"}
+
+
+def _differs(old: Any, value: Any) -> bool:
+    # Re-assigning the same list/dict may follow an in-place edit, so it always counts
+    if old is value:
+        return isinstance(value, (list, dict))
+    return old != value
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return value
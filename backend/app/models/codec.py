@@ -0,0 +1,281 @@
+import struct
+from datetime import date
+from typing import Callable, Dict, Tuple
+
+from app.models.case_state import CaseState
+
+# --- CASESTATE BINARY CODEC ---
+# Compact, schema-versioned encoding of a CaseState, for the session store (database rows and
+# the cold tier) and for handing a session to another process. Only fields that differ from
+# their default are written, as (field tag, value) pairs, and strings from the fixed
+# vocabulary (the Literal enum values, option texts, step names, test names) are written as
+# small integer tags. A typical mid-intake session is ~60 bytes, against ~1.2 KB of JSON.
+#
+# Layout: MAGIC, schema version (varint), then per set field its tag (varint) and value.
+# Values are self-describing: a type byte, then a varint (zigzag for ints), an 8-byte double,
+# length-prefixed UTF-8, a count-prefixed list or dict, a date ordinal or a vocabulary tag.
+#
+# FIELDS and STRINGS are append-only: a tag that has been written must keep its meaning.
+# A new CaseState field is appended to FIELDS (or to UNSTORED_FIELDS, if it must not be
+# persisted); importing this module fails while a field is in neither. Renaming or removing a
+# field (or a string) needs a new SCHEMA_VERSION with its own tables, plus a MIGRATIONS entry
+# lifting the previous version's decoded fields to it; old payloads are read with their own
+# tables and migrated forward one version at a time.
+
+MAGIC = 0xCA # Not the first byte of JSON ("{") or zlib (0x78), so stored payloads can be told apart
+
+NONE, FALSE, TRUE, INT, FLOAT, WHOLE_FLOAT, STR, TAG, LIST, DICT, DATE = range(11)
+
+FIELDS_V1 = (
+    "case_id", "version", "phase", "intro_shown", "pending_step", "step_cursor",
+    "male_partner_present", "male_partner_type", "female_age", "male_age", "unclear_age_ownership",
+    "first_marriage", "years_married", "years_trying", "pending_duration_value",
+    "has_prior_pregnancies", "pregnancy_source", "pregnancy_outcome", "pregnancy_history",
+    "menstrual_regularity", "cycle_length", "cycle_predictability", "menarche_age", "sexual_difficulty",
+    "has_had_treatments", "treatment_type", "treatments_reviewed", "ivf_cycles", "last_ivf_transfer_type",
+    "last_ivf_outcome", "iui_cycles", "tests_reviewed", "tests_done_list", "male_tests_done_list",
+    "semen_analysis_date", "semen_analysis_result", "semen_report_available", "reported_test_dates",
+    "active_date_inquiry", "reports_availability", "reports_availability_checked", "confirmation_status",
+    "phase2_documents", "phase2_uploads_complete", "phase2_verification_complete", "status",
+)
+
+STRINGS_V1 = (
+    # Literal enum values
+    "Partner", "Donor", "Unsure", "Natural", "Treatment", "NotSure", "Miscarriage", "Ectopic", "Chemical",
+    "Live birth", "Ongoing", "Regular", "Irregular", "None", "Sometimes", "Rarely", "NotApplicable",
+    "IVF", "IUI", "Medications", "Fresh", "Frozen", "Normal", "Abnormal", "Yes", "No", "Some",
+    "PHASE1", "PHASE2", "COMPLETE", "INTAKE", "PHASE2_START", "SUMMARIZED", "CONFIRMED",
+    # Steps (pending_step / step_cursor)
+    "intro", "ages", "first_marriage", "years_married", "duration", "prior_pregnancies", "pregnancy_source",
+    "pregnancy_outcome", "menstrual_regularity", "cycle_length", "cycle_predictability", "menarche",
+    "sexual_history", "treatments", "treatment_cycles", "ivf_transfer_type", "ivf_outcome", "female_tests",
+    "male_tests", "test_date", "reports_availability", "confirmation", "phase2_entry", "phase2_no_tests",
+    "phase2_complete", "phase2_test_date", "phase2_uploads", "phase2_summary", "complete",
+    # Option values stored as-is
+    "21–25 days", "26–30 days", "31–35 days", "Not sure",
+    "Beta Negative", "Biochemical Pregnancy", "Ectopic Pregnancy", "Ongoing Pregnancy", "Live Birth",
+    "Hormonal blood tests (AMH, TSH, FSH/LH)", "Ultrasound scans", "Tube testing (HSG / Laparoscopy / HyCoSy)",
+    "Semen analysis", "Hormonal blood tests", "Genetic tests",
+    # Phase 2 documents: keys, detected test types, validity statuses
+    "test_name", "filename", "upload_date", "test_date", "validity_status",
+    "Semen Analysis", "Semen Culture", "Sperm DNA Fragmentation", "Sperm Vitality Test", "Antisperm Antibodies",
+    "Male Hormonal Profile", "Male Karyotype", "Y-Chromosome Microdeletion", "Genetic Carrier Screening (Male)",
+    "AMH", "FSH", "LH", "Estradiol E2", "Prolactin", "TSH", "Thyroid Antibodies", "AFC", "HSG",
+    "Tubal Patency Test", "Pelvic Ultrasound", "Female Karyotype", "Genetic Carrier Screening (Female)",
+    "Valid", "Valid (No repetition required)", "Close to expiry", "Expired", "Date Unknown", "Pending",
+    "sha256", "size",
+)
+
+UNSTORED_FIELDS = frozenset() # CaseState fields deliberately left out of payloads
+
+SCHEMA_VERSION = 1
+SCHEMAS: Dict[int, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {1: (FIELDS_V1, STRINGS_V1)}
+# version -> function lifting that version's decoded fields to version + 1
+MIGRATIONS: Dict[int, Callable[[Dict], Dict]] = {}
+
+_unaccounted = [name for name in CaseState.model_fields if name not in FIELDS_V1 and name not in UNSTORED_FIELDS]
+if _unaccounted:
+    raise RuntimeError(f"CaseState fields missing from codec.FIELDS_V1 (or UNSTORED_FIELDS): {', '.join(_unaccounted)}")
+
+_DOUBLE = struct.Struct("<d")
+_FIELD_TAGS = {name: tag for tag, name in enumerate(FIELDS_V1)}
+_STRING_TAGS = {text: tag for tag, text in enumerate(STRINGS_V1)}
+_DEFAULTS = CaseState().dict()
+_ENCODED_FIELDS = [(name, _FIELD_TAGS[name], _DEFAULTS[name]) for name in FIELDS_V1]
+_HEADER = bytes([MAGIC, SCHEMA_VERSION])
+
+
+def _varint(buf: bytearray, n: int) -> None:
+    while n > 0x7F:
+        buf.append((n & 0x7F) | 0x80)
+        n >>= 7
+    buf.append(n)
+
+
+def _write(buf: bytearray, value) -> None:
+    kind = type(value)
+    if value is None:
+        buf.append(NONE)
+    elif kind is bool:
+        buf.append(TRUE if value else FALSE)
+    elif kind is str:
+        tag = _STRING_TAGS.get(value)
+        if tag is not None:
+            buf.append(TAG)
+            _varint(buf, tag)
+        else:
+            raw = value.encode()
+            buf.append(STR)
+            _varint(buf, len(raw))
+            buf += raw
+    elif kind is int:
+        buf.append(INT)
+        _varint(buf, value << 1 if value >= 0 else (-value << 1) - 1)
+    elif kind is float:
+        if value.is_integer() and 0 <= value < 2 ** 53:
+            buf.append(WHOLE_FLOAT)
+            _varint(buf, int(value))
+        else:
+            buf.append(FLOAT)
+            buf += _DOUBLE.pack(value)
+    elif kind is list or kind is tuple:
+        buf.append(LIST)
+        _varint(buf, len(value))
+        for item in value:
+            _write(buf, item)
+    elif kind is dict:
+        buf.append(DICT)
+        _varint(buf, len(value))
+        for key, item in value.items():
+            _write(buf, key)
+            _write(buf, item)
+    elif kind is date:
+        buf.append(DATE)
+        _varint(buf, value.toordinal())
+    else:
+        raise TypeError(f"Cannot encode {kind.__name__} in a CaseState")
+
+
+def dumps(state: CaseState) -> bytes:
+    """
+    The session's set fields (those differing from their default), current schema version.
+    Reads the fields as they are, without snapshot(): that updates the change tracker, and the
+    session store packs idle sessions from its background thread.
+    """
+    values = state.__dict__
+    buf = bytearray(_HEADER)
+    for name, tag, default in _ENCODED_FIELDS:
+        value = values[name]
+        if value != default:
+            _varint(buf, tag)
+            _write(buf, value)
+    return bytes(buf)
+
+
+def _read_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _read(data: bytes, pos: int, strings: Tuple[str, ...]):
+    kind = data[pos]
+    if kind <= TRUE:
+        return (None, False, True)[kind], pos + 1
+    if kind == FLOAT:
+        return _DOUBLE.unpack_from(data, pos + 1)[0], pos + 9
+    n = data[pos + 1] # Every other type carries a varint, nearly always a single byte
+    if n < 0x80:
+        pos += 2
+    else:
+        n, pos = _read_varint(data, pos + 1)
+    if kind == TAG:
+        return strings[n], pos
+    if kind == STR:
+        return data[pos:pos + n].decode(), pos + n
+    if kind == INT:
+        return (n >> 1) if not n & 1 else -((n + 1) >> 1), pos
+    if kind == WHOLE_FLOAT:
+        return float(n), pos
+    if kind == LIST:
+        items = []
+        for _ in range(n):
+            item, pos = _read(data, pos, strings)
+            items.append(item)
+        return items, pos
+    if kind == DICT:
+        items = {}
+        for _ in range(n):
+            key, pos = _read(data, pos, strings)
+            items[key], pos = _read(data, pos, strings)
+        return items, pos
+    if kind == DATE:
+        return date.fromordinal(n), pos
+    raise ValueError(f"Unknown value type {kind}")
+
+
+def decode_fields(data: bytes) -> Tuple[int, Dict]:
+    """The schema version a payload was written with, and its fields as that version named them."""
+    if not data or data[0] != MAGIC:
+        raise ValueError("Not a CaseState payload")
+    version, pos = _read_varint(data, 1)
+    if version not in SCHEMAS:
+        raise ValueError(f"Unknown CaseState schema version {version} (this build reads up to {SCHEMA_VERSION})")
+    fields, strings = SCHEMAS[version]
+    values = {}
+    end = len(data)
+    while pos < end:
+        tag = data[pos]
+        if tag < 0x80:
+            pos += 1
+        else:
+            tag, pos = _read_varint(data, pos)
+        values[fields[tag]], pos = _read(data, pos, strings)
+    return version, values
+
+
+def loads(data: bytes) -> CaseState:
+    """Inverse of dumps(); payloads of older schema versions are migrated forward first."""
+    version, values = decode_fields(data)
+    while version < SCHEMA_VERSION:
+        values = MIGRATIONS[version](values)
+        version += 1
+    return CaseState(**values)
+
+
+if __name__ == "__main__":
+    # Size and speed against the JSON the session store used before: python -m app.models.codec
+    import json
+    import timeit
+    import zlib
+    from app.engine.orchestrator import get_next_question
+
+    def _json_default(value):
+        return {"$date": value.isoformat()}
+
+    def _json_hook(obj):
+        return date.fromisoformat(obj["$date"]) if len(obj) == 1 and "$date" in obj else obj
+
+    samples = {
+        "new": CaseState(case_id="session_k3j9x2m1a"),
+        "mid-intake": CaseState(
+            case_id="session_k3j9x2m1a", version=9, intro_shown=True, male_partner_present=True,
+            male_partner_type="Partner", female_age=32, male_age=35, first_marriage=True, years_married=5.0,
+            years_trying=3.0, has_prior_pregnancies=False, menstrual_regularity="Regular",
+        ),
+        "phase 2": CaseState(
+            case_id="session_k3j9x2m1a", version=31, intro_shown=True, male_partner_present=True,
+            male_partner_type="Partner", female_age=32, male_age=35, first_marriage=True, years_married=5.0,
+            years_trying=3.0, has_prior_pregnancies=True, pregnancy_source="Natural", pregnancy_outcome="Miscarriage",
+            menstrual_regularity="Regular", cycle_length="26–30 days", cycle_predictability=True, menarche_age="13",
+            sexual_difficulty="None", has_had_treatments=True, treatment_type="IUI", treatments_reviewed=True,
+            iui_cycles=3, tests_reviewed=True, tests_done_list=["Hormonal blood tests (AMH, TSH, FSH/LH)", "Ultrasound scans"],
+            male_tests_done_list=["Semen analysis"], reports_availability="Yes", reports_availability_checked=True,
+            reported_test_dates={"Hormonal blood tests (AMH, TSH, FSH/LH)": date(2025, 1, 10),
+                                 "Ultrasound scans": date(2025, 3, 2), "Semen analysis": date(2025, 6, 1)},
+            confirmation_status=True, phase="PHASE2", status="PHASE2_START",
+            phase2_documents=[{"test_name": "AMH", "filename": "AMH report.pdf", "upload_date": "2025-09-01",
+                               "test_date": date(2025, 1, 10), "validity_status": "Valid"}],
+        ),
+    }
+
+    def best(fn, number=2000):
+        return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+    print(f"{'state':<12}{'json B':>8}{'zlib B':>8}{'codec B':>9}{'json enc':>10}{'json dec':>10}{'codec enc':>11}{'codec dec':>11}  (us)")
+    for label, state in samples.items():
+        get_next_question(state)
+        text = json.dumps(state.snapshot(), default=_json_default, separators=(",", ":"))
+        packed = dumps(state)
+        assert loads(packed).dict() == state.dict()
+        print(
+            f"{label:<12}{len(text):>8}{len(zlib.compress(text.encode())):>8}{len(packed):>9}"
+            f"{best(lambda: json.dumps(state.snapshot(), default=_json_default, separators=(',', ':'))):>10.1f}"
+            f"{best(lambda: CaseState(**json.loads(text, object_hook=_json_hook))):>10.1f}"
+            f"{best(lambda: dumps(state)):>11.1f}{best(lambda: loads(packed)):>11.1f}"
+        )
@@ -0,0 +1,93 @@
+from datetime import date
+from pydantic import BaseModel, Field, field_validator
+from typing import List, Optional, Dict, Literal
+
+# --- CLINIC INTAKE FORM ---
+# Structured answers collected before the chat (clinic web form). Values use the same
+# vocabulary as the chat options, so a pre-filled session continues exactly where a chat
+# that gave the same answers would.
+
+FemaleTest = Literal["Hormonal blood tests (AMH, TSH, FSH/LH)", "Ultrasound scans", "Tube testing (HSG / Laparoscopy / HyCoSy)", "None"]
+MaleTest = Literal["Semen analysis", "Hormonal blood tests", "Genetic tests", "None"]
+
+MAX_BATCH = 1000 # Sessions per /sessions request (a clinic day's appointment list fits comfortably)
+
+
+class IntakeForm(BaseModel):
+    session_id: Optional[str] = Field(None, min_length=1, max_length=128) # Generated when omitted
+
+    # 1. Partner Status
+    male_partner_type: Optional[Literal["Partner", "Donor", "Unsure"]] = None
+
+    # 2. Ages
+    female_age: Optional[int] = Field(None, ge=16, le=60)
+    male_age: Optional[int] = Field(None, ge=16, le=90)
+
+    # 3. Relationship
+    first_marriage: Optional[bool] = None
+    years_married: Optional[float] = Field(None, ge=0, le=60)
+
+    # 4. Duration
+    years_trying: Optional[float] = Field(None, ge=0, le=40)
+
+    # 5. Pregnancy History
+    has_prior_pregnancies: Optional[bool] = None
+    pregnancy_source: Optional[Literal["Natural", "Treatment", "NotSure"]] = None
+    pregnancy_outcome: Optional[Literal["Miscarriage", "Ectopic", "Chemical", "Live birth", "Ongoing"]] = None
+
+    # 6. Menstrual History
+    menstrual_regularity: Optional[Literal["Regular", "Irregular", "NotSure"]] = None
+    cycle_length: Optional[Literal["21–25 days", "26–30 days", "31–35 days", "Not sure"]] = None
+    cycle_predictability: Optional[bool] = None
+    menarche_age: Optional[int] = Field(None, ge=8, le=20)
+    sexual_difficulty: Optional[Literal["None", "Sometimes", "Rarely", "NotApplicable"]] = None
+
+    # 7. Treatments
+    has_had_treatments: Optional[bool] = None
+    treatment_type: Optional[Literal["IVF", "IUI", "Medications", "None"]] = None
+    ivf_cycles: Optional[int] = Field(None, ge=0, le=30)
+    last_ivf_transfer_type: Optional[Literal["Fresh", "Frozen", "NotSure"]] = None
+    last_ivf_outcome: Optional[Literal["Beta Negative", "Biochemical Pregnancy", "Miscarriage", "Ectopic Pregnancy", "Ongoing Pregnancy", "Live Birth"]] = None
+    iui_cycles: Optional[int] = Field(None, ge=0, le=30)
+
+    # 8. Tests (empty = not asked on the form)
+    tests_done_list: List[FemaleTest] = []
+    male_tests_done_list: List[MaleTest] = []
+    reported_test_dates: Dict[str, date] = {}
+
+    class Config:
+        extra = "forbid" # A misspelt field is an error, not a silently skipped answer
+
+    @field_validator("reported_test_dates")
+    @classmethod
+    def dates_not_in_future(cls, value: Dict[str, date]) -> Dict[str, date]:
+        today = date.today()
+        for test, test_date in value.items():
+            if test_date > today:
+                raise ValueError(f"{test}: test date {test_date.isoformat()} is in the future")
+        return value
+
+    def to_state_updates(self) -> Dict:
+        """The CaseState fields this form answers, plus the flags the chat would have set alongside them."""
+        updates = self.dict(exclude={"session_id"}, exclude_none=True)
+        for key in ("tests_done_list", "male_tests_done_list", "reported_test_dates"):
+            if not updates[key]:
+                del updates[key]
+
+        if self.male_partner_type is not None:
+            updates["male_partner_present"] = self.male_partner_type == "Partner"
+        if self.menarche_age is not None:
+            updates["menarche_age"] = str(self.menarche_age)
+        if self.treatment_type is not None:
+            updates["has_had_treatments"] = self.treatment_type != "None"
+            updates["treatments_reviewed"] = True
+        elif self.has_had_treatments is False:
+            updates["treatment_type"] = "None"
+            updates["treatments_reviewed"] = True
+        if self.tests_done_list:
+            updates["tests_reviewed"] = True
+        return updates
+
+
+class IntakeBatch(BaseModel):
+    sessions: List[IntakeForm] = Field(..., min_length=1, max_length=MAX_BATCH)
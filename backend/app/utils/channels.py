@@ -0,0 +1,59 @@
+import asyncio
+from typing import Dict, Set
+
+from fastapi import WebSocket
+from fastapi.encoders import jsonable_encoder
+
+# --- SESSION CHANNELS ---
+# The open WebSocket connections of each session (/ws/{session_id}), so that something that
+# happens to a session outside its own connection - a report uploaded through POST /upload,
+# from this tab or another device - can be pushed to every client following it.
+# A connection is written to by its own receive loop and by publish(), hence a lock per socket.
+# Frames go through jsonable_encoder, as FastAPI does for HTTP responses: states hold dates.
+
+
+class Channel:
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.lock = asyncio.Lock() # One frame at a time on the socket
+
+    async def send(self, frame: Dict) -> None:
+        frame = jsonable_encoder(frame)
+        async with self.lock:
+            await self.websocket.send_json(frame)
+
+
+class SessionChannels:
+    """The connections open per session (within this worker), created on connect and dropped on disconnect."""
+
+    def __init__(self):
+        self.channels: Dict[str, Set[Channel]] = {}
+        self.stats = {"connected": 0, "published": 0, "dropped": 0}
+
+    def add(self, session_id: str, websocket: WebSocket) -> Channel:
+        channel = Channel(websocket)
+        self.channels.setdefault(session_id, set()).add(channel)
+        self.stats["connected"] += 1
+        return channel
+
+    def remove(self, session_id: str, channel: Channel) -> None:
+        channels = self.channels.get(session_id)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                del self.channels[session_id]
+
+    async def publish(self, session_id: str, frame: Dict) -> None:
+        """Sends `frame` to every connection of the session; one that fails is dropped (its loop sees the disconnect)."""
+        frame = jsonable_encoder(frame) # Once, and outside the try: a frame that cannot be encoded is a bug, not a dead socket
+        for channel in list(self.channels.get(session_id, ())):
+            try:
+                await channel.send(frame)
+                self.stats["published"] += 1
+            except Exception:
+                self.stats["dropped"] += 1
+                self.remove(session_id, channel)
+
+    @property
+    def open(self) -> int:
+        return sum(len(channels) for channels in self.channels.values())
@@ -0,0 +1,66 @@
+import os
+from typing import Dict, Iterable
+
+# --- EXTRACTION CONFIDENCE ---
+# Per-field confidence for the rule-based extractor. Rules flag the fields they were unsure
+# about; anything else they set counts as an unambiguous match. The expensive tier (LLM call,
+# or leaving the turn to a clarification question) only runs when the pending step scores
+# below CONFIDENCE_THRESHOLD.
+
+UNAMBIGUOUS = 1.0          # One candidate value, read directly
+COMPETING = 0.5            # Several candidate values (or readings); the rule picked one by priority
+AMBIGUOUS_OWNERSHIP = 0.3  # A number was read but not whose it is (unclear_age_ownership)
+MISSING = 0.0              # Nothing extracted for the field
+
+CONFIDENCE_THRESHOLD = float(os.getenv("CONFIDENCE_THRESHOLD", "0.6"))
+
+TIERS = ("option", "narrative", "rules", "llm", "clarify")
+
+
+def score_fields(updates: Dict, flags: Dict[str, float], fields: Iterable[str] = ()) -> Dict[str, float]:
+    """
+    Confidence for every extracted field, plus each of the pending step's `fields`
+    (MISSING unless a rule flagged it, e.g. ages it saw but could not assign).
+    """
+    scores = {field: flags.get(field, UNAMBIGUOUS) for field in updates}
+    for field in fields:
+        if field not in scores:
+            scores[field] = flags.get(field, MISSING)
+    return scores
+
+
+def step_confidence(scores: Dict[str, float], fields: Iterable[str] = ()) -> float:
+    """
+    How sure we are the turn answered the pending step: its weakest answered field.
+    Without a known step, the weakest extracted field. MISSING if nothing was answered.
+    """
+    fields = list(fields) or list(scores)
+    answered = [scores[f] for f in fields if scores.get(f, MISSING) > MISSING]
+    return min(answered) if answered else MISSING
+
+
+class TierCounters:
+    """How often each extraction tier ran and how long it took, to tune the threshold against latency."""
+
+    def __init__(self):
+        self.counts = dict.fromkeys(TIERS, 0)
+        self.seconds = dict.fromkeys(TIERS, 0.0)
+
+    def record(self, tier: str, seconds: float) -> None:
+        self.counts[tier] += 1
+        self.seconds[tier] += seconds
+
+    def snapshot(self) -> Dict:
+        total = sum(self.counts.values())
+        return {
+            "threshold": CONFIDENCE_THRESHOLD,
+            "turns": total,
+            "tiers": {
+                tier: {
+                    "count": self.counts[tier],
+                    "share": round(self.counts[tier] / total, 4) if total else 0.0,
+                    "mean_ms": round(self.seconds[tier] / self.counts[tier] * 1000, 3) if self.counts[tier] else 0.0,
+                }
+                for tier in TIERS
+            },
+        }
@@ -0,0 +1,150 @@
+import re
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Optional, Tuple, Union
+
+# --- DATE NORMALIZATION ---
+# One parser for every test date we collect (Phase 1 date questions and Phase 2 uploads).
+# Patterns are compiled once; results are cached on the normalised text. Relative phrases
+# ("last month") are cached as an offset and resolved against today on every call.
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_MONTH = r'(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?'
+
+# Tried in order, first match wins
+ISO_DATE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')                      # 2024-01-15
+DAY_MONTH_YEAR = re.compile(r'\b(\d{1,2})(?:st|nd|rd|th)?[\s,.-]+' + _MONTH + r'[\s,.-]+(\d{4})\b')  # 15 Jan 2024
+MONTH_DAY_YEAR = re.compile(r'\b' + _MONTH + r'[\s.-]+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})\b')    # January 15, 2024
+MONTH_YEAR = re.compile(r'\b' + _MONTH + r'[\s,.-]+(\d{4})')                    # Jan 2024 / January, 2024
+FULL_DATE = re.compile(r'(\d{1,2})[\/\-\.](\d{1,2})[\/\-\.](\d{2,4})')           # 15/01/2024, 15-1-24
+MONTH_SLASH_YEAR = re.compile(r'\b(\d{1,2})[\/\-\.](\d{4})\b')                 # 01/2024
+YEAR_ONLY = re.compile(r'\b((?:19|20)\d{2})\b')                                # 2024
+AGO = re.compile(r'\b(\d+|a|an|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve)\s+(day|week|month|year)s?\s+ago\b')
+
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+# Approximate units, matching the 30-day "last month" the extractor always used
+UNIT_DAYS = {"day": 1, "week": 7, "month": 30, "year": 365}
+RELATIVE_PHRASES = {
+    "today": 0,
+    "yesterday": 1,
+    "last week": 7,
+    "last month": 30,
+    "last year": 365,
+}
+
+WHITESPACE = re.compile(r'\s+')
+
+# ("date", date) for absolute dates, ("days_ago", n) for relative ones
+ParsedDate = Tuple[str, Union[date, int]]
+
+
+def _make_date(year: Union[str, int], month: Union[str, int], day: Union[str, int] = 1) -> Optional[date]:
+    year = int(year)
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, int(month), int(day))
+    except ValueError:
+        return None
+
+
+def _numeric_date(d: str, m: str, y: str) -> Optional[date]:
+    # Day first (DD/MM/YYYY) unless that is impossible and the US order is not
+    if int(m) > 12 and int(d) <= 12:
+        d, m = m, d
+    return _make_date(y, m, d)
+
+
+@lru_cache(maxsize=2048)
+def _parse_normalized(text: str) -> Optional[ParsedDate]:
+    match = ISO_DATE.search(text)
+    if match:
+        parsed = _make_date(match.group(1), match.group(2), match.group(3))
+        return ("date", parsed) if parsed else None
+
+    match = DAY_MONTH_YEAR.search(text)
+    if match:
+        parsed = _make_date(match.group(3), MONTHS[match.group(2)], match.group(1))
+        return ("date", parsed) if parsed else None
+
+    match = MONTH_DAY_YEAR.search(text)
+    if match:
+        parsed = _make_date(match.group(3), MONTHS[match.group(1)], match.group(2))
+        return ("date", parsed) if parsed else None
+
+    match = MONTH_YEAR.search(text)
+    if match:
+        parsed = _make_date(match.group(2), MONTHS[match.group(1)]) # Default to 1st
+        return ("date", parsed) if parsed else None
+
+    match = FULL_DATE.search(text)
+    if match:
+        parsed = _numeric_date(match.group(1), match.group(2), match.group(3))
+        return ("date", parsed) if parsed else None
+
+    match = MONTH_SLASH_YEAR.search(text)
+    if match:
+        parsed = _make_date(match.group(2), match.group(1))
+        return ("date", parsed) if parsed else None
+
+    match = YEAR_ONLY.search(text)
+    if match:
+        return "date", date(int(match.group(1)), 1, 1)
+
+    match = AGO.search(text)
+    if match:
+        count = match.group(1)
+        count = int(count) if count.isdigit() else NUMBER_WORDS[count]
+        return "days_ago", count * UNIT_DAYS[match.group(2)]
+
+    for phrase, days in RELATIVE_PHRASES.items():
+        if phrase in text:
+            return "days_ago", days
+    return None
+
+
+def normalize_date_text(text: str) -> str:
+    return WHITESPACE.sub(" ", text.strip().lower())
+
+
+def parse_date(text: str, today: Optional[date] = None) -> Optional[date]:
+    """
+    Parses a test date out of free text ("Jan 2024", "15/03/2024", "2 months ago", ...).
+    Returns None if no date could be found. Day defaults to the 1st when only month/year is given.
+    """
+    if not text:
+        return None
+    parsed = _parse_normalized(normalize_date_text(text))
+    if parsed is None:
+        return None
+    kind, value = parsed
+    if kind == "date":
+        return value
+    return (today or date.today()) - timedelta(days=value)
+
+
+@lru_cache(maxsize=2048)
+def _from_iso(text: str) -> Optional[date]:
+    try:
+        return date.fromisoformat(text)
+    except ValueError:
+        return None
+
+
+def to_date(value: Union[date, str, None]) -> Optional[date]:
+    """
+    Coerces a stored test date (date object, or ISO string from older/serialised state) to a date.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return _from_iso(value) or parse_date(value)
@@ -0,0 +1,122 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from app.models import codec
+from app.models.case_state import CaseState
+
+# --- TURN EXECUTOR ---
+# Where a turn's CPU-bound work (app.engine.turn: extraction, orchestration, summary) runs.
+# A 5 KB history pasted into the chat takes several milliseconds of regex work, during which
+# an event loop running it inline answers nobody else. TURN_EXECUTOR picks:
+#
+#   inline  - on the event loop (the default, as before): no hand-off cost
+#   thread  - a thread pool: the loop hands the turn over and keeps accepting connections, but
+#             the turn still holds the GIL while it runs, so it is no cure for CPU-bound stalls
+#   process - a pool of warm worker processes (spawned and primed at startup): turns run in
+#             parallel on the host's other cores. The state crosses over as codec bytes plus the
+#             fields the turn had already changed, and only the fields the worker changed come
+#             back, applied to the server's own CaseState so its change tracking (patches,
+#             version) carries on.
+#
+# Offloading only pays when there are idle cores to offload to: on one core the pools add their
+# hand-off to every turn and the tail gets no better. Use TURN_EXECUTOR=process where uvicorn
+# leaves cores free (README: Troubleshooting).
+#
+# The caller holds the session's lock around run(), so no two turns touch one CaseState at once.
+
+MODES = ("inline", "thread", "process")
+
+
+def _warm_worker() -> None:
+    """Process pool initializer: imports the engine and runs a throwaway turn (regexes, caches)."""
+    from app.engine.turn import take_turn
+    take_turn(CaseState(), "I am 32 and my husband is 35, trying for 3 years")
+
+
+def _warmed() -> int:
+    return os.getpid()
+
+
+def _run_in_worker(fn: Callable, payload: bytes, dirty: Tuple[str, ...], args: Tuple) -> Tuple[Any, Dict]:
+    state = codec.loads(payload)
+    state.mark_dirty(*dirty) # The turn resumes the step graph from what changed (see StepGraph.start)
+    result = fn(state, *args)
+    return result, {field: getattr(state, field) for field in state.changed_fields}
+
+
+class TurnExecutor:
+    """Runs fn(state, *args) inline, on a thread pool or on a process pool (see MODES)."""
+
+    def __init__(self, mode: str = "inline", workers: Optional[int] = None):
+        if mode not in MODES:
+            raise ValueError(f"TURN_EXECUTOR must be one of {', '.join(MODES)}, not {mode!r}")
+        self.mode = mode
+        self.workers = workers or ((os.cpu_count() or 1) if mode == "process" else 4)
+        self.pool: Optional[Executor] = None
+        self.seconds = 0.0 # Wall time in run(): the turn plus any hand-off and queueing
+        self.runs = 0
+        self.running = 0
+        self.peak = 0
+        if mode == "thread":
+            self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="turn")
+        elif mode == "process":
+            self.pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                # Not fork: the server process already runs store threads and holds SQLite handles
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_warm_worker,
+            )
+
+    def start(self) -> None:
+        """Spawns and warms every worker process now rather than on the first turns."""
+        if self.mode == "process":
+            # No worker is idle yet when the next job arrives, so each job spawns one
+            for future in [self.pool.submit(_warmed) for _ in range(self.workers)]:
+                future.result()
+
+    async def run(self, state: CaseState, fn: Callable, *args: Any) -> Any:
+        started = time.perf_counter()
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        try:
+            if self.mode == "inline":
+                return fn(state, *args)
+            loop = asyncio.get_running_loop()
+            if self.mode == "thread":
+                return await loop.run_in_executor(self.pool, partial(fn, state, *args))
+            payload, dirty = codec.dumps(state), tuple(state.changed_fields)
+            result, changes = await loop.run_in_executor(self.pool, _run_in_worker, fn, payload, dirty, args)
+            for field, value in changes.items():
+                setattr(state, field, value)
+            state.mark_dirty(*changes) # Exactly what the worker marked, equal values (in-place edits) included
+            return result
+        finally:
+            self.running -= 1
+            self.runs += 1
+            self.seconds += time.perf_counter() - started
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+    @property
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            "workers": self.workers if self.pool is not None else 0,
+            "runs": self.runs,
+            "running": self.running,
+            "peak_running": self.peak,
+            "mean_ms": round(self.seconds / self.runs * 1000, 3) if self.runs else 0.0,
+        }
+
+
+def get_turn_executor() -> TurnExecutor:
+    """Builds the executor from the environment: TURN_EXECUTOR (default inline) and TURN_WORKERS."""
+    workers = os.getenv("TURN_WORKERS")
+    return TurnExecutor(mode=os.getenv("TURN_EXECUTOR", "inline"), workers=int(workers) if workers else None)
@@ -0,0 +1,100 @@
+from collections import deque
+from typing import Any, Dict, Iterable, List, NamedTuple, Tuple, Union
+
+# --- KEYWORD SCANNER ---
+# Aho-Corasick automaton over several keyword catalogs. Built once at import time;
+# scan() walks the text a single time and reports every catalog keyword it contains.
+
+
+class Hit(NamedTuple):
+    category: str
+    keyword: str
+    value: Any
+    rank: int   # Position of the keyword in its catalog (catalog order is priority)
+    start: int
+    end: int
+
+
+Catalog = Union[Dict[str, Any], Iterable[Tuple[str, Any]]]
+
+
+class KeywordScanner:
+    """
+    Matches whole words only: a letter directly before or after a keyword breaks the match,
+    so "lh" is not found in "health" (digits, "_" and punctuation still separate words).
+    A keyword ending in "*" is a stem and may run on into more letters ("scan*" -> "scans").
+    Text must already be lowercased.
+    """
+
+    def __init__(self, catalogs: Dict[str, Catalog]):
+        goto: List[Dict[str, int]] = [{}]
+        outputs: List[List[Tuple]] = [[]]
+
+        for category, catalog in catalogs.items():
+            entries = catalog.items() if isinstance(catalog, dict) else catalog
+            for rank, (keyword, value) in enumerate(entries):
+                stem = keyword.endswith("*")
+                word = keyword.rstrip("*")
+                node = 0
+                for ch in word:
+                    child = goto[node].get(ch)
+                    if child is None:
+                        child = len(goto)
+                        goto[node][ch] = child
+                        goto.append({})
+                        outputs.append([])
+                    node = child
+                outputs[node].append((category, word, value, rank, len(word), stem))
+
+        # Breadth-first: set failure links and fold them into goto, so scan() never backtracks
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in list(goto[node].items()):
+                fail[child] = goto[fail[node]].get(ch, 0) if node else 0
+                outputs[child] = outputs[child] + outputs[fail[child]]
+                queue.append(child)
+            if node:
+                for ch, target in goto[fail[node]].items():
+                    goto[node].setdefault(ch, target)
+
+        self._goto = goto
+        self._outputs = [tuple(out) for out in outputs]
+
+    def scan(self, text: str) -> List[Hit]:
+        """Returns every keyword hit in the text, ordered by where the keyword ends."""
+        goto = self._goto
+        outputs = self._outputs
+        length = len(text)
+        hits = []
+        node = 0
+        for i, ch in enumerate(text):
+            node = goto[node].get(ch, 0)
+            if outputs[node]:
+                end = i + 1
+                for category, word, value, rank, size, stem in outputs[node]:
+                    start = end - size
+                    if start and text[start - 1].isalpha():
+                        continue
+                    if not stem and end < length and text[end].isalpha():
+                        continue
+                    hits.append(Hit(category, word, value, rank, start, end))
+        return hits
+
+
+def first_ranked(hits: Iterable[Hit]) -> Any:
+    """Value of the highest-priority hit (earliest in its catalog), or None."""
+    best = min(hits, key=lambda hit: hit.rank, default=None)
+    return best.value if best else None
+
+
+def last_ranked(hits: Iterable[Hit]) -> Any:
+    """Value of the lowest-priority hit (latest in its catalog), or None."""
+    best = max(hits, key=lambda hit: hit.rank, default=None)
+    return best.value if best else None
+
+
+def ranked_values(hits: Iterable[Hit]) -> List[Any]:
+    """Distinct hit values in catalog order."""
+    return list(dict.fromkeys(hit.value for hit in sorted(hits, key=lambda hit: hit.rank)))
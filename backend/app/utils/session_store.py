@@ -0,0 +1,679 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Set, Union
+
+from app.models import codec
+from app.models.case_state import CaseState
+
+# --- SESSION STORE ---
+# Where live consultations are kept between turns. SessionStore is the in-process store the
+# backend has always used (lost on restart). SqliteSessionStore keeps the recently used
+# CaseState objects hot in an LRU and persists every session to an embedded SQLite database
+# (WAL): a turn's state is encoded on the request thread and written behind the response by
+# one background thread, batched per transaction; a session that is not hot is loaded on its
+# next request. A restart (or crash) only loses the last flush interval, and a clean shutdown
+# loses nothing.
+#
+# Both expire a session once it has been idle for `idle_ttl` seconds and cap how many are
+# held in memory. The hot tier is an OrderedDict in least-recently-used order, so the sweeper
+# (the background thread, every `sweep_interval`) and the cap only ever pop from its front.
+# Expired ids are remembered for TOMBSTONE_TTL so a late request gets a clean "expired"
+# instead of silently starting a new intake under the same id; an id evicted by the cap is
+# remembered as "evicted", so that request is told its session was dropped, not that it idled out.
+#
+# Sessions idle past `pack_after` (a patient gone to fetch reports) move to a cold tier:
+# packed with app.models.codec - tens to a couple of hundred bytes instead of a pydantic object
+# graph of several KB - and inflated on their next request. The in-memory store keeps that
+# tier in RAM; for SQLite the database is the cold tier (rows are stored packed) and idle
+# sessions are simply unloaded.
+#
+# Concurrency: requests for one session are serialised in-process by SessionLocks (held for
+# the whole turn, awaits included). Several workers can share one SQLite file in `shared`
+# mode: every put() is then written at once as a compare-and-set on the row's revision (bumped
+# by every write, uploads included, unlike CaseState.version), and a hot session is re-read
+# whenever another worker has moved its row on. A put() that lost the race raises
+# SessionConflict; the caller redoes the turn on the fresh state. A request the client retried
+# (same request_id) is answered from ResponseCache without touching the session at all.
+
+DEFAULT_IDLE_TTL = 7 * 24 * 3600 # A week without a turn: long enough to go and fetch old reports
+TOMBSTONE_TTL = 30 * 24 * 3600
+MAX_TOMBSTONES = 100000 # In-memory store only (an id each)
+DEFAULT_PACK_AFTER = 600 # Idle seconds before a session leaves the hot tier
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    state TEXT NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at);
+CREATE TABLE IF NOT EXISTS expired_sessions (
+    session_id TEXT PRIMARY KEY,
+    expired_at REAL NOT NULL
+);
+"""
+
+UPSERT = """
+INSERT INTO sessions (session_id, version, updated_at, state) VALUES (?, ?, ?, ?)
+ON CONFLICT(session_id) DO UPDATE SET
+    version = excluded.version, updated_at = excluded.updated_at, state = excluded.state, revision = revision + 1
+"""
+
+SQLITE_MAX_VARIABLES = 500 # Ids per IN (...) lookup
+SWEEP_BATCH = 1000 # Expired rows deleted per transaction
+
+
+def _json_object_hook(obj: Dict):
+    if len(obj) == 1 and "$date" in obj:
+        return date.fromisoformat(obj["$date"])
+    return obj
+
+
+class SessionConflict(Exception):
+    """Another worker saved the session since this one loaded it (shared store); redo the turn."""
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Session {session_id} was updated by another worker")
+        self.session_id = session_id
+
+
+class SessionLocks:
+    """One asyncio.Lock per session id, created on demand and dropped once no request holds or awaits it."""
+
+    def __init__(self):
+        self.locks: Dict[str, List] = {} # session_id -> [lock, requests holding or waiting]
+        self.stats = {"acquired": 0, "waited": 0}
+
+    @asynccontextmanager
+    async def hold(self, session_id: str) -> AsyncIterator[None]:
+        entry = self.locks.get(session_id)
+        if entry is None:
+            entry = self.locks[session_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        self.stats["acquired"] += 1
+        if entry[0].locked():
+            self.stats["waited"] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[session_id]
+
+
+class ResponseCache:
+    """
+    The last `per_session` responses of each of the `max_sessions` most recently active sessions,
+    by client request_id: a retried request gets the reply it missed instead of running again.
+    Held by the web server (SessionLocks serialise a retry behind the original request).
+    """
+
+    def __init__(self, per_session: int = 8, max_sessions: int = 10000):
+        self.per_session = per_session
+        self.max_sessions = max_sessions
+        self.sessions: "OrderedDict[str, OrderedDict[str, tuple]]" = OrderedDict() # Least recently active first
+        self.counters = {"replayed": 0, "stored": 0, "reused_ids": 0}
+
+    def get(self, session_id: str, request_id: str, fingerprint: Any) -> Optional[Any]:
+        """The response sent for `request_id`, if any; ValueError if that id came with a different request."""
+        entries = self.sessions.get(session_id)
+        if entries is None or request_id not in entries:
+            return None
+        seen, response = entries[request_id]
+        if seen != fingerprint:
+            self.counters["reused_ids"] += 1
+            raise ValueError(f"request_id {request_id!r} was already used for a different request")
+        self.counters["replayed"] += 1
+        return response
+
+    def put(self, session_id: str, request_id: str, fingerprint: Any, response: Any) -> None:
+        entries = self.sessions.get(session_id)
+        if entries is None:
+            entries = self.sessions[session_id] = OrderedDict()
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        else:
+            self.sessions.move_to_end(session_id)
+        entries[request_id] = (fingerprint, response)
+        if len(entries) > self.per_session:
+            entries.popitem(last=False)
+        self.counters["stored"] += 1
+
+    @property
+    def stats(self) -> Dict:
+        return {"sessions": len(self.sessions), **self.counters}
+
+
+def decode_state(payload: Union[str, bytes]) -> CaseState:
+    """
+    A stored session: codec.dumps() output, or a row written before the codec (plain JSON,
+    or zlib-compressed JSON).
+    """
+    if isinstance(payload, bytes):
+        if payload[:1] == bytes([codec.MAGIC]):
+            return codec.loads(payload)
+        payload = zlib.decompress(payload).decode()
+    return CaseState(**json.loads(payload, object_hook=_json_object_hook))
+
+
+class SessionStore:
+    """
+    Process-local sessions (nothing survives a restart), at most `capacity` of them, hot or
+    packed: beyond that the least recently used one is dropped, like an idle one, and its id
+    answers drop_reason(). The interface main.py relies on: get / put (after every change, so
+    persistent stores can save it) / existing / drop_reason / close.
+    """
+
+    backend = "memory"
+    COUNTERS = ("hits", "misses", "packed", "inflated", "evicted", "expired")
+
+    def __init__(self, capacity: int = 10000, idle_ttl: float = DEFAULT_IDLE_TTL, sweep_interval: float = 60.0,
+                 pack_after: float = DEFAULT_PACK_AFTER):
+        self.capacity = capacity
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self.pack_after = min(pack_after, idle_ttl)
+        self.sessions: "OrderedDict[str, CaseState]" = OrderedDict() # Least recently used first
+        self.last_seen: Dict[str, float] = {}
+        self.packed: "OrderedDict[str, tuple]" = OrderedDict() # Cold tier: id -> (last seen, packed state), oldest first
+        self.tombstones: "OrderedDict[str, tuple]" = OrderedDict() # Dropped id -> (when, reason), oldest first
+        self.lock = threading.Lock() # Guards the tiers (and subclasses' queues)
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.inflate_seconds = 0.0
+
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._background, name="session-store", daemon=True)
+        self.thread.start()
+
+    # --- Hot tier ---
+    def get(self, session_id: str) -> Optional[CaseState]:
+        now = time.time()
+        with self.lock:
+            state = self.sessions.get(session_id)
+            if state is not None:
+                if now - self.last_seen[session_id] < self.idle_ttl:
+                    self.sessions.move_to_end(session_id)
+                    self.last_seen[session_id] = now
+                    self.counters["hits"] += 1
+                    return state
+                self._drop(session_id, "expired") # Idle past the TTL; the sweeper just has not run yet
+        return self._load(session_id)
+
+    def put(self, session_id: str, state: CaseState) -> None:
+        with self.lock:
+            self._hold(session_id, state)
+
+    def _hold(self, session_id: str, state: CaseState) -> None:
+        self.sessions[session_id] = state
+        self.sessions.move_to_end(session_id)
+        self.last_seen[session_id] = time.time()
+        while len(self.sessions) + len(self.packed) > self.capacity:
+            if self.packed:
+                self._dropped(self.packed.popitem(last=False)[0], "evicted")
+            else:
+                self._drop(next(iter(self.sessions)), "evicted")
+
+    def _drop(self, session_id: str, reason: str) -> None:
+        del self.sessions[session_id]
+        del self.last_seen[session_id]
+        self._dropped(session_id, reason)
+
+    def _dropped(self, session_id: str, reason: str) -> None:
+        """A session left the store ("expired" or "evicted"); here that is the end of it."""
+        self.counters[reason] += 1
+        self.tombstones[session_id] = (time.time(), reason)
+        self.tombstones.move_to_end(session_id)
+        if len(self.tombstones) > MAX_TOMBSTONES:
+            self.tombstones.popitem(last=False)
+
+    def _load(self, session_id: str) -> Optional[CaseState]:
+        """A session that is not hot: inflated from the cold tier, unless it expired there."""
+        with self.lock:
+            entry = self.packed.get(session_id)
+            if entry is None:
+                self.counters["misses"] += 1
+                return None
+            if time.time() - entry[0] >= self.idle_ttl:
+                del self.packed[session_id]
+                self._dropped(session_id, "expired")
+                return None
+        state = self._inflate(entry[1])
+        with self.lock:
+            if self.packed.pop(session_id, None) is None and session_id in self.sessions:
+                return self.sessions[session_id] # Inflated by a concurrent request meanwhile
+            self.counters["inflated"] += 1
+            self._hold(session_id, state)
+        return state
+
+    def _inflate(self, payload: Union[str, bytes]) -> CaseState:
+        started = time.perf_counter()
+        state = decode_state(payload)
+        # Edits saved since the last turn (an upload) are not in the fresh change tracker, so the
+        # step graph must not resume from the cursor: the next turn walks it from the top
+        state.step_cursor = None
+        self.inflate_seconds += time.perf_counter() - started
+        return state
+
+    def existing(self, session_ids: Iterable[str]) -> Set[str]:
+        """Which of `session_ids` already have a session."""
+        with self.lock:
+            return {sid for sid in session_ids if sid in self.sessions or sid in self.packed}
+
+    def drop_reason(self, session_id: str) -> Optional[str]:
+        """Why `session_id`'s session is gone ("expired" or "evicted"), None if it never existed; ask after get() returned None."""
+        with self.lock:
+            tombstone = self.tombstones.get(session_id)
+        return tombstone[1] if tombstone is not None else None
+
+    # --- Background sweeper ---
+    def sweep(self) -> None:
+        """
+        Packs hot sessions idle past `pack_after` and drops those (hot or packed) idle past the
+        TTL. Each tier is walked oldest first and only up to its first session still in use.
+        """
+        now = time.time()
+        with self.lock:
+            idle = []
+            for session_id, state in self.sessions.items():
+                seen = self.last_seen[session_id]
+                if now - seen < self.pack_after:
+                    break
+                idle.append((session_id, state, seen))
+            while self.packed:
+                session_id, (seen, _) = next(iter(self.packed.items()))
+                if now - seen < self.idle_ttl:
+                    break
+                del self.packed[session_id]
+                self._dropped(session_id, "expired")
+            while self.tombstones and now - next(iter(self.tombstones.values()))[0] > TOMBSTONE_TTL:
+                self.tombstones.popitem(last=False)
+        # Packing happens outside the lock; a session used meanwhile (last_seen moved on) stays hot
+        for session_id, state, seen in idle:
+            self._cool(session_id, state, seen, expired=now - seen >= self.idle_ttl)
+
+    def _cool(self, session_id: str, state: CaseState, seen: float, expired: bool) -> None:
+        try:
+            payload = None if expired else codec.dumps(state)
+        except RuntimeError: # A dict field changed size mid-encode: a request has the session, it stays hot
+            return
+        with self.lock:
+            if self.last_seen.get(session_id) != seen:
+                return
+            if expired:
+                self._drop(session_id, "expired")
+                return
+            del self.sessions[session_id]
+            del self.last_seen[session_id]
+            self.packed[session_id] = (seen, payload)
+            self.counters["packed"] += 1
+
+    def tick(self) -> None:
+        self.sweep()
+
+    @property
+    def tick_interval(self) -> float:
+        return self.sweep_interval
+
+    def _background(self) -> None:
+        while not self.stopping.is_set():
+            self.wake.wait(self.tick_interval)
+            self.wake.clear()
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Session store background task failed (will retry): {e}")
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        """Stops the background thread (and persists what is left); call on shutdown."""
+        self.stopping.set()
+        self.wake.set()
+        self.thread.join()
+
+    def _inflate_stats(self) -> Dict:
+        inflated = self.counters.get("inflated", 0) + self.counters.get("loads", 0)
+        return {"inflate_us": round(self.inflate_seconds / inflated * 1e6, 1) if inflated else 0.0}
+
+    @property
+    def stats(self) -> Dict:
+        with self.lock:
+            packed_bytes = sum(len(payload) for _, payload in self.packed.values())
+            return {
+                "backend": self.backend,
+                "live": len(self.sessions) + len(self.packed),
+                "hot": len(self.sessions),
+                "cold": len(self.packed),
+                "cold_bytes_per_session": round(packed_bytes / len(self.packed)) if self.packed else 0,
+                "capacity": self.capacity,
+                "idle_ttl": self.idle_ttl,
+                **self.counters,
+                **self._inflate_stats(),
+            }
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    Hot LRU of CaseState objects (up to `capacity`) in front of a SQLite file; dropping one
+    from memory only unloads it. put() encodes the state and queues it; the background thread
+    flushes the queue every `flush_interval` seconds (sooner once `max_batch` sessions are
+    waiting), one transaction per flush, latest state per session only. Sessions queued or
+    mid-flush are read from the queue, never from a database row that is about to be
+    overwritten. Rows are stored packed, and hot sessions idle past `pack_after` are unloaded
+    ("packed"). A session expires when its row has not been written for `idle_ttl`.
+
+    With `shared` (several workers on one file) there is no write-behind: get() checks the
+    row's revision before trusting a hot copy, and put() is a compare-and-set against the
+    revision the session was loaded at, raising SessionConflict when another worker got there first.
+    """
+
+    backend = "sqlite"
+    COUNTERS = ("hits", "loads", "misses", "packed", "evicted", "expired", "writes", "flushes", "conflicts", "released")
+
+    def __init__(self, path: str, capacity: int = 1000, idle_ttl: float = DEFAULT_IDLE_TTL,
+                 sweep_interval: float = 60.0, pack_after: float = DEFAULT_PACK_AFTER,
+                 flush_interval: float = 0.5, max_batch: int = 500, shared: bool = False):
+        self.path = path
+        self.shared = shared
+        self.loaded_revisions: Dict[str, int] = {} # Shared mode: hot session -> revision of the row it came from
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.next_sweep = 0.0
+
+        self.reader = self._connect()
+        self.writer = self._connect()
+        self.writer.executescript(SCHEMA)
+        if "revision" not in {column[1] for column in self.writer.execute("PRAGMA table_info(sessions)")}:
+            self.writer.execute("ALTER TABLE sessions ADD COLUMN revision INTEGER NOT NULL DEFAULT 0") # Pre-revision files
+        self.read_lock = threading.Lock()
+        self.write_lock = threading.Lock()  # One flush/sweep at a time (background thread or close())
+
+        self.pending: Dict[str, tuple] = {}   # session_id -> (version, payload), not yet written
+        self.inflight: Dict[str, tuple] = {}  # Taken by the flush in progress
+        self.last_flush_ms = 0.0
+        super().__init__(capacity=capacity, idle_ttl=idle_ttl, sweep_interval=sweep_interval, pack_after=pack_after)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL") # WAL + NORMAL: a crash never corrupts, commits stay atomic
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def _dropped(self, session_id: str, reason: str) -> None:
+        # Already encoded into pending (or written) on its last put(); unloading it loses nothing.
+        # Expiry is decided (and counted) on the stored row, by sweep().
+        self.loaded_revisions.pop(session_id, None)
+        if reason != "expired":
+            self.counters[reason] += 1
+
+    def _cool(self, session_id: str, state: CaseState, seen: float, expired: bool) -> None:
+        with self.lock:
+            if self.last_seen.get(session_id) == seen:
+                self._drop(session_id, "expired" if expired else "packed")
+
+    def _load(self, session_id: str) -> Optional[CaseState]:
+        with self.lock:
+            queued = self.pending.get(session_id) or self.inflight.get(session_id)
+        if queued is not None:
+            payload = queued[1]
+        else:
+            with self.read_lock:
+                row = self.reader.execute(
+                    "SELECT state FROM sessions WHERE session_id = ? AND updated_at > ?",
+                    (session_id, time.time() - self.idle_ttl),
+                ).fetchone()
+            if row is None:
+                self.counters["misses"] += 1
+                return None
+            payload = row[0]
+        state = self._inflate(payload)
+        with self.lock:
+            self.counters["loads"] += 1
+            self._hold(session_id, state)
+        return state
+
+    def get(self, session_id: str) -> Optional[CaseState]:
+        if not self.shared:
+            return super().get(session_id)
+        with self.read_lock:
+            row = self.reader.execute(
+                "SELECT revision, state FROM sessions WHERE session_id = ? AND updated_at > ?",
+                (session_id, time.time() - self.idle_ttl),
+            ).fetchone()
+        with self.lock:
+            if row is None:
+                if session_id in self.sessions:
+                    self._drop(session_id, "expired") # Expired (swept) by another worker
+                self.counters["misses"] += 1
+                return None
+            state = self.sessions.get(session_id)
+            if state is not None and self.loaded_revisions.get(session_id) == row[0]:
+                self.sessions.move_to_end(session_id)
+                self.last_seen[session_id] = time.time()
+                self.counters["hits"] += 1
+                return state
+        state = self._inflate(row[1]) # New here, or moved on by another worker
+        with self.lock:
+            self.counters["loads"] += 1
+            self._hold(session_id, state)
+            self.loaded_revisions[session_id] = row[0]
+        return state
+
+    def put(self, session_id: str, state: CaseState) -> None:
+        if self.shared:
+            return self._put_shared(session_id, state)
+        entry = (state.version, codec.dumps(state))
+        with self.lock:
+            self._hold(session_id, state)
+            self.pending[session_id] = entry
+            backlog = len(self.pending)
+        if backlog >= self.max_batch:
+            self.wake.set()
+
+    def _put_shared(self, session_id: str, state: CaseState) -> None:
+        payload = codec.dumps(state)
+        with self.lock:
+            loaded = self.loaded_revisions.get(session_id) if session_id in self.sessions else None
+        with self.write_lock:
+            if loaded is None: # A new session: only if no other worker created it meanwhile
+                cursor = self.writer.execute(
+                    "INSERT INTO sessions (session_id, version, updated_at, state) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(session_id) DO NOTHING",
+                    (session_id, state.version, time.time(), payload),
+                )
+            else:
+                cursor = self.writer.execute(
+                    "UPDATE sessions SET version = ?, updated_at = ?, state = ?, revision = revision + 1 "
+                    "WHERE session_id = ? AND revision = ?",
+                    (state.version, time.time(), payload, session_id, loaded),
+                )
+        with self.lock:
+            if cursor.rowcount != 1:
+                # Our copy carries the turn that lost; forget it so the retry loads the winner's state
+                if session_id in self.sessions:
+                    del self.sessions[session_id]
+                    del self.last_seen[session_id]
+                    self.loaded_revisions.pop(session_id, None)
+                self.counters["conflicts"] += 1
+                raise SessionConflict(session_id)
+            self._hold(session_id, state)
+            self.loaded_revisions[session_id] = 0 if loaded is None else loaded + 1
+            self.counters["writes"] += 1
+
+    def existing(self, session_ids: Iterable[str]) -> Set[str]:
+        found = set()
+        cold = []
+        with self.lock:
+            for sid in session_ids:
+                if sid in self.sessions or sid in self.pending or sid in self.inflight:
+                    found.add(sid)
+                else:
+                    cold.append(sid)
+        for start in range(0, len(cold), SQLITE_MAX_VARIABLES):
+            chunk = cold[start:start + SQLITE_MAX_VARIABLES]
+            query = f"SELECT session_id FROM sessions WHERE session_id IN ({','.join('?' * len(chunk))})"
+            with self.read_lock:
+                found.update(row[0] for row in self.reader.execute(query, chunk))
+        return found
+
+    def drop_reason(self, session_id: str) -> Optional[str]:
+        # Rows are only ever deleted by expiry: evicting a session from the hot LRU just unloads it
+        with self.read_lock:
+            row = self.reader.execute(
+                "SELECT 1 FROM expired_sessions WHERE session_id = ? "
+                "UNION ALL SELECT 1 FROM sessions WHERE session_id = ? AND updated_at <= ?",
+                (session_id, session_id, time.time() - self.idle_ttl),
+            ).fetchone()
+        return "expired" if row is not None else None
+
+    # --- Write-behind ---
+    def flush(self) -> None:
+        """Writes everything queued so far (one transaction)."""
+        with self.write_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                self.inflight, self.pending = self.pending, {}
+            started = time.perf_counter()
+            now = time.time()
+            rows = [(sid, version, now, payload) for sid, (version, payload) in self.inflight.items()]
+            try:
+                self.writer.execute("BEGIN")
+                self.writer.executemany(UPSERT, rows)
+                self.writer.execute("COMMIT")
+            except sqlite3.Error:
+                if self.writer.in_transaction:
+                    self.writer.execute("ROLLBACK")
+                with self.lock:
+                    # Requeue under anything newer that arrived meanwhile, retry next flush
+                    self.pending = {**self.inflight, **self.pending}
+                    self.inflight = {}
+                raise
+            with self.lock:
+                self.inflight = {}
+                self.counters["writes"] += len(rows)
+                self.counters["flushes"] += 1
+            self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+
+    def release(self, keep: Callable[[str], bool]) -> int:
+        """
+        Hands sessions over to another process: writes everything queued, then unloads the hot
+        sessions `keep` rejects, so their next owner loads what this one saved. Returns how many.
+        """
+        self.flush()
+        with self.lock:
+            released = [sid for sid in self.sessions if not keep(sid)]
+            for session_id in released:
+                del self.sessions[session_id]
+                del self.last_seen[session_id]
+                self.loaded_revisions.pop(session_id, None)
+            self.counters["released"] += len(released)
+        return len(released)
+
+    def sweep(self) -> None:
+        """Unloads idle hot sessions, then deletes (and tombstones) rows idle past the TTL."""
+        super().sweep()
+        while True:
+            now = time.time()
+            with self.read_lock:
+                rows = self.reader.execute(
+                    "SELECT session_id FROM sessions WHERE updated_at <= ? LIMIT ?", (now - self.idle_ttl, SWEEP_BATCH)
+                ).fetchall()
+            with self.lock:
+                # A session that was just used is kept; its next put() rewrites the row anyway
+                expired = [(sid, now - self.idle_ttl) for (sid,) in rows
+                           if sid not in self.sessions and sid not in self.pending and sid not in self.inflight]
+            with self.write_lock:
+                self.writer.execute("BEGIN")
+                self.writer.executemany("DELETE FROM sessions WHERE session_id = ? AND updated_at <= ?", expired)
+                self.writer.executemany(
+                    "INSERT OR REPLACE INTO expired_sessions (session_id, expired_at) VALUES (?, ?)",
+                    [(sid, now) for sid, _ in expired],
+                )
+                self.writer.execute("DELETE FROM expired_sessions WHERE expired_at <= ?", (now - TOMBSTONE_TTL,))
+                self.writer.execute("COMMIT")
+            with self.lock:
+                self.counters["expired"] += len(expired)
+            if len(rows) < SWEEP_BATCH or not expired:
+                break
+
+    def tick(self) -> None:
+        self.flush()
+        if time.time() >= self.next_sweep:
+            self.next_sweep = time.time() + self.sweep_interval
+            self.sweep()
+
+    @property
+    def tick_interval(self) -> float:
+        return self.flush_interval
+
+    def close(self) -> None:
+        super().close()
+        self.flush()
+        self.writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.reader.close()
+        self.writer.close()
+
+    @property
+    def stats(self) -> Dict:
+        with self.read_lock:
+            live, stored_bytes = self.reader.execute(
+                "SELECT COUNT(*), AVG(LENGTH(state)) FROM sessions WHERE updated_at > ?", (time.time() - self.idle_ttl,)
+            ).fetchone()
+        with self.lock:
+            return {
+                "backend": self.backend,
+                "path": self.path,
+                "shared": self.shared,
+                "live": live, # Stored and not yet idle past the TTL (a brand-new session counts once flushed)
+                "hot": len(self.sessions),
+                "cold_bytes_per_session": round(stored_bytes or 0),
+                "capacity": self.capacity,
+                "idle_ttl": self.idle_ttl,
+                "queued": len(self.pending) + len(self.inflight),
+                **self.counters,
+                **self._inflate_stats(),
+                "last_flush_ms": self.last_flush_ms,
+            }
+
+
+def get_session_store() -> SessionStore:
+    """
+    Builds the store from the environment: SQLite at SESSION_DB (the default), or
+    SESSION_STORE=memory. SQLite runs in shared mode under several uvicorn workers
+    (WEB_CONCURRENCY > 1) or with SESSION_SHARED=1.
+    """
+    idle_ttl = float(os.getenv("SESSION_IDLE_TTL", str(DEFAULT_IDLE_TTL)))
+    sweep_interval = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+    pack_after = float(os.getenv("SESSION_PACK_AFTER", str(DEFAULT_PACK_AFTER)))
+    if os.getenv("SESSION_STORE", "sqlite") == "memory":
+        return SessionStore(
+            capacity=int(os.getenv("SESSION_MAX", "10000")),
+            idle_ttl=idle_ttl,
+            sweep_interval=sweep_interval,
+            pack_after=pack_after,
+        )
+    return SqliteSessionStore(
+        path=os.getenv("SESSION_DB", "sessions.db"),
+        capacity=int(os.getenv("SESSION_HOT_CAPACITY", "1000")),
+        idle_ttl=idle_ttl,
+        sweep_interval=sweep_interval,
+        pack_after=pack_after,
+        flush_interval=float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5")),
+        max_batch=int(os.getenv("SESSION_MAX_BATCH", "500")),
+        shared=os.getenv("SESSION_SHARED", "0") == "1" or int(os.getenv("WEB_CONCURRENCY", "1")) > 1,
+    )
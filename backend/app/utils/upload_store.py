@@ -0,0 +1,125 @@
+import hashlib
+import os
+import tempfile
+from typing import BinaryIO, Dict, NamedTuple
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+# --- UPLOAD STORE ---
+# Where uploaded reports are kept: a content-addressed directory (UPLOAD_DIR), one file per
+# distinct content, named by its SHA-256 (<root>/ab/abcdef...). An upload is copied in
+# fixed-size chunks from the request's spooled temp file into a staging file under the root
+# while it is hashed (stage). Memory stays at one chunk whatever the file size, and a file over
+# the size limit is abandoned as soon as it crosses it.
+#
+# A staged file only joins the store once a session has entered it in phase2_documents (keep:
+# renamed into place, or dropped if that content is already stored); a file the session turned
+# down - wrong test, duplicate, no such session - is deleted (discard). So every stored file is
+# referenced by some document and nobody can fill the disk with rejected uploads.
+#
+# The copy runs on the thread pool, off the event loop. Sessions refer to stored files by hash
+# (phase2_documents), which is also what a session's duplicate check compares.
+
+DEFAULT_MAX_BYTES = 25 * 1024 * 1024 # A long scanned PDF fits comfortably
+DEFAULT_CHUNK_BYTES = 1024 * 1024
+
+
+class UploadRejected(Exception):
+    """The file cannot be stored (empty, or over the size limit); `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, detail: str, status_code: int):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+class StoredFile(NamedTuple):
+    sha256: str
+    size: int
+    path: str # Where it is kept
+    staged: str # Where it waits until keep() or discard()
+
+
+class UploadStore:
+    """Content-addressed files under `root`, at most `max_bytes` each, copied `chunk_bytes` at a time."""
+
+    def __init__(self, root: str = "uploads", max_bytes: int = DEFAULT_MAX_BYTES, chunk_bytes: int = DEFAULT_CHUNK_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.chunk_bytes = chunk_bytes
+        self.incoming = os.path.join(root, "incoming")
+        os.makedirs(self.incoming, exist_ok=True)
+        self.counters = {"stored": 0, "deduplicated": 0, "discarded": 0, "rejected": 0, "bytes_stored": 0}
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256)
+
+    def _too_large(self) -> UploadRejected:
+        self.counters["rejected"] += 1
+        limit = f"{self.max_bytes / (1024 * 1024):g} MB" if self.max_bytes >= 1024 * 1024 else f"{self.max_bytes} bytes"
+        return UploadRejected(f"The file is larger than the {limit} limit.", 413)
+
+    async def store(self, upload: UploadFile) -> StoredFile:
+        # Starlette counted the part while spooling it: an oversized file is refused without copying it
+        if upload.size is not None and upload.size > self.max_bytes:
+            raise self._too_large()
+        return await run_in_threadpool(self.stage, upload.file)
+
+    def stage(self, source: BinaryIO) -> StoredFile:
+        """Copies `source` into a staging file (blocking); raises UploadRejected. Follow with keep() or discard()."""
+        if source.seekable():
+            source.seek(0)
+        digest = hashlib.sha256()
+        size = 0
+        fd, temp_path = tempfile.mkstemp(dir=self.incoming)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while True:
+                    chunk = source.read(self.chunk_bytes)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise self._too_large()
+                    digest.update(chunk)
+                    out.write(chunk)
+            if not size:
+                self.counters["rejected"] += 1
+                raise UploadRejected("The file is empty.", 422)
+
+            sha256 = digest.hexdigest()
+            return StoredFile(sha256, size, self.path(sha256), temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def keep(self, stored: StoredFile) -> None:
+        """A session references the staged file: moves it into the store."""
+        if os.path.exists(stored.path):
+            self.counters["deduplicated"] += 1
+            os.remove(stored.staged)
+        else:
+            os.makedirs(os.path.dirname(stored.path), exist_ok=True)
+            os.replace(stored.staged, stored.path) # Atomic: a concurrent upload of the same content just replaces it
+            self.counters["stored"] += 1
+            self.counters["bytes_stored"] += stored.size
+
+    def discard(self, stored: StoredFile) -> None:
+        self.counters["discarded"] += 1
+        if os.path.exists(stored.staged):
+            os.remove(stored.staged)
+
+    @property
+    def stats(self) -> Dict:
+        return {"max_bytes": self.max_bytes, **self.counters}
+
+
+def get_upload_store() -> UploadStore:
+    """Builds the store from the environment: UPLOAD_DIR, UPLOAD_MAX_BYTES and UPLOAD_CHUNK_BYTES."""
+    return UploadStore(
+        root=os.getenv("UPLOAD_DIR", "uploads"),
+        max_bytes=int(os.getenv("UPLOAD_MAX_BYTES", str(DEFAULT_MAX_BYTES))),
+        chunk_bytes=int(os.getenv("UPLOAD_CHUNK_BYTES", str(DEFAULT_CHUNK_BYTES))),
+    )
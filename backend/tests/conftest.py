@@ -0,0 +1,23 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.main builds its stores at import: keep them in memory and in a scratch directory
+os.environ.setdefault("SESSION_STORE", "memory")
+os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp(prefix="ivf-uploads-"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+NARRATIVE = (
+    "I am 34 and my husband is 37. We have been married for 8 years and trying for 5 years. "
+    "My periods are irregular, cycles of 35 days. AMH was 1.2 in Jan 2024."
+)
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as client:
+        yield client
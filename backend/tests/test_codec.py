@@ -0,0 +1,40 @@
+from datetime import date
+
+from app.models import codec
+from app.models.case_state import CaseState
+
+FULL = dict(
+    case_id="session_k3j9x2m1a", version=31, phase="PHASE2", intro_shown=True, pending_step="phase2_uploads",
+    step_cursor="phase2_uploads", male_partner_present=True, male_partner_type="Partner", female_age=32, male_age=35,
+    unclear_age_ownership=[32, 35], first_marriage=False, years_married=5.5, years_trying=3.0,
+    pending_duration_value=-1.25, has_prior_pregnancies=True,
+    pregnancy_source="Natural", pregnancy_outcome="Miscarriage",
+    pregnancy_history=[{"source": "Natural", "outcome": "Miscarriage", "year": 2021}, "free text"],
+    menstrual_regularity="Irregular", cycle_length="31–35 days", cycle_predictability=False, menarche_age="13",
+    sexual_difficulty="Sometimes", has_had_treatments=True, treatment_type="IVF", treatments_reviewed=True,
+    ivf_cycles=2, last_ivf_transfer_type="Frozen", last_ivf_outcome="Beta Negative", iui_cycles=3,
+    tests_reviewed=True, tests_done_list=["Hormonal blood tests (AMH, TSH, FSH/LH)", "Ultrasound scans"],
+    male_tests_done_list=["Semen analysis"], semen_analysis_date="March 2025", semen_analysis_result="Abnormal",
+    semen_report_available=False, reported_test_dates={"Ultrasound scans": date(2025, 3, 2), "AMH (own name)": date(1999, 12, 31)},
+    active_date_inquiry="Semen analysis", reports_availability="Some", reports_availability_checked=True,
+    confirmation_status=False,
+    phase2_documents=[{"test_name": "AMH", "filename": "AMH report ✓.pdf", "upload_date": "2025-09-01",
+                       "test_date": date(2025, 1, 10), "validity_status": "Valid", "sha256": "ab" * 32, "size": 183204}],
+    phase2_uploads_complete=True, phase2_verification_complete=True, status="CONFIRMED",
+)
+
+
+def test_every_field_survives_a_round_trip():
+    state = CaseState(**FULL)
+    defaults = CaseState().dict()
+    assert [name for name in CaseState.model_fields if state.dict()[name] == defaults[name]] == []
+    assert codec.loads(codec.dumps(state)).dict() == state.dict()
+
+
+def test_default_state_is_just_the_header():
+    assert codec.dumps(CaseState()) == bytes([codec.MAGIC, codec.SCHEMA_VERSION])
+    assert codec.loads(codec.dumps(CaseState())).dict() == CaseState().dict()
+
+
+def test_every_case_state_field_has_a_tag():
+    assert set(CaseState.model_fields) <= set(codec.FIELDS_V1) | codec.UNSTORED_FIELDS
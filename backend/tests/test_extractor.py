@@ -0,0 +1,92 @@
+from datetime import date
+
+import pytest
+
+from app.engine.extractor import STEP_RULES, extract_clinical_state
+from app.engine.orchestrator import STEPS
+
+
+def test_every_step_has_its_own_rules():
+    assert set(STEP_RULES) == {step.name for step in STEPS}
+
+
+def test_yes_to_the_summary_only_confirms_it():
+    state = {"reports_availability_checked": True}
+    updates = extract_clinical_state("yes, although I am not sure she was 35 then", state, step="confirmation")
+    assert updates == {"confirmation_status": True}
+
+
+@pytest.mark.parametrize("step", ["intro", None])
+def test_not_sure_is_the_partner_status_on_the_role_question(step):
+    updates = extract_clinical_state("Not sure", {}, step=step)
+    assert updates["male_partner_type"] == "Unsure"
+
+
+def test_steps_without_rules_of_their_own_fill_nothing_else():
+    assert extract_clinical_state("I am 34, trying 2 years", {}, step="phase2_summary") == {}
+
+
+AGES = {"female_age": 34, "male_age": 37}
+
+# What extract_clinical_state returned before it became a rule table, with no step pending.
+# Changed on purpose since: "male is N" is anchored on a word boundary (it used to match inside
+# "female is N"), and reported test dates are dates rather than ISO strings.
+BASELINE = [
+    ('I have a husband', {}, {'male_partner_type': 'Partner', 'male_partner_present': True}),
+    ('We are using donor sperm', {}, {'male_partner_type': 'Donor', 'male_partner_present': False}),
+    ('Not sure yet, exploring options', {}, {'male_partner_type': 'Unsure', 'male_partner_present': False}),
+    ('no partner', {}, {}),
+    ('my wife and I', {}, {'male_partner_type': 'Partner', 'male_partner_present': True}),
+    ('I am 34 and my husband is 37', {}, {'male_partner_type': 'Partner', 'male_partner_present': True, 'female_age': 34, 'male_age': 37, 'unclear_age_ownership': []}),
+    ('my age is 34 and husband is 37', {}, {'male_partner_type': 'Partner', 'male_partner_present': True, 'female_age': 34, 'male_age': 37, 'unclear_age_ownership': []}),
+    ("I'm 32, he is 35", {}, {'female_age': 32, 'male_age': 35, 'unclear_age_ownership': []}),
+    ('32 and 35', {}, {'unclear_age_ownership': [32, 35]}),
+    ('32 and 35', {'male_partner_present': False}, {}),
+    ('Female is 30, Male is 33', {}, {'female_age': 30, 'male_age': 33, 'unclear_age_ownership': []}),
+    ('I am 29', {}, {'female_age': 29}),
+    ('he is 41', {}, {'male_age': 41}),
+    ('40', {}, {'female_age': 40}),
+    ('40', {'male_partner_present': False}, {'female_age': 40}),
+    ('40', {'female_age': 33}, {'male_age': 40, 'pending_duration_value': 40.0}),
+    ('me 31 partner 33', {}, {'male_partner_type': 'Partner', 'male_partner_present': True, 'female_age': 31, 'male_age': 33, 'unclear_age_ownership': [], 'cycle_length': 'me 31 partner 33'}),
+    ('the first is mine', {'unclear_age_ownership': [31, 36]}, {'female_age': 31, 'male_age': 36, 'unclear_age_ownership': []}),
+    ('yes', {'pending_step': 'first_marriage'}, {}),
+    ('no, second marriage', {}, {'first_marriage': False}),
+    ('married for 5 years', AGES, {'years_trying': 5.0, 'pending_duration_value': None}),
+    ('6 months', AGES, {'years_trying': 0.5, 'pending_duration_value': None}),
+    ('3 years', AGES, {'years_trying': 3.0, 'pending_duration_value': None}),
+    ('2.5', AGES, {'pending_duration_value': 2.5}),
+    ('never', AGES, {'years_trying': 0.0, 'pending_duration_value': None}),
+    ('trying for 2 years', AGES, {'years_trying': 2.0, 'pending_duration_value': None}),
+    ('not yet', AGES, {'years_trying': 0.0, 'pending_duration_value': None}),
+    ('yes, one miscarriage', AGES, {'first_marriage': True, 'pregnancy_outcome': 'Miscarriage'}),
+    ('natural', AGES, {'pregnancy_source': 'Natural'}),
+    ('it was ectopic', AGES, {'pregnancy_outcome': 'Ectopic'}),
+    ('live birth', AGES, {'pregnancy_outcome': 'Live birth'}),
+    ('regular', AGES, {'menstrual_regularity': 'Regular'}),
+    ('irregular periods', AGES, {'menstrual_regularity': 'Irregular'}),
+    ('26-30 days', AGES, {'cycle_length': '26-30 days'}),
+    ('31 to 35', AGES, {'cycle_length': '31 to 35'}),
+    ('about 28 days', AGES, {}),
+    ('13', AGES, {'pending_duration_value': 13.0}),
+    ('no difficulty', AGES, {'first_marriage': False}),
+    ('sometimes', AGES, {}),
+    ('yes IVF', AGES, {'first_marriage': True, 'has_had_treatments': True, 'treatment_type': 'IVF', 'treatments_reviewed': True}),
+    ('IUI', AGES, {'has_had_treatments': True, 'treatment_type': 'IUI', 'treatments_reviewed': True}),
+    ('3 cycles', AGES, {'iui_cycles': 3}),
+    ('frozen transfer', AGES, {}),
+    ('beta negative', AGES, {}),
+    ('AMH and ultrasound', AGES, {'tests_done_list': ['Ultrasound scans'], 'tests_reviewed': True}),
+    ('semen analysis', AGES, {'male_tests_done_list': ['Semen analysis']}),
+    ('none of the above', AGES, {'tests_done_list': ['None'], 'tests_reviewed': True}),
+    ('yes I have them', AGES, {'first_marriage': True, 'reports_availability': 'Yes', 'reports_availability_checked': True}),
+    ('some of them', AGES, {}),
+    ('yes that is correct', {**AGES, 'reports_availability_checked': True}, {'first_marriage': True, 'confirmation_status': True}),
+    ('Jan 2024', {**AGES, 'active_date_inquiry': 'AMH'}, {'reported_test_dates': {'AMH': date(2024, 1, 1)}}),
+    ('done uploading', AGES, {}),
+]
+
+
+@pytest.mark.parametrize("message, state, expected", BASELINE)
+def test_rule_table_matches_the_original_extractor(message, state, expected):
+    assert extract_clinical_state(message, dict(state)) == expected
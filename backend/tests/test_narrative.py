@@ -0,0 +1,41 @@
+import pytest
+
+from app.engine.narrative import extract_narrative
+
+
+def read(message, **state):
+    return extract_narrative(message, state)
+
+
+@pytest.mark.parametrize("message, female_age, male_age", [
+    ("I am 34, my husband is 37, trying 2 years", 34, 37),
+    ("My son is 10, I am 34, my husband is 37, trying 2 years", 34, 37),
+    ("My daughter is 12, my husband is 40, I'm 38, trying for 3 years", 38, 40),
+    ("I am 37 and my wife is 32, married 5 years, trying for 3 years", 32, 37),
+    ("My wife is 32 and I am 37, married 5 years, trying for 3 years", 32, 37),
+])
+def test_ages_go_to_the_person_the_clause_names(message, female_age, male_age):
+    updates = read(message)
+    assert (updates.get("female_age"), updates.get("male_age")) == (female_age, male_age)
+
+
+def test_wife_names_the_female_partner():
+    assert read("My wife is 31, married 4 years, trying 2 years")["female_age"] == 31
+
+
+def test_clause_about_a_child_assigns_no_age():
+    updates = read("My son is 10, my husband is 37, married 8 years, trying 2 years")
+    assert "female_age" not in updates
+    assert updates["male_age"] == 37
+
+
+def test_short_answers_are_left_to_the_rules():
+    assert read("34") == {}
+    assert read("I am 34, he is 37") == {}
+
+
+def test_reported_tests_leave_the_tests_question_open():
+    updates = read("I am 34, my husband is 37, trying 3 years. AMH done Jan 2024")
+    assert updates["tests_done_list"]
+    assert "reported_test_dates" in updates
+    assert "tests_reviewed" not in updates
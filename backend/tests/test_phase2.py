@@ -0,0 +1,29 @@
+import pytest
+
+from app.engine.phase2 import detect_test_type
+
+
+@pytest.mark.parametrize("filename, test_type", [
+    ("AMH.pdf", "AMH"),
+    ("AMHReport.pdf", "AMH"),
+    ("amhreport.pdf", "AMH"),
+    ("PatientAMHresult.pdf", "AMH"),
+    ("myAMH.pdf", "AMH"),
+    ("HSGReport.pdf", "HSG"),
+    ("LabHSGReport.pdf", "HSG"),
+    ("semenanalysis.pdf", "Semen Analysis"),
+    ("SemenAnalysis.pdf", "Semen Analysis"),
+    ("IMGSemen.pdf", "Semen Analysis"),
+    ("TSHresult.jpg", "TSH"),
+    ("FSH-LH.pdf", "FSH"),
+    ("LHReport.pdf", "LH"),
+    ("AFCcount.pdf", "AFC"),
+    ("Ultrasound_Jan.pdf", "Pelvic Ultrasound"),
+])
+def test_test_type_from_filename(filename, test_type):
+    assert detect_test_type(filename) == test_type
+
+
+@pytest.mark.parametrize("filename", ["document.pdf", "IMG_2034.jpg", "HealthCheck.pdf", "Blood Test.pdf"])
+def test_unrecognised_filename(filename):
+    assert detect_test_type(filename) == "UNKNOWN_TEST"
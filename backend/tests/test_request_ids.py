@@ -0,0 +1,30 @@
+from conftest import NARRATIVE
+
+from app import main
+
+
+def chat(client, session_id, message, request_id):
+    return client.post("/chat", json={"session_id": session_id, "message": message, "request_id": request_id})
+
+
+def test_retried_turn_gets_the_same_reply_without_running_again(client):
+    chat(client, "retried", "hi", "r1")
+    first = chat(client, "retried", NARRATIVE, "r2")
+    version = main.sessions.get("retried").version
+
+    again = chat(client, "retried", NARRATIVE, "r2")
+    assert again.status_code == 200
+    assert again.json() == first.json()
+    assert main.sessions.get("retried").version == version
+
+
+def test_request_id_reused_for_another_message_is_a_422(client):
+    chat(client, "reused", "hi", "r1")
+    response = chat(client, "reused", "I am 34", "r1")
+    assert response.status_code == 422
+    assert "r1" in response.json()["detail"]
+
+
+def test_request_ids_are_per_session(client):
+    chat(client, "one", "hi", "same")
+    assert chat(client, "two", "I am 34", "same").status_code == 200
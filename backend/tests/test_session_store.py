@@ -0,0 +1,114 @@
+import pytest
+
+from app import main
+from app.engine.consultation import SESSION_EVICTED, SESSION_EXPIRED
+from app.models.case_state import CaseState
+from app.utils.session_store import SessionConflict, SessionStore, SqliteSessionStore
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two workers' stores sharing one SQLite file."""
+    path = str(tmp_path / "sessions.db")
+    stores = [SqliteSessionStore(path, sweep_interval=3600, shared=True) for _ in range(2)]
+    yield stores
+    for store in stores:
+        store.close()
+
+
+@pytest.fixture
+def store():
+    store = SessionStore(sweep_interval=3600, pack_after=0)
+    yield store
+    store.close()
+
+
+def test_packing_leaves_the_change_tracker_alone(store):
+    state = CaseState(case_id="s1")
+    state.snapshot()
+    state.female_age = 34 # Not in the cached snapshot yet
+    store.put("s1", state)
+
+    store.sweep()
+
+    assert store.stats["cold"] == 1
+    assert "female_age" in state.__pydantic_private__["_tracker"].stale
+    assert state.snapshot()["female_age"] == 34
+    assert store.get("s1").female_age == 34
+
+
+def test_eviction_and_expiry_are_told_apart(store):
+    store.capacity = 1
+    store.put("old", CaseState(case_id="old"))
+    store.put("new", CaseState(case_id="new"))
+    assert store.get("old") is None
+    assert store.drop_reason("old") == "evicted"
+    assert store.drop_reason("never") is None
+
+    store.idle_ttl = 0
+    assert store.get("new") is None
+    assert store.drop_reason("new") == "expired"
+
+
+def test_chat_says_why_a_session_is_gone(client, monkeypatch):
+    client.post("/chat", json={"session_id": "evicted", "message": "hi"})
+    monkeypatch.setattr(main.sessions, "capacity", 1)
+    client.post("/chat", json={"session_id": "kept", "message": "hi"})
+    response = client.post("/chat", json={"session_id": "evicted", "message": "I am 34"})
+    assert (response.status_code, response.json()["detail"]) == (410, SESSION_EVICTED)
+
+    monkeypatch.setattr(main.sessions, "idle_ttl", 0)
+    response = client.post("/chat", json={"session_id": "kept", "message": "I am 34"})
+    assert (response.status_code, response.json()["detail"]) == (410, SESSION_EXPIRED)
+
+
+def test_shared_put_loses_to_a_newer_write(workers):
+    first, second = workers
+    first.put("s1", CaseState(case_id="s1"))
+    mine, theirs = first.get("s1"), second.get("s1")
+    theirs.female_age = 34
+    second.put("s1", theirs)
+
+    mine.female_age = 40
+    with pytest.raises(SessionConflict):
+        first.put("s1", mine)
+    assert first.get("s1").female_age == 34 # The retry sees the winner's state
+
+
+def test_chat_redoes_a_turn_that_lost_the_race(client, workers, monkeypatch):
+    first, second = workers
+    monkeypatch.setattr(main, "sessions", first)
+    client.post("/chat", json={"session_id": "raced", "message": "hi"})
+
+    get = first.get
+    def racing_get(session_id):
+        state = get(session_id)
+        if not first.counters["conflicts"]: # Another worker saves the session mid-turn, once
+            theirs = second.get(session_id)
+            theirs.male_age = 37
+            second.put(session_id, theirs)
+        return state
+    monkeypatch.setattr(first, "get", racing_get)
+
+    response = client.post("/chat", json={"session_id": "raced", "message": "I am 34"})
+    assert response.status_code == 200
+    assert first.counters["conflicts"] == 1
+    assert second.get("raced").male_age == 37
+
+
+def test_seeding_an_id_another_worker_just_created_is_a_409(client, workers, monkeypatch):
+    first, second = workers
+    monkeypatch.setattr(main, "sessions", first)
+    second.put("taken", CaseState(case_id="taken", female_age=40))
+    monkeypatch.setattr(first, "existing", lambda session_ids: set()) # It checked just before the other worker wrote
+
+    forms = [{"session_id": "before"}, {"session_id": "taken"}, {"session_id": "after"}]
+    response = client.post("/sessions", json={"sessions": forms})
+    assert response.status_code == 409
+    assert "taken" in response.json()["detail"]
+    # The sessions that were created are returned, so the client does not retry them
+    created = response.json()["sessions"]
+    assert [session["session_id"] for session in created] == ["before", "after"]
+    assert all(session["reply"] for session in created)
+    assert second.existing(["before", "taken", "after"]) == {"before", "taken", "after"}
+    assert second.get("taken").female_age == 40 # The other worker's session is left alone
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from app import main
+
+
+def stored_files():
+    """Files kept in the upload store, and files still waiting in its staging area."""
+    kept = [name for folder, _, names in os.walk(main.uploads.root) if folder != main.uploads.incoming for name in names]
+    return sorted(kept), os.listdir(main.uploads.incoming)
+
+
+@pytest.fixture
+def session(client, request):
+    """A session whose history mentions hormonal tests (AMH uploads are accepted, HSG ones are not)."""
+    session_id = request.node.name
+    client.post("/chat", json={"session_id": session_id, "message": "hi"})
+    main.sessions.get(session_id).tests_done_list = ["Hormonal blood tests (AMH, TSH, FSH/LH)"]
+    before = stored_files()
+    yield session_id
+    assert stored_files()[1] == [] # Nothing left behind in staging
+    assert before[1] == []
+
+
+def upload(client, session_id, filename, body, **data):
+    return client.post("/upload", data={"session_id": session_id, **data}, files={"file": (filename, body)})
+
+
+def test_accepted_report_is_kept_once_by_content(client, session):
+    before, _ = stored_files()
+    response = upload(client, session, "AMH.pdf", b"amh report 1")
+    assert response.json()["status"] == "success"
+    again = upload(client, session, "AMH copy.pdf", b"amh report 1").json()
+    assert again["duplicate"] is True
+    kept, _ = stored_files()
+    assert len(kept) == len(before) + 1
+    assert [d["filename"] for d in main.sessions.get(session).phase2_documents] == ["AMH.pdf"]
+
+
+@pytest.mark.parametrize("filename, reason", [
+    ("document.pdf", "could not identify"),
+    ("HSG.pdf", "not mentioned in your history"),
+])
+def test_report_the_session_turns_down_is_not_kept(client, session, filename, reason):
+    before = stored_files()
+    response = upload(client, session, filename, b"turned down " + filename.encode())
+    assert response.json()["status"] == "error" and reason in response.json()["message"]
+    assert stored_files() == before
+
+
+def test_upload_to_a_missing_session_is_not_kept(client):
+    before = stored_files()
+    response = upload(client, "no-such-session", "AMH.pdf", b"orphan")
+    assert response.status_code == 404
+    assert stored_files() == before
+
+
+def test_oversized_and_empty_files_are_refused(client, session, monkeypatch):
+    monkeypatch.setattr(main.uploads, "max_bytes", 10)
+    before = stored_files()
+    assert upload(client, session, "AMH.pdf", b"x" * 11).status_code == 413
+    assert upload(client, session, "AMH.pdf", b"").status_code == 422
+    assert stored_files() == before
+
+
+def test_batch_keeps_only_what_the_session_took(client, session):
+    before, _ = stored_files()
+    files = [("files", ("AMH.pdf", b"batch amh")), ("files", ("AMH 2.pdf", b"batch amh")),
+             ("files", ("HSG.pdf", b"batch hsg")), ("files", ("document.pdf", b"batch document"))]
+    results = client.post("/upload/batch", data={"session_id": session}, files=files).json()["results"]
+    assert [(r["filename"], r["status"], r.get("duplicate", False)) for r in results] == [
+        ("AMH.pdf", "success", False), ("AMH 2.pdf", "success", True), ("HSG.pdf", "error", False), ("document.pdf", "error", False),
+    ]
+    kept, _ = stored_files()
+    assert len(kept) == len(before) + 1
+
+
+def test_retried_upload_gets_the_same_result_and_is_entered_once(client, session):
+    first = upload(client, session, "AMH.pdf", b"amh retried", request_id="u1")
+    again = upload(client, session, "AMH.pdf", b"amh retried", request_id="u1")
+    assert again.json() == first.json()
+    assert "duplicate" not in again.json()
+    assert len(main.sessions.get(session).phase2_documents) == 1
+    assert upload(client, session, "FSH.pdf", b"fsh", request_id="u1").status_code == 422
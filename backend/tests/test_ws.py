@@ -0,0 +1,39 @@
+from conftest import NARRATIVE
+
+
+def chat(ws, message, request_id=None):
+    ws.send_json({"type": "chat", "message": message, "request_id": request_id})
+    question = ws.receive_json()
+    assert question["type"] == "question", question
+    return question, ws.receive_json()
+
+
+def test_turn_sends_question_then_state(client):
+    with client.websocket_connect("/ws/ws-turn") as ws:
+        question, state = chat(ws, "hi")
+        assert question["reply"]
+        assert state["type"] == "state" and state["state"]["case_id"] == "ws-turn"
+        question, state = chat(ws, "Female and male partner")
+        assert state["state"] is None and state["version"] == 2
+        assert {"op": "replace", "path": "/version", "value": 2} in state["state_patch"]
+
+
+def test_answered_dates_are_sent_as_iso_strings(client):
+    with client.websocket_connect("/ws/ws-dates") as ws:
+        chat(ws, "hi")
+        chat(ws, "Female and male partner")
+        question, state = chat(ws, NARRATIVE)
+        patch = {op["path"]: op["value"] for op in state["state_patch"]}
+        assert "2024-01-01" in patch["/reported_test_dates"].values()
+        question, state = chat(ws, "hi") # The connection survived
+        assert state["type"] == "state"
+
+
+def test_malformed_frames_get_an_error_and_keep_the_connection(client):
+    with client.websocket_connect("/ws/ws-errors") as ws:
+        for frame in ["not json", '{"type": "chat", "message": 5}', '{"type": "chat", "message": "hi", "request_id": 7}']:
+            ws.send_text(frame)
+            error = ws.receive_json()
+            assert error["type"] == "error" and error["status"] == 422
+        question, state = chat(ws, "hi")
+        assert state["version"] == 1
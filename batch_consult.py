@@ -0,0 +1,166 @@
+"""
+Replays recorded consultations offline, the way /chat and /upload would have answered them,
+on a pool of worker processes: for nightly regression checks and analytics.
+
+    python batch_consult.py conversations.jsonl -o results.jsonl
+    python batch_consult.py conversations.jsonl --workers 8 --replies > results.jsonl
+
+Each input line is one conversation; "messages" holds the patient's chat messages in order,
+and an {"upload": filename} item where a report was uploaded:
+
+    {"id": "c1", "messages": ["Hi", "I am 32 and my husband is 35", {"upload": "AMH Report.pdf"}, "Done uploading"]}
+
+Each output line (same order) has the final case state, the Section A summary and the validity
+of every uploaded report ({"id", "error"} instead if the conversation could not be replayed):
+
+    {"id": "c1", "turns": 4, "state": {...}, "section_a": "...", "validity": [...]}
+
+Conversations are streamed through the pool with a bounded number in flight, so memory stays
+flat however large the input file is.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from datetime import date
+from typing import Dict, Iterable, Iterator, Optional
+
+# Add backend to path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+
+from app.engine.consultation import attach_document
+from app.engine.phase2 import check_validity
+from app.engine.summary import generate_section_a
+from app.engine.turn import take_turn
+from app.models.case_state import CaseState
+
+IN_FLIGHT_PER_WORKER = 4 # Chunks queued per worker: keeps every worker busy without reading ahead further
+
+
+class OneSession:
+    """The session store attach_document() expects, holding the one conversation being replayed."""
+
+    def __init__(self, state: CaseState):
+        self.state = state
+
+    def get(self, session_id: str) -> Optional[CaseState]:
+        return self.state
+
+    def put(self, session_id: str, state: CaseState) -> None:
+        self.state = state
+
+    def drop_reason(self, session_id: str) -> Optional[str]:
+        return None
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def replay(conversation: Dict, replies: bool = False) -> Dict:
+    """One conversation through the same turn functions as /chat and /upload (without the LLM tier)."""
+    session_id = str(conversation["id"])
+    state = CaseState(case_id=session_id)
+    store = OneSession(state)
+    said = []
+    for message in conversation["messages"]:
+        if isinstance(message, dict):
+            said.append(attach_document(store, session_id, message["upload"])["message"])
+            continue
+        tier, seconds, updates, reply = take_turn(state, message)
+        state.commit()
+        said.append(reply.text)
+
+    result = {
+        "id": conversation["id"],
+        "turns": len(conversation["messages"]),
+        "state": state.snapshot(),
+        "section_a": generate_section_a(state),
+        "validity": [
+            {**doc, "validity_status": check_validity(doc["test_name"], doc["test_date"])}
+            for doc in state.phase2_documents
+        ],
+    }
+    if replies:
+        result["replies"] = said
+    return result
+
+
+def _replay_line(line: str, replies: bool) -> str:
+    """Worker side: JSON in, JSON out, so parsing and encoding are spread over the pool too."""
+    conversation = None
+    try:
+        conversation = json.loads(line)
+        result = replay(conversation, replies)
+    except Exception as e:
+        result = {"id": conversation.get("id") if isinstance(conversation, dict) else None, "error": f"{type(e).__name__}: {e}"}
+    return json.dumps(result, default=_json_default, ensure_ascii=False)
+
+
+def _replay_chunk(args) -> list:
+    lines, replies = args
+    return [_replay_line(line, replies) for line in lines]
+
+
+def _quiet_worker() -> None:
+    # The engine prints diagnostics ("Extraction Error: ..."); keep them out of the JSONL on stdout
+    sys.stdout = sys.stderr
+
+
+def _chunks(lines: Iterable[str], size: int, replies: bool, slots: threading.Semaphore) -> Iterator:
+    chunk = []
+    for line in lines:
+        if line.strip():
+            chunk.append(line)
+        if len(chunk) == size:
+            slots.acquire() # Released once the chunk's results are written
+            yield chunk, replies
+            chunk = []
+    if chunk:
+        slots.acquire()
+        yield chunk, replies
+
+
+def run(lines: Iterable[str], out, workers: int, chunk_size: int, replies: bool) -> int:
+    """Replays every conversation in `lines`, writing results to `out` in input order; returns how many."""
+    # Pool.imap() would otherwise pull the whole input into its task queue up front
+    slots = threading.Semaphore(workers * IN_FLIGHT_PER_WORKER)
+    done = 0
+    with multiprocessing.Pool(workers, initializer=_quiet_worker) as pool:
+        for results in pool.imap(_replay_chunk, _chunks(lines, chunk_size, replies, slots)):
+            out.write("\n".join(results) + "\n")
+            done += len(results)
+            slots.release()
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded consultations (JSONL) offline")
+    parser.add_argument("input", help="JSONL file of conversations ('-' for stdin)")
+    parser.add_argument("-o", "--output", help="JSONL file for the results (default: stdout)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=16, help="Conversations per task sent to a worker")
+    parser.add_argument("--replies", action="store_true", help="Also output every reply, in order")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    out = sys.stdout if args.output is None else open(args.output, "w", encoding="utf-8")
+    started = time.perf_counter()
+    try:
+        done = run(source, out, args.workers, args.chunk_size, args.replies)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+    print(f"{done} conversations in {elapsed:.1f}s ({done / elapsed if elapsed else 0:.0f}/s, {args.workers} workers)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
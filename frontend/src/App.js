@@ -1,21 +1,81 @@
 import React, { useState, useEffect, useRef } from 'react';
 
+// Applies the server's JSON-patch ops (RFC 6902, top-level "replace"/"add"/"remove") to our copy of the case state
+const applyStatePatch = (state, ops) => {
+  const next = { ...state };
+  ops.forEach(({ op, path, value }) => {
+    const key = path.slice(1).replace(/~1/g, '/').replace(/~0/g, '~');
+    if (op === 'remove') delete next[key];
+    else next[key] = value;
+  });
+  return next;
+};
+
+const newSessionId = () => {
+  const id = 'session_' + Math.random().toString(36).substr(2, 9);
+  localStorage.setItem('ivf_session_id', id);
+  return id;
+};
+
+const newRequestId = () => 'req_' + Date.now().toString(36) + Math.random().toString(36).substr(2, 9);
+
+// Retries a request that never got an answer (network error); the request_id in it lets the
+// server hand back the reply it already sent instead of running the request twice
+const postWithRetry = async (url, options, attempts = 3) => {
+  for (let attempt = 1; ; attempt++) {
+    try {
+      return await fetch(url, { method: 'POST', ...options });
+    } catch (err) {
+      if (attempt >= attempts) throw err;
+      await new Promise((resolve) => setTimeout(resolve, 500 * attempt));
+    }
+  }
+};
+
 function App() {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState("");
   const [sessionId, setSessionId] = useState("");
   const [isLoading, setIsLoading] = useState(false);
+  const caseStateRef = useRef(null); // Our copy of the case state, kept in step with the server
+  const stateVersionRef = useRef(null); // Version of that copy; the server only sends what changed since
+  const socketRef = useRef(null); // Open /ws connection of this session (none: turns go to POST /chat)
+  const pendingRef = useRef(null); // Turn sent on the socket and not answered yet
+  const ownUploadsRef = useRef(new Set()); // request_ids of our uploads, already shown from the POST reply
   const messagesEndRef = useRef(null);
 
   useEffect(() => {
-    let storedId = localStorage.getItem('ivf_session_id');
-    if (!storedId) {
-      storedId = 'session_' + Math.random().toString(36).substr(2, 9);
-      localStorage.setItem('ivf_session_id', storedId);
-    }
-    setSessionId(storedId);
+    setSessionId(localStorage.getItem('ivf_session_id') || newSessionId());
   }, []);
 
+  // One connection per session: turns and their state deltas, plus reports uploaded to the session
+  useEffect(() => {
+    if (!sessionId) return;
+    const version = stateVersionRef.current;
+    const socket = new WebSocket(`ws://localhost:8000/ws/${sessionId}` + (version != null ? `?state_version=${version}` : ''));
+    socket.onopen = () => { socketRef.current = socket; };
+    socket.onmessage = (event) => handleFrame(JSON.parse(event.data));
+    socket.onclose = () => {
+      if (socketRef.current === socket) socketRef.current = null;
+      // Dropped mid-turn: ask over HTTP instead; the same request_id gets the reply if the turn already ran
+      const pending = pendingRef.current;
+      if (pending && pending.socket === socket) {
+        pendingRef.current = null;
+        postChat(pending.message, pending.requestId);
+      }
+    };
+    return () => socket.close();
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [sessionId]);
+
+  // The server expired our session (410): carry on under a fresh one, starting from scratch
+  const restartExpiredSession = (detail) => {
+    setSessionId(newSessionId());
+    caseStateRef.current = null;
+    stateVersionRef.current = null;
+    setMessages((prev) => [...prev, { role: 'bot', content: detail }]);
+  };
+
   const [currentSelections, setCurrentSelections] = useState([]);
 
   useEffect(() => {
@@ -40,6 +100,57 @@ function App() {
     sendMessage(joined);
   };
 
+  // Full state when our copy could not be patched (first turn, server restart), otherwise a patch
+  const updateCaseState = (data) => {
+    if (data.state) {
+      caseStateRef.current = data.state;
+    } else if (data.state_patch) {
+      caseStateRef.current = applyStatePatch(caseStateRef.current, data.state_patch);
+    }
+    stateVersionRef.current = data.version;
+  };
+
+  const showReply = (data) => {
+    // Detect if it is a summary message for special styling
+    const isSummary = data.reply.includes("Section A: My Understanding");
+
+    const botMsg = {
+      role: 'bot',
+      content: data.reply,
+      options: data.options || [],
+      multi_select: data.multi_select || false,
+      isSummary: isSummary
+    };
+
+    setMessages((prev) => [...prev, botMsg]);
+  };
+
+  const showUploadResult = (data) => {
+    if (data.status === 'success') {
+      setMessages(prev => [...prev, { role: 'bot', content: data.message }]);
+    } else {
+      setMessages(prev => [...prev, { role: 'bot', content: `Error: ${data.message}` }]);
+    }
+  };
+
+  const handleFrame = (frame) => {
+    if (frame.type === 'question') {
+      pendingRef.current = null;
+      showReply(frame);
+      setIsLoading(false);
+    } else if (frame.type === 'state') {
+      updateCaseState(frame);
+    } else if (frame.type === 'upload') {
+      // Someone else's upload (another tab or device); ours was shown from the POST reply
+      if (!ownUploadsRef.current.has(frame.request_id)) showUploadResult(frame);
+    } else if (frame.type === 'error') {
+      pendingRef.current = null;
+      setIsLoading(false);
+      if (frame.status === 410) restartExpiredSession(frame.detail);
+      else setMessages((prev) => [...prev, { role: 'bot', content: frame.detail }]);
+    }
+  };
+
   const sendMessage = async (textOverride = null) => {
     const textToSend = textOverride || input;
     if (!textToSend.trim()) return;
@@ -50,27 +161,35 @@ function App() {
     setCurrentSelections([]); // Clear selections on send
     setIsLoading(true);
 
+    const requestId = newRequestId();
+    const socket = socketRef.current;
+    if (socket && socket.readyState === WebSocket.OPEN) {
+      pendingRef.current = { message: textToSend, requestId, socket };
+      socket.send(JSON.stringify({ type: 'chat', message: textToSend, request_id: requestId }));
+      return; // Answered by the socket's "question" and "state" frames
+    }
+    await postChat(textToSend, requestId);
+  };
+
+  const postChat = async (textToSend, requestId) => {
     try {
-      const response = await fetch('http://localhost:8000/chat', {
-        method: 'POST',
+      const response = await postWithRetry('http://localhost:8000/chat', {
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ session_id: sessionId, message: textToSend })
+        body: JSON.stringify({
+          session_id: sessionId,
+          message: textToSend,
+          state_version: stateVersionRef.current,
+          request_id: requestId
+        })
       });
+      if (response.status === 410) {
+        restartExpiredSession((await response.json()).detail);
+        return;
+      }
 
       const data = await response.json();
-
-      // Detect if it is a summary message for special styling
-      const isSummary = data.reply.includes("Section A: My Understanding");
-
-      const botMsg = {
-        role: 'bot',
-        content: data.reply,
-        options: data.options || [],
-        multi_select: data.multi_select || false,
-        isSummary: isSummary
-      };
-
-      setMessages((prev) => [...prev, botMsg]);
+      updateCaseState(data);
+      showReply(data);
     } catch (err) {
       console.error(err);
       setMessages((prev) => [...prev, { role: 'bot', content: "Error connecting to server." }]);
@@ -79,27 +198,34 @@ function App() {
     }
   };
 
+  // All the selected reports in one request; the server answers for each file
   const handleFileUpload = async (e) => {
-    const file = e.target.files[0];
-    if (!file) return;
+    const files = Array.from(e.target.files);
+    e.target.value = ''; // Selecting the same files again still fires onChange
+    if (files.length === 0) return;
 
     setIsLoading(true);
     const formData = new FormData();
     formData.append('session_id', sessionId);
-    formData.append('file', file);
+    files.forEach((file) => formData.append('files', file));
+    const requestId = newRequestId();
+    formData.append('request_id', requestId);
+    ownUploadsRef.current.add(requestId);
 
     try {
-      const response = await fetch('http://localhost:8000/upload', {
-        method: 'POST',
-        body: formData
-      });
+      const response = await postWithRetry('http://localhost:8000/upload/batch', { body: formData });
+      if (response.status === 410) {
+        restartExpiredSession((await response.json()).detail);
+        return;
+      }
       const data = await response.json();
-
-      if (data.status === 'success') {
-        setMessages(prev => [...prev, { role: 'bot', content: data.message }]);
-      } else {
-        setMessages(prev => [...prev, { role: 'bot', content: `Error: ${data.message}` }]);
+      if (!response.ok) {
+        showUploadResult({ status: 'error', message: data.detail });
+        return;
       }
+      data.results.forEach((result) => showUploadResult(
+        files.length > 1 ? { ...result, message: `${result.filename}: ${result.message}` } : result
+      ));
     } catch (error) {
       console.error("Upload error:", error);
       setMessages(prev => [...prev, { role: 'bot', content: "Failed to upload file." }]);
@@ -191,7 +317,7 @@ function App() {
                  For now, a permanent paperclip icon.
              */}
             <label className="upload-btn" title="Upload Report">
-              <input type="file" onChange={handleFileUpload} style={{ display: 'none' }} accept=".pdf,.jpg,.jpeg,.png" />
+              <input type="file" multiple onChange={handleFileUpload} style={{ display: 'none' }} accept=".pdf,.jpg,.jpeg,.png" />
               <svg width="24" height="24" viewBox="0 0 24 24" fill="none" stroke="currentColor" strokeWidth="2" strokeLinecap="round" strokeLinejoin="round">
                 <path d="M21.44 11.05l-9.19 9.19a6 6 0 0 1-8.49-8.49l9.19-9.19a4 4 0 0 1 5.66 5.66l-9.2 9.19a2 2 0 0 1-2.83-2.83l8.49-8.48"></path>
               </svg>